@@ -19,6 +19,32 @@ migrate = Migrate()
 csrf = CSRFProtect()
 mail = Mail()
 
+# أعمدة أضيفت بترحيلات لا ينشئها create_all في الجداول الموجودة
+MIGRATED_COLUMNS = {
+    'salla_orders': ('shipping_policy_thumbnail',)
+}
+
+def check_pending_migrations(app):
+    """إيقاف تشغيل الخادم إن كانت قاعدة البيانات تنقصها أعمدة الترحيلات (flask db upgrade)"""
+    from sqlalchemy import inspect
+
+    inspector = inspect(db.engine)
+    missing = [
+        f"{table}.{column}"
+        for table, columns in MIGRATED_COLUMNS.items()
+        for column in columns
+        if column not in {c['name'] for c in inspector.get_columns(table)}
+    ]
+    if not missing:
+        return
+
+    message = f"أعمدة ناقصة في قاعدة البيانات: {', '.join(missing)} - شغّل: flask db upgrade"
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        # أوامر flask (ومنها db upgrade نفسه) تعمل مع تحذير فقط
+        app.logger.warning(f"⚠️ {message}")
+        return
+    raise RuntimeError(message)
+
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
@@ -61,6 +87,7 @@ def create_app():
     with app.app_context():
         from . import models
         db.create_all()
+        check_pending_migrations(app)
    
     # استيراد الوظائف المطلوبة
     from .token_utils import refresh_salla_token
@@ -100,6 +127,67 @@ def create_app():
     from .services.storage_service import do_storage
     do_storage.init_app(app)
     app.storage_service = do_storage  # إرفاق خدمة التخزين بالتطبيق
+
+    # مخزن رموز QR الثابت (ذاكرة + قرص + رفع واحد لكل طلب)
+    from .services.qr_store import qr_store
+    qr_store.init_app(app)
+
+    # توليد QR في الخلفية للطلبات الجديدة
+    from .services.qr_pregen import qr_pregen
+    qr_pregen.init_app(app)
+
+    # QR كـ SVG مضمّن في قوالب الطباعة: {{ order.id|qr_svg('barcode-image') }}
+    from markupsafe import Markup
+    app.jinja_env.filters['qr_svg'] = lambda value, css_class=None: Markup(qr_store.svg(value, css_class))
+
+    # ذاكرة البيانات المرجعية (الحالات والموظفين) لكل متجر
+    from .services.reference_cache import reference_cache
+    reference_cache.init_app(app)
+
+    # ناقل إبطال الذاكرة المؤقتة بين العمال (LISTEN/NOTIFY)
+    from .services.invalidation_bus import invalidation_bus
+    invalidation_bus.init_app(app)
+    invalidation_bus.subscribe(reference_cache.invalidate, on_state_change=reference_cache.on_bus_state)
+
+    # بث تغييرات الطلبات للصفحات المفتوحة (SSE)
+    from .services.order_events import order_events
+    order_events.init_app(app)
+
+    # ذاكرة صور المنتجات المصغرة للطباعة
+    from .services.print_image_cache import print_image_cache
+    print_image_cache.init_app(app)
+
+    # ذاكرة صور /proxy-image ونسخها المصغرة
+    from .services.image_proxy_cache import image_proxy_cache
+    image_proxy_cache.init_app(app)
+
+    # ذاكرة ملفات بوالص الشحن
+    from .services.shipping_policy_cache import shipping_policy_cache
+    shipping_policy_cache.init_app(app)
+
+    # تطبيع صور البواليص المرفوعة في الخلفية
+    from .services.policy_image_pipeline import policy_image_pipeline
+    policy_image_pipeline.init_app(app)
+
+    # خدمة توليد PDF عبر مجموعة عمليات
+    from .services.pdf_render_service import pdf_render_service
+    pdf_render_service.init_app(app)
+
+    # تقسيم ملفات بواليص شركات الشحن ومطابقتها بالطلبات
+    from .services.carrier_pdf_ingest import carrier_pdf_ingest
+    carrier_pdf_ingest.init_app(app)
+
+    # أمر قياس أداء الطباعة: flask benchmark-print
+    from .services.print_context import register_print_commands
+    register_print_commands(app)
+
+    # تنظيف الكائنات غير المستخدمة من التخزين: flask storage-gc [--delete]
+    from .services.storage_gc import register_storage_commands
+    register_storage_commands(app)
+
+    # ذاكرة صفحات الطباعة لكل طلب
+    from .services.print_fragment_cache import print_fragment_cache
+    print_fragment_cache.init_app(app)
     
     @app.after_request
     def add_security_headers(response):
@@ -154,6 +242,9 @@ def create_app():
             response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
             response.headers['Pragma'] = 'no-cache'
             response.headers['Expires'] = '0'
+        elif response.is_streamed and 'Cache-Control' in response.headers:
+            # الاستجابات المتدفقة (SSE والتصدير) تحدد سياسة التخزين بنفسها
+            pass
         else:
             # اسمح للمتصفح الخاص بالمستخدم فقط بتخزين الصفحة
             response.headers['Cache-Control'] = 'private, max-age=3600'
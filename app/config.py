@@ -36,11 +36,78 @@ class Config:
 
     # إعدادات الأداء المحسنة لـ PDF والطباعة
     MAX_WORKERS = 10
-    PDF_GENERATION_WORKERS = 10
+    # عدد عمال gunicorn: WEB_CONCURRENCY يقرؤه Procfile أيضاً
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 2))
+    # عمليات WeasyPrint لكل عامل gunicorn (وليس للخادم كله): الأنوية مقسمة على العمال،
+    # ومجموعة CARRIER_PDF_WORKERS منفصلة عنها ولكل عامل أيضاً
+    PDF_GENERATION_WORKERS = int(os.environ.get(
+        'PDF_GENERATION_WORKERS', max(1, (os.cpu_count() or 1) // max(1, WEB_CONCURRENCY))
+    ))
+    PDF_JOBS_DIR = os.environ.get('PDF_JOBS_DIR', '/tmp/pdf_jobs')
+    PDF_JOB_TTL = 3600  # مدة الاحتفاظ بملفات المهام بالثواني
+    PDF_CHUNK_SIZE = int(os.environ.get('PDF_CHUNK_SIZE', 50))  # عدد الطلبات في كل جزء يُولد بشكل مستقل
+    PDF_RENDER_TIMEOUT = 300
+
+    # ذاكرة صفحات PDF المولدة لكل طلب (إعادة الطباعة دون إعادة التوليد)
+    # معطلة افتراضياً لأنها تغيّر شكل الطباعة: كل طلب يبدأ صفحة جديدة بدلاً من عدة طلبات في الصفحة،
+    # فيزيد عدد الأوراق وحجم الملف (الخطوط تُضمّن لكل طلب). تفعيلها مقابل سرعة إعادة الطباعة فقط
+    PRINT_FRAGMENT_CACHE_ENABLED = os.environ.get('PRINT_FRAGMENT_CACHE_ENABLED', 'False').lower() == 'true'
+    PRINT_FRAGMENT_CACHE_DIR = os.environ.get('PRINT_FRAGMENT_CACHE_DIR', '/tmp/print_fragments')
+    PRINT_FRAGMENT_CACHE_MAX_MB = int(os.environ.get('PRINT_FRAGMENT_CACHE_MAX_MB', 512))
+
+    # صور المنتجات المصغرة لمقاس الطباعة (تُستبدل بـ image_cache_dir في WEASYPRINT_OPTIONS إن وجد)
+    PRINT_IMAGE_CACHE_DIR = os.environ.get('PRINT_IMAGE_CACHE_DIR', '/tmp/weasyprint_cache')
+    PRINT_IMAGE_MAX_PX = 360  # أقصى بعد للصورة بالبكسل (حوالي 300dpi لعرض 110px)
+    PRINT_IMAGE_FETCH_WORKERS = 8
+
+    # ذاكرة /proxy-image على القرص (LRU) مع إعادة التحقق من المصدر بعد المدة المحددة
+    IMAGE_PROXY_CACHE_DIR = os.environ.get('IMAGE_PROXY_CACHE_DIR', '/tmp/image_proxy')
+    IMAGE_PROXY_CACHE_MAX_MB = int(os.environ.get('IMAGE_PROXY_CACHE_MAX_MB', 256))
+    IMAGE_PROXY_REVALIDATE_SECONDS = 86400
+
+    # ذاكرة بوالص الشحن على القرص (LRU) مع حد أقصى للتحميلات المتزامنة من المصدر
+    SHIPPING_POLICY_CACHE_DIR = os.environ.get('SHIPPING_POLICY_CACHE_DIR', '/tmp/shipping_policies')
+    SHIPPING_POLICY_CACHE_MAX_MB = int(os.environ.get('SHIPPING_POLICY_CACHE_MAX_MB', 512))
+    SHIPPING_POLICY_FETCH_WORKERS = int(os.environ.get('SHIPPING_POLICY_FETCH_WORKERS', 4))
+
+    # مخزن رموز QR الثابت (رفع واحد لكل طلب)
+    QR_CACHE_DIR = os.environ.get('QR_CACHE_DIR', '/tmp/qr_codes')
+    QR_MEMORY_CACHE_SIZE = 5000
+    # svg: رسم QR داخل قوالب الطباعة مباشرة، url: صورة PNG مستضافة
+    PRINT_QR_MODE = os.environ.get('PRINT_QR_MODE', 'svg')
+    # توليد QR في الخلفية عند استلام الطلبات (Webhook والمزامنة)
+    QR_PREGEN_ENABLED = os.environ.get('QR_PREGEN_ENABLED', 'True').lower() == 'true'
+    QR_PREGEN_BATCH_SIZE = 100
+    QR_PREGEN_WORKERS = int(os.environ.get('QR_PREGEN_WORKERS', 4))
+    QR_PREGEN_QUEUE_SIZE = 10000
     REQUEST_TIMEOUT = 15
     PDF_JPEG_QUALITY = 80
     PDF_OPTIMIZE_SIZE = True
     BARCODE_GENERATION_WORKERS = 5
+
+    # مدة صلاحية البيانات المرجعية (الحالات والموظفين) بالثواني
+    REFERENCE_CACHE_TTL = int(os.environ.get('REFERENCE_CACHE_TTL', 300))
+
+    # ناقل إبطال الذاكرة المؤقتة بين العمال عبر LISTEN/NOTIFY
+    INVALIDATION_BUS_ENABLED = os.environ.get('INVALIDATION_BUS_ENABLED', 'True').lower() == 'true'
+    INVALIDATION_CHANNEL = os.environ.get('INVALIDATION_CHANNEL', 'cache_invalidation')
+    # مدة الصلاحية المختصرة عند انقطاع الناقل
+    INVALIDATION_FALLBACK_TTL = int(os.environ.get('INVALIDATION_FALLBACK_TTL', 30))
+
+    # بث تغييرات الطلبات (SSE)
+    ORDER_EVENTS_HEARTBEAT = 15  # ثوانٍ بين رسائل الإبقاء على الاتصال
+    ORDER_EVENTS_MAX_STREAM_SECONDS = int(os.environ.get('ORDER_EVENTS_MAX_STREAM_SECONDS', 600))
+    ORDER_EVENTS_QUEUE_SIZE = 200
+    # كل اتصال SSE يحجز خيطاً من عامل gthread طوال مدته: يجب أن يبقى --threads أكبر من هذا الحد
+    # بعدد كافٍ للطلبات العادية، وما زاد عن الحد يعمل بالاستطلاع
+    ORDER_EVENTS_MAX_STREAMS = int(os.environ.get('ORDER_EVENTS_MAX_STREAMS', 6))
+    ORDER_EVENTS_POLL_SECONDS = 20
+    ORDER_EVENTS_BUFFER_SIZE = 200  # آخر الأحداث المحفوظة لكل متجر لطلبات الاستطلاع
+
+    # بث الطلبات (NDJSON) عبر مؤشر من جهة الخادم
+    ORDERS_STREAM_BATCH_SIZE = 500
+    ORDERS_STREAM_MAX_ROWS = int(os.environ.get('ORDERS_STREAM_MAX_ROWS', 20000))
+    ORDERS_EXPORT_MAX_ROWS = int(os.environ.get('ORDERS_EXPORT_MAX_ROWS', 200000))
     # إعدادات PostgreSQL المحسنة
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ENGINE_OPTIONS = {
@@ -114,10 +181,45 @@ class Config:
     DO_SPACES_SECRET = os.environ.get('DO_SPACES_SECRET')
     DO_SPACES_BUCKET = os.environ.get('DO_SPACES_BUCKET')
     DO_SPACES_REGION = os.environ.get('DO_SPACES_REGION')
+    # بديل محلي متوافق مع S3 للتجربة (مثال: http://localhost:9000 و http://localhost:9000/<bucket> و path)
+    DO_SPACES_ENDPOINT = os.environ.get('DO_SPACES_ENDPOINT')
+    DO_SPACES_PUBLIC_URL = os.environ.get('DO_SPACES_PUBLIC_URL')
+    DO_SPACES_ADDRESSING_STYLE = os.environ.get('DO_SPACES_ADDRESSING_STYLE', 'auto')
+    STORAGE_MAX_POOL_CONNECTIONS = int(os.environ.get('STORAGE_MAX_POOL_CONNECTIONS', 32))
+    STORAGE_MAX_ATTEMPTS = 5  # إعادة محاولة تكيفية عند تقييد Spaces
+    STORAGE_UPLOAD_WORKERS = int(os.environ.get('STORAGE_UPLOAD_WORKERS', 16))  # لا يتجاوز عدد الاتصالات
+    # واجهة التخزين: s3 (Spaces) أو local أو memory للتشغيل بدون شبكة واختبارات الحمل
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 's3')
+    STORAGE_LOCAL_DIR = os.environ.get('STORAGE_LOCAL_DIR', '/tmp/storage')
+    STORAGE_PUBLIC_URL = os.environ.get('STORAGE_PUBLIC_URL', '/storage')  # للواجهتين local و memory (مسار أو رابط كامل)
+    # طبقة قرص محلية أمام S3 (كتابة للاثنين وقراءة من القرص أولاً)
+    STORAGE_LOCAL_TIER = os.environ.get('STORAGE_LOCAL_TIER', 'False').lower() == 'true'
+    STORAGE_LOCAL_TIER_MAX_MB = int(os.environ.get('STORAGE_LOCAL_TIER_MAX_MB', 1024))
+    STORAGE_GC_GRACE_DAYS = 7  # لا تُحذف الكائنات غير المستخدمة قبل هذه المدة (رفع مباشر لم يُؤكد بعد مثلاً)
     
     # إعدادات رفع الملفات
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'webp'}
     MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
+    # رفع البواليص مباشرة من المتصفح إلى Spaces بروابط موقّعة
+    SHIPPING_POLICY_DIRECT_UPLOAD = os.environ.get('SHIPPING_POLICY_DIRECT_UPLOAD', 'True').lower() == 'true'
+    PRESIGNED_UPLOAD_EXPIRES = 600  # ثوانٍ
+    # تطبيع صور البواليص في الخلفية (ملصق 4x6 بوصة بدقة 203dpi ≈ 1218 بكسل)
+    POLICY_IMAGE_PIPELINE_ENABLED = os.environ.get('POLICY_IMAGE_PIPELINE_ENABLED', 'True').lower() == 'true'
+    POLICY_IMAGE_MAX_PX = 1400
+    POLICY_IMAGE_THUMB_PX = 240
+    POLICY_IMAGE_FORMAT = os.environ.get('POLICY_IMAGE_FORMAT', 'webp')  # webp أو jpeg
+    POLICY_IMAGE_QUALITY = 80
+    POLICY_IMAGE_WORKERS = 2
+    # تقسيم ملف بواليص شركة الشحن على الخادم: طبقة النص أولاً ثم OCR (يتطلب pytesseract و tesseract)
+    CARRIER_PDF_INGEST_ENABLED = os.environ.get('CARRIER_PDF_INGEST_ENABLED', 'True').lower() == 'true'
+    CARRIER_PDF_WORKERS = int(os.environ.get('CARRIER_PDF_WORKERS', 2))  # لكل عامل gunicorn
+    CARRIER_PDF_PAGES_PER_TASK = 8
+    CARRIER_PDF_RENDER_DPI = 203
+    CARRIER_PDF_OCR_ENABLED = os.environ.get('CARRIER_PDF_OCR_ENABLED', 'True').lower() == 'true'
+    CARRIER_PDF_OCR_LANG = os.environ.get('CARRIER_PDF_OCR_LANG', 'eng')
+    CARRIER_PDF_MAX_PAGES = 300
+    CARRIER_PDF_TIMEOUT = 300  # ثوانٍ
+    CARRIER_PDF_WORK_DIR = os.environ.get('CARRIER_PDF_WORK_DIR', '/tmp/carrier_pdf')
     
     # ------ إعدادات التطوير ------
     DEBUG = os.environ.get('DEBUG', 'False').lower() == 'true'
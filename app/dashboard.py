@@ -16,6 +16,7 @@ from .models import (
 from datetime import datetime
 from functools import wraps
 from sqlalchemy.orm import joinedload
+from .services.reference_cache import reference_cache
 import logging
 
 # إعداد المسجل للإنتاج
@@ -227,10 +228,7 @@ def index():
         if is_admin:
             user = request.current_user
 
-            all_employees = Employee.query.filter_by(
-                store_id=user.store_id,
-                is_active=True
-            ).all()
+            all_employees = reference_cache.get_active_employees(user.store_id)
 
             selected_employee_id = request.args.get('employee_id', type=int)
             selected_employee = None
@@ -447,7 +445,7 @@ def index():
                     }
 
                     # استخدام الحالات الأصلية بدلاً من المخصصة
-                    default_statuses = OrderStatus.query.filter_by(store_id=employee.store_id).all()
+                    default_statuses = reference_cache.get_order_statuses(employee.store_id)
 
                     custom_status_stats = []
                     for status in default_statuses:
@@ -465,10 +463,7 @@ def index():
                         db.joinedload(OrderStatusNote.custom_status)
                     ).order_by(OrderStatusNote.created_at.desc()).limit(5).all()
 
-                    all_employees = Employee.query.filter_by(
-                        store_id=employee.store_id,
-                        is_active=True
-                    ).all()
+                    all_employees = reference_cache.get_active_employees(employee.store_id)
 
                     selected_employee_id = request.args.get('employee_id', type=int)
                     if selected_employee_id:
@@ -522,7 +517,7 @@ def index():
                     }
 
                     # استخدام الحالات الأصلية بدلاً من المخصصة
-                    default_statuses = OrderStatus.query.filter_by(store_id=employee.store_id).all()
+                    default_statuses = reference_cache.get_order_statuses(employee.store_id)
 
                     custom_status_stats = []
                     for status in default_statuses:
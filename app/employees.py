@@ -2,6 +2,7 @@ from flask_wtf.csrf import CSRFProtect
 csrf = CSRFProtect()
 from flask import Blueprint, render_template, redirect, url_for, request, flash, make_response
 from .models import db, User, Employee, OrderStatusNote, EmployeePermission, EmployeeCustomStatus, OrderAssignment
+from .services.invalidation_bus import invalidation_bus
 from datetime import datetime
 
 employees_bp = Blueprint('employees', __name__, url_prefix='/dashboard')
@@ -72,6 +73,8 @@ def add_employee():
         new_employee.set_password(password)
         db.session.add(new_employee)
         db.session.commit()
+        # الموظف الجديد يحصل على حالات افتراضية عند الإنشاء
+        invalidation_bus.publish(store_id)
         
         flash('تمت إضافة الموظف بنجاح', 'success')
         return redirect(url_for('employees.list_employees'))
@@ -116,8 +119,10 @@ def delete_employee(employee_id):
         OrderAssignment.query.filter_by(employee_id=employee_id).delete()
         
         # حذف الموظف نفسه
+        store_id = employee.store_id
         db.session.delete(employee)
         db.session.commit()
+        invalidation_bus.publish(store_id)
         
         flash('تم حذف الموظف بنجاح', 'success')
         return redirect(url_for('employees.list_employees'))
@@ -154,6 +159,7 @@ def toggle_employee_active(employee_id):
         employee.deactivated_at = None
     
     db.session.commit()
+    invalidation_bus.publish(employee.store_id)
     
     action = "تم تفعيل الموظف" if employee.is_active else "تم إيقاف الموظف"
     flash(f'{action} بنجاح', 'success')
@@ -13,7 +13,7 @@ from sqlalchemy import (
     func, event
 )
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import relationship, backref, validates
+from sqlalchemy.orm import relationship, backref, validates, deferred
 from sqlalchemy.dialects.postgresql import JSONB
 # Local application imports
 from . import db
@@ -426,6 +426,8 @@ class SallaOrder(db.Model):
     # العلاقة الصحيحة مع OrderStatus
     status = db.relationship('OrderStatus', backref='salla_orders', lazy='selectin')
     shipping_policy_image = db.Column(db.String(500), nullable=True)
+    # صورة مصغرة لقوائم العرض (ترحيل a1c4e7d2b9f0): مؤجل حتى لا تفشل الاستعلامات قبل تطبيق الترحيل
+    shipping_policy_thumbnail = deferred(db.Column(db.String(500), nullable=True))
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     raw_data = db.Column(db.JSON)
     barcode_data = db.Column(db.Text)  # تخزين الباركود كـ base64
@@ -15,4 +15,7 @@ from . import status_management
 from . import custom_orders
 from . import utils_routes
 from . import print_utils
-from . import shipping_policies
\ No newline at end of file
+from . import shipping_policies
+from . import live_updates
+from . import orders_api
+from . import export
\ No newline at end of file
@@ -3,6 +3,7 @@ from flask import jsonify, request
 from . import orders_bp
 from app.models import db, Employee, OrderAssignment, SallaOrder, CustomOrder
 from app.utils import get_user_from_cookies
+from app.services.order_events import order_events, ORDER_ASSIGNED
 
 import logging
 logger = logging.getLogger(__name__)
@@ -51,6 +52,7 @@ def assign_orders():
         
         assigned_count = 0
         failed_assignments = []
+        assigned_ids = {'salla': [], 'custom': []}
         
         for order in orders_data:
             order_id = str(order.get('id'))
@@ -81,6 +83,7 @@ def assign_orders():
                     assigned_by=current_user_id
                 ))
                 assigned_count += 1
+                assigned_ids['salla'].append(order_id)
             
             elif order_type == 'custom':
                 existing_order = CustomOrder.query.get(int(order_id))
@@ -103,9 +106,17 @@ def assign_orders():
                     assigned_by=current_user_id
                 ))
                 assigned_count += 1
+                assigned_ids['custom'].append(order_id)
         
         if assigned_count > 0:
             db.session.commit()
+            for order_type, ids in assigned_ids.items():
+                order_events.publish(
+                    user.store_id, ORDER_ASSIGNED, ids,
+                    order_type=order_type,
+                    employee_id=target_employee.id,
+                    employee_email=target_employee.email
+                )
             return jsonify({
                 'success': True,
                 'message': f'تم إسناد {assigned_count} طلب(ات) بنجاح',
@@ -22,6 +22,7 @@ from flask import send_file
 from io import BytesIO
 import logging
 from concurrent import futures
+from app.services.shipping_policy_cache import shipping_policy_cache
 logger = logging.getLogger('salla_app')
 @orders_bp.route('/')
 def get_cipher():
@@ -461,40 +462,30 @@ def download_shipping_policy(order_id, shipment_index=0):
         reference_id = order.reference_id or order.id
         filename = f"بوليصة_شحن_{reference_id}.pdf"
 
-        # جلب ملف البوليصة مباشرة
-        access_token = ensure_valid_access_token(user)
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Accept': 'application/pdf,application/octet-stream'
-        }
-        
-        policy_url = shipment['shipping_policy_url']
-        response = requests.get(policy_url, headers=headers, timeout=30, stream=True)
-        
-        if response.status_code == 200:
-            # التحقق من أن الملف هو PDF
-            content_type = response.headers.get('content-type', '')
-            if 'pdf' in content_type.lower() or policy_url.lower().endswith('.pdf'):
-                pdf_data = BytesIO(response.content)
-                return send_file(
-                    pdf_data,
-                    as_attachment=True,
-                    download_name=filename,
-                    mimetype='application/pdf'
-                )
-            else:
-                # إذا لم يكن PDF، نعيد الملف كما هو بدون تحويل
-                file_data = BytesIO(response.content)
-                return send_file(
-                    file_data,
-                    as_attachment=True,
-                    download_name=filename,
-                    mimetype=content_type
-                )
-        else:
+        # البوليصة من ذاكرة القرص، والمصدر (ورمز الوصول) لا يُطلب إلا عند عدم وجود نسخة
+        def source_headers():
+            return {
+                'Authorization': f'Bearer {ensure_valid_access_token(user)}',
+                'Accept': 'application/pdf,application/octet-stream'
+            }
+
+        policy_path, policy_meta = shipping_policy_cache.get(
+            user.store_id, order.id, shipment_index, shipment['shipping_policy_url'], source_headers
+        )
+        if not policy_path:
             flash('فشل في تحميل البوليصة', 'error')
             return redirect(url_for('orders.order_details', order_id=order_id))
 
+        # send_file بمسار الملف: sendfile بدون نسخ، ودعم Range و If-None-Match بالبصمة
+        return send_file(
+            policy_path,
+            as_attachment=True,
+            download_name=filename,
+            mimetype=policy_meta['content_type'],
+            conditional=True,
+            etag=policy_meta['etag']
+        )
+
     except Exception as e:
         error_msg = f"خطأ في تحميل البوليصة: {str(e)}"
         flash(error_msg, "error")
@@ -0,0 +1,121 @@
+# orders/export.py
+import os
+import io
+import csv
+import logging
+import tempfile
+from datetime import datetime
+from flask import Response, request, jsonify, send_file, current_app, stream_with_context
+from openpyxl import Workbook
+from . import orders_bp
+from app.utils import get_user_from_cookies
+from .routes import get_orders_filters
+from .orders_api import build_order_rows_query, iter_order_rows
+
+# إعداد المسجل
+logger = logging.getLogger('salla_app')
+
+EXPORT_HEADERS = [
+    'رقم الطلب', 'العميل', 'المدينة', 'الحالة', 'المسند إليه',
+    'العلامات', 'الحالة المخصصة', 'طريقة الدفع', 'الإجمالي', 'العملة', 'تاريخ الإنشاء'
+]
+
+
+def _export_row(order):
+    """تحويل الطلب إلى صف في ملف التصدير"""
+    return [
+        order['reference_id'],
+        order['customer_name'] or '',
+        order['city'],
+        order['status']['name'],
+        '، '.join(order['assignees']),
+        order['flag']['name'] if order['flag'] else '',
+        order['custom_status']['name'] if order['custom_status'] else '',
+        order['payment_method_name'],
+        order['total_amount'] or 0,
+        order['currency'] or '',
+        order['created_at'].replace('T', ' ')[:19] if order['created_at'] else ''
+    ]
+
+
+def _stream_csv(rows_query, batch_size):
+    """كتابة CSV على دفعات صغيرة مباشرة إلى الاستجابة"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    # BOM ليتعرف Excel على الترميز العربي
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_HEADERS)
+
+    count = 0
+    for order in iter_order_rows(rows_query, batch_size):
+        writer.writerow(_export_row(order))
+        count += 1
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    yield buffer.getvalue()
+    logger.info(f"✅ تم تصدير {count} طلب بصيغة CSV")
+
+
+def _build_xlsx(rows_query, batch_size):
+    """بناء ملف XLSX بوضع الكتابة فقط داخل ملف مؤقت (ذاكرة ثابتة)"""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('الطلبات')
+    sheet.sheet_view.rightToLeft = True
+    sheet.append(EXPORT_HEADERS)
+
+    count = 0
+    for order in iter_order_rows(rows_query, batch_size):
+        sheet.append(_export_row(order))
+        count += 1
+
+    fd, path = tempfile.mkstemp(suffix='.xlsx', prefix='orders_export_')
+    os.close(fd)
+    workbook.save(path)
+    logger.info(f"✅ تم تصدير {count} طلب بصيغة XLSX")
+    return path
+
+
+@orders_bp.route('/orders/export', methods=['GET'])
+def export_orders():
+    """تصدير الطلبات المصفاة إلى CSV أو XLSX"""
+    user, employee = get_user_from_cookies()
+
+    if not user:
+        return jsonify({'success': False, 'error': 'الرجاء تسجيل الدخول'}), 401
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'xlsx'):
+        return jsonify({'success': False, 'error': 'صيغة غير مدعومة'}), 400
+
+    max_rows = current_app.config.get('ORDERS_EXPORT_MAX_ROWS', 200000)
+    batch_size = current_app.config.get('ORDERS_STREAM_BATCH_SIZE', 500)
+
+    filters = get_orders_filters(request.args)
+    rows_query = build_order_rows_query(user, employee, filters).limit(max_rows)
+    filename = f"orders_{datetime.now().strftime('%Y%m%d_%H%M')}.{export_format}"
+
+    if export_format == 'csv':
+        response = Response(stream_with_context(_stream_csv(rows_query, batch_size)), mimetype='text/csv')
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+        response.headers['Cache-Control'] = 'no-store'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    try:
+        path = _build_xlsx(rows_query, batch_size)
+    except Exception as e:
+        logger.error(f"خطأ في تصدير الطلبات: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'error': 'حدث خطأ أثناء تصدير الطلبات'}), 500
+
+    response = send_file(
+        path,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=filename
+    )
+    response.call_on_close(lambda: os.path.exists(path) and os.remove(path))
+    return response
@@ -0,0 +1,135 @@
+# orders/live_updates.py
+import json
+import time
+import logging
+from queue import Empty
+from flask import Response, request, jsonify, current_app
+from . import orders_bp
+from app.models import OrderAssignment
+from app.utils import get_user_from_cookies
+from app.services.order_events import order_events, ORDER_ASSIGNED
+
+logger = logging.getLogger('salla_app')
+
+RIYADH_CITY = 'الرياض'
+
+
+def _format_sse(event):
+    """تحويل الحدث إلى صيغة Server-Sent Events"""
+    return f"event: {event.get('type', 'message')}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def _event_visible(event, scope, employee_id, assigned_ids):
+    """هل يسمح نطاق المستخدم برؤية هذا الحدث؟"""
+    if scope == 'store':
+        return True
+
+    if scope == 'riyadh':
+        return event.get('city') == RIYADH_CITY
+
+    # الموظف العادي والمندوب: فقط الطلبات المسندة إليه
+    if event.get('type') == ORDER_ASSIGNED and str(event.get('employee_id')) == str(employee_id):
+        assigned_ids.update(event.get('order_ids', []))
+        return True
+
+    return any(order_id in assigned_ids for order_id in event.get('order_ids', []))
+
+
+def _resolve_scope(user, employee):
+    """نطاق رؤية الأحداث للمستخدم: (النطاق، معرف الموظف، الطلبات المسندة) أو None إن لم يُصرح له"""
+    is_admin = request.cookies.get('is_admin') == 'true'
+
+    if is_admin or (employee and employee.role in ['reviewer', 'manager']):
+        return 'store', None, set()
+    if employee and employee.role == 'delivery_manager':
+        return 'riyadh', None, set()
+    if employee:
+        assigned_ids = {
+            str(row.order_id) for row in OrderAssignment.query.with_entities(
+                OrderAssignment.order_id
+            ).filter(
+                OrderAssignment.employee_id == employee.id,
+                OrderAssignment.order_id.isnot(None)
+            ).all()
+        }
+        return 'assigned', employee.id, assigned_ids
+    return None
+
+
+@orders_bp.route('/events/stream')
+def order_events_stream():
+    """بث تغييرات الطلبات للصفحات المفتوحة حسب المتجر وصلاحية المستخدم"""
+    user, employee = get_user_from_cookies()
+
+    if not user:
+        return jsonify({'success': False, 'error': 'الرجاء تسجيل الدخول'}), 401
+
+    resolved = _resolve_scope(user, employee)
+    if resolved is None:
+        return jsonify({'success': False, 'error': 'غير مصرح لك بالوصول'}), 403
+    scope, employee_id, assigned_ids = resolved
+    store_id = user.store_id
+
+    # كل اتصال مفتوح يحجز خيطاً من عامل gthread، فما زاد عن الحد يعمل بالاستطلاع
+    max_streams = current_app.config.get('ORDER_EVENTS_MAX_STREAMS', 6)
+    queue = order_events.try_subscribe(store_id, max_streams)
+    if queue is None:
+        response = jsonify({'success': False, 'error': 'تم بلوغ الحد الأقصى للاتصالات المفتوحة', 'fallback': 'poll'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(current_app.config.get('ORDER_EVENTS_POLL_SECONDS', 20))
+        return response
+
+    heartbeat = current_app.config.get('ORDER_EVENTS_HEARTBEAT', 15)
+    max_seconds = current_app.config.get('ORDER_EVENTS_MAX_STREAM_SECONDS', 600)
+
+    def generate():
+        # يعيد المتصفح الاتصال تلقائياً بعد انتهاء مدة البث
+        yield 'retry: 5000\n\n'
+        deadline = time.monotonic() + max_seconds
+        while time.monotonic() < deadline:
+            try:
+                event = queue.get(timeout=heartbeat)
+            except Empty:
+                yield ': ping\n\n'
+                continue
+
+            if _event_visible(event, scope, employee_id, assigned_ids):
+                yield _format_sse(event)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    # تحرير المكان عند إغلاق الاستجابة حتى لو لم يبدأ البث
+    response.call_on_close(lambda: order_events.unsubscribe(store_id, queue))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@orders_bp.route('/events/poll')
+def order_events_poll():
+    """أحداث الطلبات منذ وقت معين للصفحات التي لم تحصل على اتصال SSE"""
+    user, employee = get_user_from_cookies()
+
+    if not user:
+        return jsonify({'success': False, 'error': 'الرجاء تسجيل الدخول'}), 401
+
+    resolved = _resolve_scope(user, employee)
+    if resolved is None:
+        return jsonify({'success': False, 'error': 'غير مصرح لك بالوصول'}), 403
+    scope, employee_id, assigned_ids = resolved
+
+    since = request.args.get('since', type=float)
+    # أول طلب يحدد نقطة البداية فقط، وبعدها يتقدم المؤشر بوقت آخر حدث مُرسل
+    events = [] if since is None else [
+        event for event in order_events.recent(user.store_id, since)
+        if _event_visible(event, scope, employee_id, assigned_ids)
+    ]
+
+    response = jsonify({
+        'success': True,
+        'events': events,
+        'since': max([time.time() if since is None else since] + [event.get('ts', 0) for event in events]),
+        'poll_seconds': current_app.config.get('ORDER_EVENTS_POLL_SECONDS', 20),
+        'stream_available': order_events.subscribers_count() < current_app.config.get('ORDER_EVENTS_MAX_STREAMS', 6)
+    })
+    response.headers['Cache-Control'] = 'no-store'
+    return response
@@ -0,0 +1,181 @@
+# orders/orders_api.py
+import json
+import logging
+from flask import Response, request, jsonify, current_app, stream_with_context
+from sqlalchemy import nullslast, func
+from sqlalchemy.orm import aliased
+from . import orders_bp
+from app.models import (db, SallaOrder, OrderStatus, OrderAddress, OrderAssignment, Employee,
+                        OrderStatusNote, CustomNoteStatus, OrderEmployeeStatus, EmployeeCustomStatus)
+from app.utils import get_user_from_cookies
+from .routes import build_orders_query, apply_orders_filters, get_orders_filters, get_payment_method_name
+
+# إعداد المسجل
+logger = logging.getLogger('salla_app')
+
+FLAG_TEXTS = {
+    'late': 'متأخر',
+    'missing': 'واصل ناقص',
+    'refunded': 'مرتجع',
+    'not_shipped': 'لم يشحن'
+}
+
+
+def get_orders_access(user, employee):
+    """تحديد صلاحيات عرض الطلبات (مراجع، موظف توصيل)"""
+    is_admin = request.cookies.get('is_admin') == 'true'
+    is_reviewer = is_admin or bool(employee and employee.role in ['reviewer', 'manager'])
+    is_delivery_personnel = bool(employee and employee.role in ['delivery_manager', 'delivery'])
+    return is_reviewer, is_delivery_personnel
+
+
+def build_order_rows_query(user, employee, filters):
+    """استعلام أعمدة خفيف لقائمة الطلبات بنفس صلاحيات وفلاتر الصفحة الرئيسية"""
+    is_reviewer, is_delivery_personnel = get_orders_access(user, employee)
+
+    orders_query = build_orders_query(user, employee, is_reviewer, is_delivery_personnel, eager=False)
+    orders_query = apply_orders_filters(orders_query, filters)
+
+    # أسماء مستعارة لتجنب التعارض مع الربط الذي تضيفه الفلاتر
+    status_alias = aliased(OrderStatus)
+    address_alias = aliased(OrderAddress)
+
+    return orders_query.outerjoin(
+        status_alias, status_alias.id == SallaOrder.status_id
+    ).outerjoin(
+        address_alias, address_alias.order_id == SallaOrder.id
+    ).with_entities(
+        SallaOrder.id,
+        func.coalesce(SallaOrder.reference_id, SallaOrder.full_order_data['reference_id'].astext).label('reference_id'),
+        SallaOrder.customer_name,
+        SallaOrder.created_at,
+        SallaOrder.total_amount,
+        SallaOrder.currency,
+        SallaOrder.payment_method,
+        status_alias.slug.label('status_slug'),
+        status_alias.name.label('status_name'),
+        address_alias.city
+    ).distinct().order_by(nullslast(SallaOrder.created_at.desc()), SallaOrder.id)
+
+
+def _load_batch_details(order_ids):
+    """جلب المسندين وآخر علامة وآخر حالة مخصصة لدفعة طلبات (3 استعلامات للدفعة)"""
+    assignees = {}
+    for order_id, email in db.session.query(OrderAssignment.order_id, Employee.email).join(
+        Employee, Employee.id == OrderAssignment.employee_id
+    ).filter(OrderAssignment.order_id.in_(order_ids)):
+        assignees.setdefault(order_id, []).append(email)
+
+    flags = {
+        order_id: {
+            'flag': status_flag,
+            'name': custom_name if status_flag == 'custom' else FLAG_TEXTS.get(status_flag, status_flag)
+        }
+        for order_id, status_flag, custom_name in db.session.query(
+            OrderStatusNote.order_id, OrderStatusNote.status_flag, CustomNoteStatus.name
+        ).outerjoin(
+            CustomNoteStatus, CustomNoteStatus.id == OrderStatusNote.custom_status_id
+        ).filter(
+            OrderStatusNote.order_id.in_(order_ids)
+        ).order_by(
+            OrderStatusNote.order_id, OrderStatusNote.created_at.desc()
+        ).distinct(OrderStatusNote.order_id)
+    }
+
+    custom_statuses = {
+        order_id: {'name': name, 'color': color}
+        for order_id, name, color in db.session.query(
+            OrderEmployeeStatus.order_id, EmployeeCustomStatus.name, EmployeeCustomStatus.color
+        ).join(
+            EmployeeCustomStatus, EmployeeCustomStatus.id == OrderEmployeeStatus.status_id
+        ).filter(
+            OrderEmployeeStatus.order_id.in_(order_ids)
+        ).order_by(
+            OrderEmployeeStatus.order_id, OrderEmployeeStatus.created_at.desc()
+        ).distinct(OrderEmployeeStatus.order_id)
+    }
+
+    return assignees, flags, custom_statuses
+
+
+def _serialize_batch(rows):
+    order_ids = [row.id for row in rows]
+    assignees, flags, custom_statuses = _load_batch_details(order_ids)
+
+    for row in rows:
+        yield {
+            'id': row.id,
+            'reference_id': row.reference_id or row.id,
+            'customer_name': row.customer_name,
+            'created_at': row.created_at.isoformat() if row.created_at else None,
+            'total_amount': row.total_amount,
+            'currency': row.currency,
+            'payment_method': row.payment_method,
+            'payment_method_name': get_payment_method_name(row.payment_method) if row.payment_method else '',
+            'status': {'slug': row.status_slug or 'unknown', 'name': row.status_name or 'غير محدد'},
+            'city': row.city or 'غير محدد',
+            'assignees': assignees.get(row.id, []),
+            'flag': flags.get(row.id),
+            'custom_status': custom_statuses.get(row.id)
+        }
+
+
+def iter_order_rows(rows_query, batch_size=500):
+    """مرور على الطلبات عبر مؤشر من جهة الخادم دون تحميلها كلها في الذاكرة"""
+    batch = []
+    for row in rows_query.yield_per(batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield from _serialize_batch(batch)
+            batch = []
+    if batch:
+        yield from _serialize_batch(batch)
+
+
+@orders_bp.route('/api/orders', methods=['GET'])
+def stream_orders():
+    """بث الطلبات كـ NDJSON أو JSON بنفس فلاتر قائمة الطلبات"""
+    user, employee = get_user_from_cookies()
+
+    if not user:
+        return jsonify({'success': False, 'error': 'الرجاء تسجيل الدخول'}), 401
+
+    output_format = request.args.get('format', 'ndjson')
+    if output_format not in ('ndjson', 'json'):
+        return jsonify({'success': False, 'error': 'صيغة غير مدعومة'}), 400
+
+    max_rows = current_app.config.get('ORDERS_STREAM_MAX_ROWS', 20000)
+    limit = min(request.args.get('limit', max_rows, type=int) or max_rows, max_rows)
+    batch_size = current_app.config.get('ORDERS_STREAM_BATCH_SIZE', 500)
+
+    filters = get_orders_filters(request.args)
+    rows_query = build_order_rows_query(user, employee, filters).limit(limit)
+
+    def generate_ndjson():
+        try:
+            for order in iter_order_rows(rows_query, batch_size):
+                yield json.dumps(order, ensure_ascii=False) + '\n'
+        except Exception as e:
+            logger.error(f"خطأ في بث الطلبات: {str(e)}", exc_info=True)
+            yield json.dumps({'error': 'حدث خطأ أثناء جلب الطلبات'}, ensure_ascii=False) + '\n'
+
+    def generate_json():
+        yield '{"orders": ['
+        first = True
+        try:
+            for order in iter_order_rows(rows_query, batch_size):
+                yield ('' if first else ',') + json.dumps(order, ensure_ascii=False)
+                first = False
+            yield '], "success": true}'
+        except Exception as e:
+            logger.error(f"خطأ في بث الطلبات: {str(e)}", exc_info=True)
+            yield '], "success": false, "error": "حدث خطأ أثناء جلب الطلبات"}'
+
+    if output_format == 'json':
+        response = Response(stream_with_context(generate_json()), mimetype='application/json')
+    else:
+        response = Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,7 +1,6 @@
-from flask import request, redirect, url_for, flash, make_response, current_app, render_template, jsonify
+from flask import request, redirect, url_for, flash, make_response, current_app, render_template, jsonify, send_file, Response, copy_current_request_context
 import requests
 from datetime import datetime
-from weasyprint import HTML
 from . import orders_bp
 from app.utils import (
     get_user_from_cookies, 
@@ -16,10 +15,17 @@ from app.utils import (
 )
 from app.models import SallaOrder, CustomOrder, OrderAddress # إضافة الاستيراد
 from app.config import Config
+from app.services.pdf_render_service import pdf_render_service, JOB_DONE, JOB_FAILED
+from app.services.print_fragment_cache import print_fragment_cache
+from app.services.print_image_cache import print_image_cache
+from app.services.image_proxy_cache import image_proxy_cache
+from app.services.qr_store import qr_store
+from sqlalchemy import text
 import logging
 import traceback
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from threading import Lock
+from functools import partial
 import json
 
 # إعداد المسجل للإنتاج
@@ -127,30 +133,7 @@ def process_order_from_local_data(order, order_data, items_data):
                 notes = item.get('notes', '') or item.get('note', '') or ''
                 
                 # معالجة الخيارات
-                options = []
-                item_options = item.get('options', [])
-                if isinstance(item_options, list):
-                    for option in item_options:
-                        if not option or not isinstance(option, dict):
-                            continue
-                            
-                        raw_value = option.get('value', '')
-                        display_value = 'غير محدد'
-                        
-                        if isinstance(raw_value, dict):
-                            display_value = raw_value.get('name') or raw_value.get('value') or str(raw_value)
-                        elif isinstance(raw_value, list):
-                            values_list = [str(opt.get('name') or opt.get('value') or str(opt)) 
-                                         for opt in raw_value if isinstance(opt, (dict, str))]
-                            display_value = ', '.join(values_list) if values_list else 'غير محدد'
-                        else:
-                            display_value = str(raw_value) if raw_value else 'غير محدد'
-                        
-                        options.append({
-                            'name': option.get('name', ''),
-                            'value': display_value,
-                            'type': option.get('type', '')
-                        })
+                options = format_item_options(item.get('options', []))
                 
                 # إنشاء بيانات العنصر
                 item_data = {
@@ -184,20 +167,24 @@ def process_order_from_local_data(order, order_data, items_data):
         barcode_data = order.barcode_data if order else None
         
         # معالجة الباركود بشكل آمن
-        if barcode_data:
+        if current_app.config.get('PRINT_QR_MODE') == 'svg':
+            # القالب يرسم QR كـ SVG من رقم الطلب، فلا حاجة لتوليد صورة أو رفعها
+            if not (isinstance(barcode_data, str) and barcode_data.startswith('data:image')):
+                barcode_data = None
+        elif barcode_data:
             if isinstance(barcode_data, str):
                 if barcode_data.startswith('iVBOR'):
                     barcode_data = f"data:image/png;base64,{barcode_data}"
                 elif not barcode_data.startswith('data:image'):
                     # إذا كان الباركود ليس بصيغة صحيحة، نستخدم رقم الطلب لإنشاء باركود جديد
                     logger.warning(f"⚠️ تنسيق الباركود غير صحيح للطلب {order.id}")
-                    barcode_data = generate_barcode(str(order.id))
+                    barcode_data = order.qr_code_url or generate_barcode(str(order.id))
             else:
                 # إذا لم يكن الباركود نصاً، نستخدم رقم الطلب لإنشاء باركود جديد
-                barcode_data = generate_barcode(str(order.id))
+                barcode_data = order.qr_code_url or generate_barcode(str(order.id))
         else:
-            # إذا لم يكن هناك باركود، ننشئ واحداً
-            barcode_data = generate_barcode(str(order.id))
+            # الرمز المولد في الخلفية عند استلام الطلب، وإلا ننشئ واحداً
+            barcode_data = order.qr_code_url or generate_barcode(str(order.id))
         
         # إنشاء كائن الطلب النهائي
         processed_order = {
@@ -222,6 +209,35 @@ def process_order_from_local_data(order, order_data, items_data):
         logger.error(f"❌ خطأ في معالجة البيانات المحلية للطلب {order.id if order else 'unknown'}: {str(e)}")
         return None
 
+def format_item_options(item_options):
+    """تحويل خيارات العنصر إلى (الاسم، القيمة المعروضة، النوع)"""
+    options = []
+    if not isinstance(item_options, list):
+        return options
+
+    for option in item_options:
+        if not option or not isinstance(option, dict):
+            continue
+            
+        raw_value = option.get('value', '')
+        display_value = 'غير محدد'
+        
+        if isinstance(raw_value, dict):
+            display_value = raw_value.get('name') or raw_value.get('value') or str(raw_value)
+        elif isinstance(raw_value, list):
+            values_list = [str(opt.get('name') or opt.get('value') or str(opt)) 
+                         for opt in raw_value if isinstance(opt, (dict, str))]
+            display_value = ', '.join(values_list) if values_list else 'غير محدد'
+        else:
+            display_value = str(raw_value) if raw_value else 'غير محدد'
+        
+        options.append({
+            'name': option.get('name', ''),
+            'value': display_value,
+            'type': option.get('type', '')
+        })
+    return options
+
 def get_main_image_from_local(item):
     """استخراج الصورة الرئيسية من البيانات المحلية"""
     try:
@@ -372,6 +388,269 @@ def download_orders_html():
         flash('حدث خطأ أثناء إنشاء المعاينة', 'error')
         return redirect(url_for('orders.index'))
 
+# عناصر الطلبات المحددة من full_order_data مع مفتاح التجميع والكمية (SKU ثم الاسم)
+QUICK_LIST_ITEMS_SQL = """
+    WITH items AS (
+        SELECT o.id AS order_id, o.reference_id, o.created_at, o.qr_code_url, o.barcode_data,
+               o.full_order_data AS order_data, item.value AS item, item.ordinality AS item_index
+        FROM salla_orders o
+        CROSS JOIN LATERAL jsonb_array_elements(
+            CASE WHEN jsonb_typeof(o.full_order_data->'items') = 'array'
+                 THEN o.full_order_data->'items' ELSE '[]'::jsonb END
+        ) WITH ORDINALITY AS item(value, ordinality)
+        WHERE o.store_id = :store_id AND o.id = ANY(:order_ids)
+    ),
+    valid_items AS (
+        SELECT *,
+               COALESCE(NULLIF(btrim(item->>'sku'), ''), btrim(item->>'name')) AS sku,
+               CASE WHEN jsonb_typeof(item->'quantity') = 'number'
+                    THEN (item->>'quantity')::numeric ELSE 0 END AS quantity
+        FROM items
+        WHERE jsonb_typeof(item) = 'object'
+          AND COALESCE(NULLIF(btrim(item->>'sku'), ''), NULLIF(btrim(item->>'name'), '')) IS NOT NULL
+    )
+"""
+
+QUICK_LIST_PRODUCTS_SQL = QUICK_LIST_ITEMS_SQL + """
+    SELECT sku,
+           SUM(quantity) AS total_quantity,
+           COUNT(*) AS appearances_count,
+           (array_agg(item ORDER BY created_at DESC NULLS LAST, order_id))[1] AS sample_item
+    FROM valid_items
+    WHERE quantity > 0
+    GROUP BY sku
+    ORDER BY total_quantity DESC, sku
+"""
+
+QUICK_LIST_STATS_SQL = QUICK_LIST_ITEMS_SQL + """
+    SELECT (SELECT COUNT(*) FROM salla_orders
+            WHERE store_id = :store_id AND id = ANY(:order_ids)) AS local_orders,
+           (SELECT COUNT(DISTINCT order_id) FROM valid_items WHERE quantity > 0) AS orders_with_items
+"""
+
+QUICK_LIST_APPEARANCES_SQL = QUICK_LIST_ITEMS_SQL + """
+    SELECT order_id, reference_id, created_at, qr_code_url, barcode_data, item, sku, quantity,
+           order_data->'customer' AS customer, order_data->>'customer_name' AS customer_name,
+           COUNT(*) OVER () AS total
+    FROM valid_items
+    WHERE quantity > 0 AND sku = ANY(:skus)
+    ORDER BY sku, created_at DESC NULLS LAST, order_id, item_index
+    LIMIT :limit OFFSET :offset
+"""
+
+QUICK_LIST_MAX_PER_PAGE = 500
+
+# حقول جدول الطلبات في الصيغة المضغوطة (بنفس الترتيب)
+QUICK_LIST_ORDER_FIELDS = ('order_id', 'reference_id', 'customer_name', 'customer_mobile',
+                           'created_at', 'barcode', 'barcode_svg')
+
+
+class QuickListPacker:
+    """صيغة مضغوطة لظهور المنتجات: جدول طلبات وخيارات يُرسل مرة واحدة وصفوف تشير إليه بالفهرس"""
+
+    def __init__(self):
+        self.orders = []
+        self.options = []
+        self._order_index = {}
+        self._option_index = {}
+
+    def pack(self, appearance):
+        """تحويل ظهور واحد إلى [فهرس الطلب، الكمية، فهارس الخيارات، الملاحظات]"""
+        order_id = str(appearance.get('order_id', ''))
+        order_index = self._order_index.get(order_id)
+        if order_index is None:
+            order_index = len(self.orders)
+            self._order_index[order_id] = order_index
+            self.orders.append([appearance.get(field) or '' for field in QUICK_LIST_ORDER_FIELDS])
+
+        option_indexes = []
+        for option in appearance.get('options') or []:
+            if not isinstance(option, dict):
+                continue
+            key = (str(option.get('name', '')), str(option.get('value', '')), str(option.get('type', '')))
+            option_index = self._option_index.get(key)
+            if option_index is None:
+                option_index = len(self.options)
+                self._option_index[key] = option_index
+                self.options.append(list(key))
+            option_indexes.append(option_index)
+
+        return [order_index, appearance.get('quantity', 0), option_indexes, appearance.get('notes') or '']
+
+    def pack_groups(self, appearances_by_sku):
+        """ترميز قاموس {sku: [ظهور...]}"""
+        return {
+            sku: [self.pack(appearance) for appearance in appearances]
+            for sku, appearances in appearances_by_sku.items()
+        }
+
+    def tables(self):
+        """الجداول المشتركة التي تُضاف لجذر الاستجابة"""
+        return {
+            'format': 'compact',
+            'order_fields': list(QUICK_LIST_ORDER_FIELDS),
+            'orders': self.orders,
+            'options': self.options
+        }
+
+
+def aggregate_quick_list_products(order_ids, store_id):
+    """تجميع منتجات الطلبات حسب SKU داخل PostgreSQL (الإجماليات وعدد مرات الظهور فقط)"""
+    order_ids_str = [str(oid).strip() for oid in order_ids if str(oid).strip()]
+    engine = get_postgres_engine()
+    params = {'store_id': store_id, 'order_ids': order_ids_str}
+    with engine.connect() as conn:
+        rows = conn.execute(text(QUICK_LIST_PRODUCTS_SQL), params).mappings().all()
+        stats = dict(conn.execute(text(QUICK_LIST_STATS_SQL), params).mappings().one())
+
+    products = []
+    for row in rows:
+        item = row['sample_item'] or {}
+        quantity = row['total_quantity']
+        products.append({
+            'sku': row['sku'],
+            'name': (item.get('name') or '').strip(),
+            'main_image': get_main_image_from_local(item),
+            'price': item.get('amounts', {}).get('price_without_tax', {}).get('amount', 0),
+            'total_quantity': int(quantity) if quantity == int(quantity) else float(quantity),
+            'appearances_count': row['appearances_count']
+        })
+    return products, stats
+
+
+def quick_list_barcodes(rows):
+    """باركود كل طلب مرة واحدة كما في process_order_from_local_data، والرموز الناقصة تُجلب دفعة واحدة من مخزن QR"""
+    barcodes = {}
+    missing = []
+    for row in rows:
+        order_id = str(row['order_id'])
+        if order_id in barcodes or order_id in missing:
+            continue
+        
+        barcode_data = row['barcode_data']
+        if isinstance(barcode_data, str) and barcode_data.startswith('iVBOR'):
+            barcode_data = f"data:image/png;base64,{barcode_data}"
+        if not (isinstance(barcode_data, str) and barcode_data.startswith('data:image')):
+            barcode_data = row['qr_code_url']
+        
+        if barcode_data:
+            barcodes[order_id] = barcode_data
+        else:
+            missing.append(order_id)
+    
+    if missing:
+        barcodes.update(qr_store.get_urls(missing))
+    return barcodes
+
+def get_quick_list_appearances(order_ids, store_id, skus, page=1, per_page=50):
+    """ظهور المنتجات في الطلبات (مقسم لصفحات) عند توسيع منتج في القائمة السريعة"""
+    order_ids_str = [str(oid).strip() for oid in order_ids if str(oid).strip()]
+    per_page = max(1, min(int(per_page), QUICK_LIST_MAX_PER_PAGE))
+    page = max(1, int(page))
+
+    engine = get_postgres_engine()
+    with engine.connect() as conn:
+        rows = conn.execute(text(QUICK_LIST_APPEARANCES_SQL), {
+            'store_id': store_id,
+            'order_ids': order_ids_str,
+            'skus': [str(sku) for sku in skus],
+            'limit': per_page,
+            'offset': (page - 1) * per_page
+        }).mappings().all()
+
+    qr_svg_mode = current_app.config.get('PRINT_QR_MODE') == 'svg'
+    barcodes = {} if qr_svg_mode else quick_list_barcodes(rows)
+    appearances = {}
+    for row in rows:
+        item = row['item'] or {}
+        customer = row['customer'] if isinstance(row['customer'], dict) else {}
+        customer_name = f"{customer.get('first_name', '')} {customer.get('last_name', '')}".strip()
+        quantity = row['quantity']
+
+        appearance = {
+            'order_id': str(row['order_id']),
+            'reference_id': row['reference_id'] or str(row['order_id']),
+            'customer_name': customer_name or row['customer_name'] or 'عميل غير معروف',
+            'customer_mobile': customer.get('mobile', ''),
+            'created_at': format_date(row['created_at']),
+            'quantity': int(quantity) if quantity == int(quantity) else float(quantity),
+            'options': format_item_options(item.get('options', [])),
+            'notes': item.get('notes', '') or item.get('note', '') or ''
+        }
+        if qr_svg_mode:
+            appearance['barcode_svg'] = qr_store.svg(row['order_id'], 'barcode-image')
+        else:
+            appearance['barcode'] = barcodes.get(str(row['order_id']))
+
+        appearances.setdefault(row['sku'], []).append(appearance)
+
+    total = rows[0]['total'] if rows else 0
+    return {
+        'appearances': appearances,
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'has_more': page * per_page < total
+    }
+
+
+def group_quick_list_orders(orders):
+    """تجميع الطلبات المعالجة في الذاكرة حسب SKU (للطلبات القادمة من API سلة)"""
+    qr_svg_mode = current_app.config.get('PRINT_QR_MODE') == 'svg'
+    products_by_sku = {}
+    orders_with_items = 0
+
+    for order in orders:
+        order_items = order.get('order_items', [])
+        if not order_items:
+            continue
+        orders_with_items += 1
+
+        for item in order_items:
+            if not item or not isinstance(item, dict):
+                continue
+
+            sku = item.get('sku', '').strip() or item.get('name', '').strip()
+            quantity = item.get('quantity', 0)
+            if not sku or not quantity or quantity <= 0:
+                continue
+
+            if sku not in products_by_sku:
+                products_by_sku[sku] = {
+                    'sku': sku,
+                    'name': item.get('name', '').strip(),
+                    'main_image': item.get('main_image', ''),
+                    'price': item.get('price', {}).get('amount', 0),
+                    'total_quantity': 0,
+                    'order_appearances': []
+                }
+
+            order_appearance = {
+                'order_id': order.get('id', ''),
+                'reference_id': order.get('reference_id', order.get('id', '')),
+                'customer_name': order.get('customer', {}).get('name', ''),
+                'customer_mobile': order.get('customer', {}).get('mobile', ''),
+                'created_at': order.get('created_at', ''),
+                'quantity': quantity,
+                'options': item.get('options', []),
+                'barcode': order.get('barcode', ''),
+                'notes': item.get('notes', '')
+            }
+            if qr_svg_mode:
+                order_appearance['barcode_svg'] = qr_store.svg(order.get('id', ''), 'barcode-image')
+
+            products_by_sku[sku]['order_appearances'].append(order_appearance)
+            products_by_sku[sku]['total_quantity'] += quantity
+
+    products = []
+    for product in products_by_sku.values():
+        product['order_appearances'].sort(key=lambda x: x.get('created_at', ''), reverse=True)
+        product['appearances_count'] = len(product['order_appearances'])
+        products.append(product)
+    products.sort(key=lambda x: x['total_quantity'], reverse=True)
+    return products, orders_with_items
+
+
 @orders_bp.route('/get_quick_list_data', methods=['POST'])
 def get_quick_list_data():
     """جلب بيانات القائمة السريعة مع تجميع المنتجات حسب SKU من جميع الطلبات"""
@@ -392,12 +671,13 @@ def get_quick_list_data():
         if not order_ids:
             return jsonify({'success': False, 'error': 'لم يتم تحديد أي طلبات'}), 400
         
-        logger.info(f"🔄 جلب بيانات {len(order_ids)} طلب للقائمة السريعة من البيانات المحلية")
+        logger.info(f"🔄 تجميع {len(order_ids)} طلب للقائمة السريعة في قاعدة البيانات")
         
-        # استخدام البيانات المحلية أولاً
-        orders = get_orders_from_local_database(order_ids, user.store_id)
+        # التجميع في PostgreSQL، وتفاصيل الطلبات تُجلب عند توسيع المنتج
+        products_result, sql_stats = aggregate_quick_list_products(order_ids, user.store_id)
+        orders_with_items = sql_stats['orders_with_items']
         
-        if not orders:
+        if not sql_stats['local_orders']:
             logger.warning("⚠️ لم يتم العثور على طلبات في البيانات المحلية، جاري استخدام API")
             # العودة إلى API كبديل
             access_token = user.salla_access_token
@@ -406,124 +686,26 @@ def get_quick_list_data():
             
             max_workers = max(1, min(current_app.config.get('MAX_WORKERS', 10), len(order_ids)))
             orders = process_orders_concurrently(order_ids, access_token, max_workers)
+            products_result, orders_with_items = group_quick_list_orders(orders or [])
         
-        # تجميع المنتجات حسب SKU من جميع الطلبات
-        products_by_sku = {}
-        success_count = 0
-        error_count = 0
-        orders_with_items = 0
-        
-        if not orders:
-            return jsonify({
-                'success': True,
-                'products': [],
-                'stats': {
-                    'total': len(order_ids),
-                    'successful': 0,
-                    'failed': len(order_ids)
-                }
-            })
-        
-        # تجميع جميع المنتجات من جميع الطلبات حسب SKU
-        for order in orders:
-            try:
-                order_items = order.get('order_items', [])
-                
-                # تخطي الطلبات التي لا تحتوي على عناصر
-                if not order_items:
-                    logger.warning(f"⚠️ الطلب {order.get('id', '')} لا يحتوي على عناصر")
-                    error_count += 1
-                    continue
-                
-                # عد الطلبات التي تحتوي على عناصر
-                orders_with_items += 1
-                
-                for item in order_items:
-                    # التحقق من صحة بيانات العنصر
-                    if not item or not isinstance(item, dict):
-                        continue
-                        
-                    sku = item.get('sku', '').strip()
-                    item_name = item.get('name', '').strip()
-                    quantity = item.get('quantity', 0)
-                    
-                    # تخطي العناصر بدون اسم أو SKU
-                    if not sku and not item_name:
-                        continue
-                        
-                    # تخطي العناصر بكمية صفر أو غير صالحة
-                    if not quantity or quantity <= 0:
-                        continue
-                    
-                    # استخدام الاسم إذا لم يكن هناك SKU
-                    if not sku:
-                        sku = item_name
-                    
-                    # إذا كان SKU لا يزال فارغاً، استخدم معرف العنصر
-                    if not sku:
-                        sku = f"item_{item.get('id', 'unknown')}"
-                    
-                    if sku not in products_by_sku:
-                        products_by_sku[sku] = {
-                            'sku': sku,
-                            'name': item_name,
-                            'main_image': item.get('main_image', ''),
-                            'price': item.get('price', {}).get('amount', 0),
-                            'total_quantity': 0,
-                            'order_appearances': []  # ظهور المنتج في الطلبات المختلفة
-                        }
-                    
-                    # إضافة ظهور المنتج في هذا الطلب
-                    order_appearance = {
-                        'order_id': order.get('id', ''),
-                        'reference_id': order.get('reference_id', order.get('id', '')),
-                        'customer_name': order.get('customer', {}).get('name', ''),
-                        'customer_mobile': order.get('customer', {}).get('mobile', ''),  # إضافة الجوال
-                        'created_at': order.get('created_at', ''),
-                        'quantity': quantity,
-                        'options': item.get('options', []),
-                        'barcode': order.get('barcode', ''),
-                        'notes': item.get('notes', '')
-                    }
-                    
-                    products_by_sku[sku]['order_appearances'].append(order_appearance)
-                    products_by_sku[sku]['total_quantity'] += quantity
-                
-                success_count += 1
-                
-            except Exception as e:
-                error_count += 1
-                logger.error(f"❌ خطأ في معالجة الطلب {order.get('id', '')}: {str(e)}")
-                continue
-        
-        # تحويل القاموس إلى قائمة منتجات
-        products_result = []
-        for sku, product_data in products_by_sku.items():
-            # ترتيب الطلبات بحيث تكون الأحدث أولاً
-            product_data['order_appearances'].sort(key=lambda x: x.get('created_at', ''), reverse=True)
-            
-            products_result.append({
-                'sku': product_data['sku'],
-                'name': product_data['name'],
-                'main_image': product_data['main_image'],
-                'price': product_data['price'],
-                'total_quantity': product_data['total_quantity'],
-                'appearances_count': len(product_data['order_appearances']),
-                'order_appearances': product_data['order_appearances']
-            })
-        
-        # ترتيب المنتجات حسب الكمية الإجمالية (من الأكبر إلى الأصغر)
-        products_result.sort(key=lambda x: x['total_quantity'], reverse=True)
+        logger.info(f"✅ تم تجميع {len(products_result)} منتج من {orders_with_items} طلب يحتوي على عناصر")
         
-        logger.info(f"✅ تم تجميع {len(products_result)} منتج من {orders_with_items} طلب يحتوي على عناصر، إجمالي {success_count} طلب ناجح و {error_count} طلب فاشل")
+        tables = {}
+        if data.get('format') == 'compact':
+            packer = QuickListPacker()
+            for product in products_result:
+                if 'order_appearances' in product:
+                    product['order_appearances'] = [packer.pack(appearance) for appearance in product['order_appearances']]
+            tables = packer.tables()
         
         return jsonify({
             'success': True,
+            **tables,
             'products': products_result,
             'stats': {
                 'total_orders': len(order_ids),
-                'successful_orders': success_count,
-                'failed_orders': error_count,
+                'successful_orders': orders_with_items,
+                'failed_orders': len(order_ids) - orders_with_items,
                 'orders_with_items': orders_with_items,
                 'total_products': len(products_result),
                 'total_items': sum(product['total_quantity'] for product in products_result)
@@ -534,219 +716,350 @@ def get_quick_list_data():
         logger.error(f"❌ خطأ في جلب بيانات القائمة السريعة: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({'success': False, 'error': 'حدث خطأ أثناء جلب البيانات'}), 500
-import re
-import unicodedata
-@orders_bp.route('/quick_list_print')
-def quick_list_print():
-    """عرض صفحة الطباعة للقائمة السريعة"""
-    return render_template('quick_list_print.html')
-@orders_bp.route('/download_pdf')
-def download_pdf():
-    """تحميل الطلبات كملف PDF باستخدام البيانات المحلية"""
-    logger.info("بدء تحميل الطلبات كملف PDF (باستخدام البيانات المحلية)")
-    
+
+
+@orders_bp.route('/get_quick_list_appearances', methods=['POST'])
+def get_quick_list_appearances_data():
+    """جلب طلبات منتج أو أكثر من القائمة السريعة صفحة بصفحة"""
     try:
         user, employee = get_user_from_cookies()
-        
         if not user:
-            flash('الرجاء تسجيل الدخول أولاً', 'error')
-            return redirect(url_for('user_auth.login'))
-        
-        order_ids = request.args.get('order_ids', '').split(',')
-        
-        # تصفية القائمة من القيم الفارغة
-        order_ids = [order_id.strip() for order_id in order_ids if order_id.strip()]
-        
-        if not order_ids:
-            flash('لم يتم تحديد أي طلبات للتحميل', 'error')
-            return redirect(url_for('orders.index'))
-        
-        logger.info(f"🔄 معالجة {len(order_ids)} طلب لتحويل PDF من البيانات المحلية")
-        
-        # استخدام البيانات المحلية بدلاً من API
-        orders = get_orders_from_local_database(order_ids, user.store_id)
-        
-        if not orders:
-            logger.warning("⚠️ لم يتم العثور على طلبات في البيانات المحلية، جاري استخدام API كبديل")
-            # العودة إلى الطريقة القديمة كبديل
-            access_token = user.salla_access_token
-            if not access_token:
-                flash('يجب ربط المتجر مع سلة أولاً', 'error')
-                return redirect(url_for('auth.link_store'))
-            
-            max_workers = max(1, min(current_app.config.get('MAX_WORKERS', 10), len(order_ids)))
-            orders = process_orders_concurrently(order_ids, access_token, max_workers)
-        
-        if not orders:
-            flash('لم يتم العثور على أي طلبات للتحميل', 'error')
-            return redirect(url_for('orders.index'))
-        
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            return jsonify({'success': False, 'error': 'الرجاء تسجيل الدخول'}), 401
         
-        # تحسين أداء إنشاء PDF
-        optimized_orders = optimize_pdf_generation(orders)
+        data = request.get_json() or {}
+        order_ids = data.get('order_ids', [])
+        skus = data.get('skus') or ([data['sku']] if data.get('sku') else [])
         
-        # إنشاء HTML مع تحسينات الأداء
-        html = render_template('print_orders.html', 
-                             orders=optimized_orders, 
-                             current_time=current_time)
+        if not order_ids or not skus:
+            return jsonify({'success': False, 'error': 'لم يتم تحديد الطلبات أو المنتج'}), 400
         
-        # تحسين إعدادات WeasyPrint للأداء
-        pdf = HTML(
-            string=html,
-            base_url=request.host_url
-        ).write_pdf(
-            optimize_size=(),
-            jpeg_quality=80
+        result = get_quick_list_appearances(
+            order_ids, user.store_id, skus,
+            page=data.get('page', 1),
+            per_page=data.get('per_page', 50)
         )
+        if data.get('format') == 'compact':
+            packer = QuickListPacker()
+            result['appearances'] = packer.pack_groups(result['appearances'])
+            result.update(packer.tables())
+        return jsonify({'success': True, **result})
+        
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'معاملات الصفحة غير صالحة'}), 400
+    except Exception as e:
+        logger.error(f"❌ خطأ في جلب طلبات منتج القائمة السريعة: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'success': False, 'error': 'حدث خطأ أثناء جلب البيانات'}), 500
+
+
+@orders_bp.route('/quick_list_print')
+def quick_list_print():
+    """عرض صفحة الطباعة للقائمة السريعة"""
+    return render_template('quick_list_print.html')
+def load_orders_for_print(order_ids, user):
+    """جلب الطلبات للطباعة من البيانات المحلية مع الرجوع إلى API عند عدم توفرها"""
+    orders = get_orders_from_local_database(order_ids, user.store_id)
+    
+    if not orders:
+        logger.warning("⚠️ لم يتم العثور على طلبات في البيانات المحلية، جاري استخدام API كبديل")
+        access_token = user.salla_access_token
+        if not access_token:
+            return []
         
-        filename = f"orders_{current_time.replace(':', '-').replace(' ', '_')}.pdf"
-        
-        response = make_response(pdf)
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
-        response.headers['Content-Length'] = len(pdf)
-        
-        logger.info(f"✅ تم إنشاء PDF بنجاح: {filename} بحجم {len(pdf)} بايت")
-        return response
-        
+        max_workers = max(1, min(current_app.config.get('MAX_WORKERS', 10), len(order_ids)))
+        orders = process_orders_concurrently(order_ids, access_token, max_workers)
+    
+    return orders or []
+
+def prefetch_print_images(orders):
+    """جلب كل صور <img> في قوالب الطباعة مسبقاً: صور المنتجات مصغرة والباركود بمقاسه"""
+    print_image_cache.prefetch(
+        item.get('main_image') for order in orders for item in order.get('order_items', [])
+    )
+    print_image_cache.prefetch((order.get('barcode') for order in orders), downscale=False)
+
+def render_print_chunks(template, orders):
+    """تقسيم الطلبات إلى أجزاء وتجهيز HTML مستقل لكل جزء"""
+    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return [
+        render_template(template, orders=chunk, current_time=current_time, pdf_mode=True)
+        for chunk in pdf_render_service.split(orders)
+    ]
+
+def build_orders_print_html(order_ids, user):
+    """تجهيز مستند HTML مستقل لكل طلب مع مفتاح تخزينه وإرجاع ([(مفتاح, html)], عدد الطلبات).
+    الطلب المخزن لا يُولد له HTML الآن بل دالة تولده إن حُذف من الذاكرة قبل التجميع"""
+    orders = load_orders_for_print(order_ids, user)
+    if not orders:
+        return None, 0
+    
+    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    fragments = []
+    missed_orders = []
+    for order in optimize_pdf_generation(orders):
+        # وقت الإنشاء لا يظهر في الطباعة لذا لا يدخل في المفتاح
+        key = print_fragment_cache.key('print_orders.html', order)
+        if print_fragment_cache.exists(key):
+            # قد يُستدعى من خيط مهمة الخلفية بعد انتهاء الطلب
+            fragments.append((key, copy_current_request_context(partial(
+                render_template, 'print_orders.html', orders=[order], current_time=current_time, pdf_mode=True
+            ))))
+            continue
+        
+        html = render_template('print_orders.html', orders=[order], current_time=current_time, pdf_mode=True)
+        fragments.append((key, html))
+        missed_orders.append(order)
+    
+    # صور الطلبات التي ستُولد تُجلب بالتوازي مسبقاً فلا ينتظر محرك PDF الشبكة
+    prefetch_print_images(missed_orders)
+    return fragments, len(fragments)
+
+def build_addresses_print_html(order_ids, user):
+    """تجهيز أجزاء HTML طباعة العناوين وإرجاع (أجزاء html, عدد الطلبات)"""
+    orders_with_addresses = get_orders_with_addresses(order_ids, user.store_id)
+    
+    if not orders_with_addresses:
+        return None, 0
+    
+    prefetch_print_images(orders_with_addresses)
+    return render_print_chunks('print_addresses.html', orders_with_addresses), len(orders_with_addresses)
+
+def build_orders_pdf_stream(order_ids, user):
+    """مولد PDF الطلبات من صفحات الطلبات المخزنة وإرجاع (المولد, عدد الطلبات)"""
+    if not print_fragment_cache.enabled:
+        # بدون الذاكرة تُطبع عدة طلبات في الصفحة الواحدة كما في السابق
+        orders = load_orders_for_print(order_ids, user)
+        if not orders:
+            return None, 0
+        orders = optimize_pdf_generation(orders)
+        prefetch_print_images(orders)
+        return pdf_render_service.iter_merged(
+            render_print_chunks('print_orders.html', orders), base_url=request.host_url, template='print_orders.html'
+        ), len(orders)
+    
+    fragments, orders_count = build_orders_print_html(order_ids, user)
+    if not fragments:
+        return None, 0
+    return pdf_render_service.iter_cached(
+        fragments, base_url=request.host_url, template='print_orders.html'
+    ), orders_count
+
+def build_addresses_pdf_stream(order_ids, user):
+    """مولد PDF العناوين مقسماً إلى أجزاء وإرجاع (المولد, عدد الطلبات)"""
+    html_chunks, orders_count = build_addresses_print_html(order_ids, user)
+    if not html_chunks:
+        return None, 0
+    return pdf_render_service.iter_merged(
+        html_chunks, base_url=request.host_url, template='print_addresses.html'
+    ), orders_count
+
+def _print_job_redirect(job_type):
+    """روابط التحميل القديمة (GET): إنشاء مهمة في الخلفية ثم الانتقال لصفحة انتظارها بدلاً من التوليد داخل الطلب"""
+    user, employee = get_user_from_cookies()
+    
+    if not user:
+        flash('الرجاء تسجيل الدخول أولاً', 'error')
+        return redirect(url_for('user_auth.login'))
+    
+    order_ids = [order_id.strip() for order_id in request.args.get('order_ids', '').split(',') if order_id.strip()]
+    if not order_ids:
+        flash('لم يتم تحديد أي طلبات للتحميل', 'error')
+        return redirect(url_for('orders.index'))
+    
+    try:
+        job_id = submit_print_job(job_type, order_ids, user)
     except Exception as e:
-        logger.error(f"❌ خطأ في إنشاء PDF: {str(e)}")
+        logger.error(f"❌ خطأ في إنشاء مهمة الطباعة: {str(e)}")
         logger.error(traceback.format_exc())
-        flash('حدث خطأ أثناء إنشاء PDF', 'error')
+        flash('حدث خطأ أثناء إنشاء ملف PDF', 'error')
+        return redirect(url_for('orders.index'))
+    
+    if not job_id:
+        flash('لم يتم العثور على أي طلبات للتحميل', 'error')
         return redirect(url_for('orders.index'))
+    
+    return redirect(url_for('orders.download_print_job', job_id=job_id))
+
+@orders_bp.route('/download_pdf')
+def download_pdf():
+    """تحميل الطلبات كملف PDF عبر مهمة في الخلفية"""
+    return _print_job_redirect('orders')
 
-# باقي الدوال تبقى كما هي...
 @orders_bp.route('/download_addresses_pdf')
 def download_addresses_pdf():
-    """تحميل عناوين الطلبات كملف PDF مع الباركود"""
-    logger.info("بدء تحميل عناوين الطلبات كملف PDF")
+    """تحميل عناوين الطلبات كملف PDF مع الباركود عبر مهمة في الخلفية"""
+    return _print_job_redirect('addresses')
+
+PRINT_JOB_BUILDERS = {
+    'orders': (build_orders_pdf_stream, 'orders'),
+    'addresses': (build_addresses_pdf_stream, 'addresses')
+}
+
+def submit_print_job(job_type, order_ids, user):
+    """إنشاء مهمة توليد PDF في الخلفية وإرجاع معرفها، أو None إن لم توجد طلبات"""
+    builder, prefix = PRINT_JOB_BUILDERS[job_type]
+    stream, orders_count = builder(order_ids, user)
+    if not stream:
+        return None
+    
+    current_time = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    job_id = pdf_render_service.submit(
+        stream,
+        store_id=user.store_id,
+        filename=f"{prefix}_{current_time}.pdf",
+        order_count=orders_count
+    )
+    logger.info(f"🔄 مهمة PDF {job_id}: {prefix} ({orders_count} طلب)")
+    return job_id
+
+@orders_bp.route('/print-jobs', methods=['POST'])
+def create_print_job():
+    """إنشاء مهمة توليد PDF في الخلفية (order_ids في جسم الطلب)"""
+    user, employee = get_user_from_cookies()
+    
+    if not user:
+        return jsonify({'success': False, 'error': 'الرجاء تسجيل الدخول'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    job_type = data.get('type', 'orders')
+    order_ids = [str(order_id).strip() for order_id in data.get('order_ids', []) if str(order_id).strip()]
+    
+    if job_type not in PRINT_JOB_BUILDERS:
+        return jsonify({'success': False, 'error': 'نوع الطباعة غير مدعوم'}), 400
+    
+    if not order_ids:
+        return jsonify({'success': False, 'error': 'لم يتم تحديد أي طلبات'}), 400
     
     try:
-        user, employee = get_user_from_cookies()
-        
-        if not user:
-            flash('الرجاء تسجيل الدخول أولاً', 'error')
-            return redirect(url_for('user_auth.login'))
-        
-        order_ids = request.args.get('order_ids', '').split(',')
-        
-        # تصفية القائمة من القيم الفارغة
-        order_ids = [order_id.strip() for order_id in order_ids if order_id.strip()]
-        
-        if not order_ids:
-            flash('لم يتم تحديد أي طلبات للتحميل', 'error')
-            return redirect(url_for('orders.index'))
-        
-        logger.info(f"🔄 معالجة {len(order_ids)} طلب لعناوين PDF")
-        
-        # استخدام البيانات المحلية
-        orders = get_orders_from_local_database(order_ids, user.store_id)
-        
-        if not orders:
-            logger.warning("⚠️ لم يتم العثور على طلبات في البيانات المحلية، جاري استخدام API كبديل")
-            # العودة إلى الطريقة القديمة كبديل
-            access_token = user.salla_access_token
-            if not access_token:
-                flash('يجب ربط المتجر مع سلة أولاً', 'error')
-                return redirect(url_for('auth.link_store'))
-            
-            max_workers = max(1, min(current_app.config.get('MAX_WORKERS', 10), len(order_ids)))
-            orders = process_orders_concurrently(order_ids, access_token, max_workers)
-        
-        if not orders:
-            flash('لم يتم العثور على أي طلبات للتحميل', 'error')
-            return redirect(url_for('orders.index'))
-        
-        # إضافة معلومات العنوان لكل طلب
-        orders_with_addresses = []
-        for order in orders:
-            try:
-                # جلب بيانات الطلب الكاملة للحصول على العنوان
-                order_with_address = get_order_with_address(order['id'], user.store_id)
-                if order_with_address:
-                    orders_with_addresses.append(order_with_address)
-            except Exception as e:
-                logger.error(f"❌ خطأ في جلب عنوان الطلب {order.get('id', '')}: {str(e)}")
-                continue
-        
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
-        # إنشاء HTML للعناوين
-        html = render_template('print_addresses.html', 
-                             orders=orders_with_addresses, 
-                             current_time=current_time)
-        
-        # إنشاء PDF
-        pdf = HTML(
-            string=html,
-            base_url=request.host_url
-        ).write_pdf(
-            optimize_size=(),
-            jpeg_quality=80
-        )
-        
-        filename = f"addresses_{current_time.replace(':', '-').replace(' ', '_')}.pdf"
-        
-        response = make_response(pdf)
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
-        response.headers['Content-Length'] = len(pdf)
+        job_id = submit_print_job(job_type, order_ids, user)
+        if not job_id:
+            return jsonify({'success': False, 'error': 'لم يتم العثور على أي طلبات'}), 404
         
-        logger.info(f"✅ تم إنشاء عناوين PDF بنجاح: {filename} بحجم {len(pdf)} بايت")
-        return response
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status_url': url_for('orders.print_job_status', job_id=job_id),
+            'download_url': url_for('orders.download_print_job', job_id=job_id)
+        }), 202
         
     except Exception as e:
-        logger.error(f"❌ خطأ في إنشاء عناوين PDF: {str(e)}")
+        logger.error(f"❌ خطأ في إنشاء مهمة الطباعة: {str(e)}")
         logger.error(traceback.format_exc())
-        flash('حدث خطأ أثناء إنشاء ملف العناوين', 'error')
-        return redirect(url_for('orders.index'))
+        return jsonify({'success': False, 'error': 'حدث خطأ أثناء إنشاء مهمة الطباعة'}), 500
 
-def get_order_with_address(order_id, store_id):
-    """جلب بيانات الطلب مع العنوان من نموذج OrderAddress الرسمي"""
-    try:
-        # جلب عنوان الطلب من نموذج OrderAddress مباشرة
-        order_address = OrderAddress.query.filter_by(order_id=order_id).first()
-        
-        if not order_address:
-            logger.warning(f"⚠️ لم يتم العثور على عنوان للطلب {order_id}")
-            return None
+def _get_store_print_job(job_id):
+    user, _ = get_user_from_cookies()
+    if not user:
+        return None, (jsonify({'success': False, 'error': 'الرجاء تسجيل الدخول'}), 401)
+    
+    job = pdf_render_service.get_job(job_id)
+    if not job or job.get('store_id') != str(user.store_id):
+        return None, (jsonify({'success': False, 'error': 'المهمة غير موجودة'}), 404)
+    return job, None
 
-        # استخدام البيانات مباشرة من نموذج OrderAddress
-        address_info = {
-            'name': order_address.name,
-            'address': order_address.full_address,  # العنوان الكامل من الحقل المخصص
-            'city': order_address.city,
-            'state': order_address.country,  # لاحظ: في النموذج الحالي لا يوجد حقل state منفصل
-            'country': order_address.country,
-            'postal_code': '',  # يمكن إضافته إذا كان موجوداً في النموذج
-            'mobile': order_address.phone,
-            'additional_info': ''
-        }
+@orders_bp.route('/print-jobs/<job_id>', methods=['GET'])
+def print_job_status(job_id):
+    """حالة مهمة توليد PDF"""
+    job, error_response = _get_store_print_job(job_id)
+    if error_response:
+        return error_response
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': job['status'],
+        'order_count': job.get('order_count', 0),
+        'size': job.get('size'),
+        'error': job.get('error')
+    })
 
-        # جلب بيانات الطلب الأساسية من SallaOrder
-        order = SallaOrder.query.filter_by(id=order_id, store_id=store_id).first()
-        if not order:
-            logger.warning(f"⚠️ لم يتم العثور على الطلب {order_id} في SallaOrder")
-            return None
+@orders_bp.route('/print-jobs/<job_id>/download', methods=['GET'])
+def download_print_job(job_id):
+    """تحميل ملف PDF الجاهز"""
+    job, error_response = _get_store_print_job(job_id)
+    if error_response:
+        return error_response
+    
+    if job['status'] != JOB_DONE:
+        if request.accept_mimetypes.accept_html and not request.accept_mimetypes.accept_json:
+            # انتقال من رابط تحميل في المتصفح: صفحة انتظار تُحدّث نفسها حتى يجهز الملف
+            if job['status'] == JOB_FAILED:
+                flash('حدث خطأ أثناء إنشاء ملف PDF', 'error')
+                return redirect(url_for('orders.index'))
+            response = make_response(render_template('print_job_wait.html', job=job), 202)
+            response.headers['Refresh'] = '2'
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+        return jsonify({'success': False, 'error': 'الملف غير جاهز بعد', 'status': job['status']}), 409
+    
+    return send_file(
+        pdf_render_service.pdf_path(job_id),
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=job['filename']
+    )
+
+def get_orders_with_addresses(order_ids, store_id):
+    """جلب بيانات ملصقات العناوين لجميع الطلبات باستعلام واحد (الطلب + العنوان) بنفس ترتيب المعرفات"""
+    order_ids_str = list(dict.fromkeys(str(oid).strip() for oid in order_ids if str(oid).strip()))
+    if not order_ids_str:
+        return []
+
+    rows = SallaOrder.query.join(
+        OrderAddress, OrderAddress.order_id == SallaOrder.id
+    ).with_entities(
+        SallaOrder.id,
+        SallaOrder.created_at,
+        SallaOrder.barcode_data,
+        SallaOrder.qr_code_url,
+        SallaOrder.full_order_data['reference_id'].astext.label('reference_id'),
+        OrderAddress.name,
+        OrderAddress.full_address,
+        OrderAddress.city,
+        OrderAddress.country,
+        OrderAddress.phone
+    ).filter(
+        SallaOrder.store_id == store_id,
+        SallaOrder.id.in_(order_ids_str)
+    ).all()
+
+    rows_by_id = {str(row.id): row for row in rows}
+    missing = len(order_ids_str) - len(rows_by_id)
+    if missing:
+        logger.warning(f"⚠️ لم يتم العثور على عنوان أو طلب لـ {missing} من {len(order_ids_str)} طلب")
 
-        # الحصول على الباركود
-        barcode_data = order.barcode_data
+    qr_svg_mode = current_app.config.get('PRINT_QR_MODE') == 'svg'
+    orders_with_addresses = []
+    for order_id in order_ids_str:
+        row = rows_by_id.get(order_id)
+        if not row:
+            continue
+
+        # الباركود: المخزن في الطلب، وإلا رابط QR المولد مسبقاً أو من المخزن الثابت
+        barcode_data = row.barcode_data
         if not barcode_data or not isinstance(barcode_data, str) or not barcode_data.startswith('data:image'):
-            barcode_data = generate_barcode(str(order_id))
+            # في وضع SVG يرسم القالب QR مباشرة
+            barcode_data = None if qr_svg_mode else (row.qr_code_url or generate_barcode(order_id))
 
-        return {
-            'id': str(order.id),
-            'reference_id': order.full_order_data.get('reference_id', str(order.id)) if order.full_order_data else str(order.id),
+        orders_with_addresses.append({
+            'id': order_id,
+            'reference_id': row.reference_id or order_id,
             'barcode': barcode_data,
-            'address': address_info,
-            'customer_name': order_address.name,
-            'created_at': format_date(order.created_at)
-        }
-        
-    except Exception as e:
-        logger.error(f"❌ خطأ في جلب عنوان الطلب {order_id}: {str(e)}")
-        return None
+            'address': {
+                'name': row.name,
+                'address': row.full_address,  # العنوان الكامل من الحقل المخصص
+                'city': row.city,
+                'state': row.country,  # لاحظ: في النموذج الحالي لا يوجد حقل state منفصل
+                'country': row.country,
+                'postal_code': '',  # يمكن إضافته إذا كان موجوداً في النموذج
+                'mobile': row.phone,
+                'additional_info': ''
+            },
+            'customer_name': row.name,
+            'created_at': format_date(row.created_at)
+        })
+
+    return orders_with_addresses
 
 @orders_bp.route('/preview_addresses_html')
 def preview_addresses_html():
@@ -771,12 +1084,8 @@ def preview_addresses_html():
         
         logger.info(f"🔄 معالجة {len(order_ids)} طلب لعناوين HTML")
         
-        # استخدام البيانات المحلية
-        orders_with_addresses = []
-        for order_id in order_ids:
-            order_with_address = get_order_with_address(order_id, user.store_id)
-            if order_with_address:
-                orders_with_addresses.append(order_with_address)
+        # استخدام البيانات المحلية (استعلام واحد لجميع الطلبات)
+        orders_with_addresses = get_orders_with_addresses(order_ids, user.store_id)
         
         if not orders_with_addresses:
             flash('لم يتم العثور على أي طلبات للمعاينة', 'error')
@@ -818,28 +1127,20 @@ def proxy_image():
         if not cleaned_url:
             return redirect(url_for('static', filename='images/no-image.png'))
         
-        # تحميل الصورة من المصدر الأصلي
-        response = requests.get(
-            cleaned_url, 
-            timeout=10,
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
-                'Accept-Language': 'ar,en;q=0.9',
-                'Referer': 'https://salla.sa/'
-            }
-        )
+        # النسخة المخزنة (أو المطلوبة بعرض/صيغة محددة) من ذاكرة القرص
+        try:
+            width = int(request.args.get('w', 0)) or None
+        except ValueError:
+            width = None
+        path, mime_type = image_proxy_cache.get(cleaned_url, width, request.args.get('format'))
         
-        if response.status_code == 200:
-            # إرجاع الصورة مع الرأس المناسب
-            proxy_response = make_response(response.content)
-            proxy_response.headers.set('Content-Type', response.headers.get('Content-Type', 'image/jpeg'))
-            proxy_response.headers.set('Cache-Control', 'public, max-age=86400') # كاش لمدة يوم
-            proxy_response.headers.set('Access-Control-Allow-Origin', '*') # ✅ السماح لجميع المصادر
-            return proxy_response
-        else:
-            logger.warning(f"⚠️ فشل تحميل الصورة {cleaned_url}: {response.status_code}")
+        if not path:
             return redirect(url_for('static', filename='images/no-image.png'))
+        
+        # إرسال الملف مباشرة من القرص مع دعم If-Modified-Since/ETag للمتصفح
+        proxy_response = send_file(path, mimetype=mime_type, max_age=86400, conditional=True)
+        proxy_response.headers.set('Access-Control-Allow-Origin', '*') # ✅ السماح لجميع المصادر
+        return proxy_response
             
     except requests.exceptions.Timeout:
         logger.error(f"⏰ انتهت مهلة تحميل الصورة: {image_url}")
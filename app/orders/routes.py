@@ -21,6 +21,10 @@ from app.utils import get_user_from_cookies, process_order_data, format_date, hu
 from app.token_utils import refresh_salla_token
 from app.config import Config
 from app.scheduler_tasks import handle_order_completion
+from app.services.reference_cache import reference_cache
+from app.services.order_events import order_events, ORDER_CREATED, STATUS_CHANGED
+from app.services.qr_pregen import qr_pregen
+from app.services.shipping_policy_cache import shipping_policy_cache
 
 # إعداد المسجل
 logger = logging.getLogger('salla_app')
@@ -374,12 +378,14 @@ def fetch_additional_order_data(store_id, order_id_str):
             'product_statuses': {}
         }
 
-def build_orders_query(user, employee, is_reviewer, is_delivery_personnel):
+def build_orders_query(user, employee, is_reviewer, is_delivery_personnel, eager=True):
     """بناء استعلام الطلبات بناءً على صلاحيات المستخدم"""
-    orders_query = SallaOrder.query.filter_by(store_id=user.store_id).options(
-        selectinload(SallaOrder.status),
-        selectinload(SallaOrder.assignments).selectinload(OrderAssignment.employee)
-    )
+    orders_query = SallaOrder.query.filter_by(store_id=user.store_id)
+    if eager:
+        orders_query = orders_query.options(
+            selectinload(SallaOrder.status),
+            selectinload(SallaOrder.assignments).selectinload(OrderAssignment.employee)
+        )
     
     if is_delivery_personnel:
         orders_query = orders_query.join(OrderAddress).filter(
@@ -398,6 +404,17 @@ def build_orders_query(user, employee, is_reviewer, is_delivery_personnel):
     
     return orders_query
 
+def get_orders_filters(args):
+    """قراءة فلاتر قائمة الطلبات من باراميترات الطلب"""
+    return {
+        'status': args.get('status', ''),
+        'employee': args.get('employee', ''),
+        'custom_status': args.get('custom_status', ''),
+        'date_from': args.get('date_from', ''),
+        'date_to': args.get('date_to', ''),
+        'search': args.get('search', '')
+    }
+
 def apply_orders_filters(orders_query, filters):
     """تطبيق الفلاتر على استعلام الطلبات"""
     status_filter = filters.get('status')
@@ -526,14 +543,7 @@ def index():
         orders_query = build_orders_query(user, employee, is_reviewer, is_delivery_personnel)
         
         # تطبيق الفلاتر
-        filters = {
-            'status': request.args.get('status', ''),
-            'employee': request.args.get('employee', ''),
-            'custom_status': request.args.get('custom_status', ''),
-            'date_from': request.args.get('date_from', ''),
-            'date_to': request.args.get('date_to', ''),
-            'search': request.args.get('search', '')
-        }
+        filters = get_orders_filters(request.args)
         
         orders_query = apply_orders_filters(orders_query, filters)
         orders_query = orders_query.order_by(nullslast(db.desc(SallaOrder.created_at)))
@@ -546,14 +556,12 @@ def index():
         processed_orders = [process_order_for_display(order) for order in orders]
         
         # جلب البيانات الإضافية
-        order_statuses = OrderStatus.query.filter_by(store_id=user.store_id).order_by(OrderStatus.sort).all()
-        employees = Employee.query.filter_by(store_id=user.store_id, is_active=True).all() if is_reviewer else []
+        order_statuses = reference_cache.get_order_statuses(user.store_id)
+        employees = reference_cache.get_active_employees(user.store_id) if is_reviewer else []
         
         custom_statuses = []
         if is_reviewer:
-            custom_statuses = EmployeeCustomStatus.query.join(Employee).filter(
-                Employee.store_id == user.store_id
-            ).all()
+            custom_statuses = reference_cache.get_custom_statuses(user.store_id)
         elif employee:
             custom_statuses = EmployeeCustomStatus.query.filter_by(employee_id=employee.id).all()
         
@@ -693,7 +701,7 @@ def order_details(order_id):
         })
         
         # جلب البيانات الإضافية
-        order_statuses = OrderStatus.query.filter_by(store_id=user.store_id).order_by(OrderStatus.sort).all()
+        order_statuses = reference_cache.get_order_statuses(user.store_id)
         status_changes = SallaStatusChange.query.filter_by(
             order_id=str(order_id)
         ).order_by(SallaStatusChange.created_at.desc()).all()
@@ -757,40 +765,30 @@ def download_shipping_policy(order_id, shipment_index=0):
         reference_id = order.reference_id or order.id
         filename = f"بوليصة_شحن_{reference_id}.pdf"
 
-        # جلب ملف البوليصة مباشرة
-        access_token = ensure_valid_access_token(user)
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Accept': 'application/pdf,application/octet-stream'
-        }
-        
-        policy_url = shipment['shipping_policy_url']
-        response = requests.get(policy_url, headers=headers, timeout=30, stream=True)
-        
-        if response.status_code == 200:
-            # التحقق من أن الملف هو PDF
-            content_type = response.headers.get('content-type', '')
-            if 'pdf' in content_type.lower() or policy_url.lower().endswith('.pdf'):
-                pdf_data = BytesIO(response.content)
-                return send_file(
-                    pdf_data,
-                    as_attachment=True,
-                    download_name=filename,
-                    mimetype='application/pdf'
-                )
-            else:
-                # إذا لم يكن PDF، نعيد الملف كما هو بدون تحويل
-                file_data = BytesIO(response.content)
-                return send_file(
-                    file_data,
-                    as_attachment=True,
-                    download_name=filename,
-                    mimetype=content_type
-                )
-        else:
+        # البوليصة من ذاكرة القرص، والمصدر (ورمز الوصول) لا يُطلب إلا عند عدم وجود نسخة
+        def source_headers():
+            return {
+                'Authorization': f'Bearer {ensure_valid_access_token(user)}',
+                'Accept': 'application/pdf,application/octet-stream'
+            }
+
+        policy_path, policy_meta = shipping_policy_cache.get(
+            user.store_id, order.id, shipment_index, shipment['shipping_policy_url'], source_headers
+        )
+        if not policy_path:
             flash('فشل في تحميل البوليصة', 'error')
             return redirect(url_for('orders.order_details', order_id=order_id))
 
+        # send_file بمسار الملف: sendfile بدون نسخ، ودعم Range و If-None-Match بالبصمة
+        return send_file(
+            policy_path,
+            as_attachment=True,
+            download_name=filename,
+            mimetype=policy_meta['content_type'],
+            conditional=True,
+            etag=policy_meta['etag']
+        )
+
     except Exception as e:
         error_msg = f"خطأ في تحميل البوليصة: {str(e)}"
         flash(error_msg, "error")
@@ -886,6 +884,9 @@ def handle_order_creation(data, webhook_version='2'):
                     new_address = OrderAddress(order_id=order_id, **address_info)
                     db.session.add(new_address)
                     db.session.commit()
+
+            if not existing_order.qr_code_url:
+                qr_pregen.enqueue([order_id])
             return True
 
         # ربط الطلب بالمستخدم
@@ -961,7 +962,21 @@ def handle_order_creation(data, webhook_version='2'):
             new_address = OrderAddress(order_id=order_id, **address_info)
             db.session.add(new_address)
 
+        order_status = OrderStatus.query.get(status_id) if status_id else None
+        event_status = {'slug': order_status.slug, 'name': order_status.name} if order_status else None
+        created_at_iso = new_order.created_at.isoformat()
+
         db.session.commit()
+
+        qr_pregen.enqueue([order_id])
+        order_events.publish(
+            store_id, ORDER_CREATED, [order_id],
+            city=(address_info or {}).get('city') or '',
+            reference_id=str(reference_id) if reference_id else order_id,
+            customer_name=customer_name,
+            status=event_status,
+            created_at=created_at_iso
+        )
         return True
 
     except Exception as e:
@@ -969,6 +984,12 @@ def handle_order_creation(data, webhook_version='2'):
         logger.error(f"خطأ في إنشاء الطلب من Webhook: {str(e)}", exc_info=True)
         return False
 
+def shipping_policy_urls(order_data):
+    """روابط بوالص الشحنات في بيانات الطلب"""
+    if not order_data:
+        return []
+    return [shipment['shipping_policy_url'] for shipment in extract_shipping_info(order_data).get('shipment_details', [])]
+
 def update_order_items_from_webhook(order, order_data):
     """تحديث المنتجات داخل full_order_data"""
     try:
@@ -981,6 +1002,10 @@ def update_order_items_from_webhook(order, order_data):
         removed_ids = old_ids - new_ids
         added_ids = new_ids - old_ids
 
+        # إعادة إصدار البوليصة أو إلغاؤها: حذف النسخ المخزنة القديمة
+        if shipping_policy_urls(order.full_order_data) != shipping_policy_urls(order_data):
+            shipping_policy_cache.invalidate(order.store_id, order.id)
+
         order.full_order_data = order_data
         order.raw_data = json.dumps(order_data, ensure_ascii=False)
 
@@ -1135,6 +1160,10 @@ def order_status_webhook():
 
             if status_updated:
                 db.session.commit()
+                order_events.publish(
+                    store_id, STATUS_CHANGED, [order_id],
+                    status={'slug': status.slug, 'name': status.name, 'type': status.type}
+                )
 
         return jsonify({'success': True, 'message': 'تم استقبال البيانات بنجاح'}), 200
 
@@ -1197,14 +1226,7 @@ def riyadh_orders():
             orders_query = orders_query.filter(assignment_exists)
         
         # تطبيق الفلاتر
-        filters = {
-            'status': request.args.get('status', ''),
-            'employee': request.args.get('employee', ''),
-            'custom_status': request.args.get('custom_status', ''),
-            'date_from': request.args.get('date_from', ''),
-            'date_to': request.args.get('date_to', ''),
-            'search': request.args.get('search', '')
-        }
+        filters = get_orders_filters(request.args)
         
         orders_query = apply_orders_filters(orders_query, filters)
         orders_query = orders_query.order_by(nullslast(db.desc(SallaOrder.created_at)))
@@ -1217,7 +1239,7 @@ def riyadh_orders():
         processed_orders = [process_order_for_display(order) for order in orders]
         
         # جلب البيانات الإضافية
-        order_statuses = OrderStatus.query.filter_by(store_id=user.store_id).order_by(OrderStatus.sort).all()
+        order_statuses = reference_cache.get_order_statuses(user.store_id)
         
         # جلب المندوبين الذين أضافهم المدير الحالي فقط
         delivery_employees = []
@@ -1230,10 +1252,8 @@ def riyadh_orders():
         
         # للمديرين فقط يمكنهم رؤية جميع الموظفين، للموظف العادي فقط حالاته
         if employee.role == 'delivery_manager':
-            employees = Employee.query.filter_by(store_id=user.store_id, is_active=True).all()
-            custom_statuses = EmployeeCustomStatus.query.join(Employee).filter(
-                Employee.store_id == user.store_id
-            ).all()
+            employees = reference_cache.get_active_employees(user.store_id)
+            custom_statuses = reference_cache.get_custom_statuses(user.store_id)
         else:
             employees = []
             custom_statuses = EmployeeCustomStatus.query.filter_by(employee_id=employee.id).all()
@@ -1,11 +1,18 @@
-from flask import request, jsonify, current_app, flash, redirect
+from flask import request, jsonify, current_app, flash, redirect, Response, stream_with_context
 from werkzeug.utils import secure_filename
 import os
+import json
+import uuid
+import base64
+import mimetypes
+from datetime import datetime
 from . import orders_bp
 from ..models import SallaOrder, db
 from ..services.storage_service import do_storage
+from ..services.policy_image_pipeline import policy_image_pipeline
+from ..services.carrier_pdf_ingest import carrier_pdf_ingest
 from flask import render_template
-from sqlalchemy import or_
+from sqlalchemy import or_, text
 from app.utils import get_user_from_cookies  # استيراد نفس الدالة المستخدمة في routes
 
 def allowed_file(filename):
@@ -61,7 +68,9 @@ def upload_shipping_policy(order_id):
         
         # حفظ رابط الصورة في قاعدة البيانات
         order.shipping_policy_image = image_url
+        order.shipping_policy_thumbnail = None
         db.session.commit()
+        policy_image_pipeline.enqueue(order.id, store_id, image_url)
         
         return jsonify({
             'message': 'تم رفع صورة البوليصة بنجاح',
@@ -99,7 +108,10 @@ def delete_shipping_policy(order_id):
         success = do_storage.delete_file(order.shipping_policy_image)
         
         if success:
+            if order.shipping_policy_thumbnail:
+                do_storage.delete_file(order.shipping_policy_thumbnail)
             order.shipping_policy_image = None
+            order.shipping_policy_thumbnail = None
             db.session.commit()
             return jsonify({'message': 'تم حذف صورة البوليصة بنجاح'}), 200
         else:
@@ -299,7 +311,9 @@ def upload_shipping_policy_by_number():
         
         # حفظ رابط الصورة في قاعدة البيانات
         order.shipping_policy_image = image_url
+        order.shipping_policy_thumbnail = None
         db.session.commit()
+        policy_image_pipeline.enqueue(order.id, store_id, image_url)
         
         return jsonify({
             'message': f'تم رفع صورة البوليصة بنجاح للطلب {order_number}',
@@ -313,9 +327,236 @@ def upload_shipping_policy_by_number():
         current_app.logger.error(f"خطأ في رفع صورة البوليصة للطلب {order_number}: {str(e)}")
         return jsonify({'error': 'حدث خطأ أثناء رفع الملف'}), 500
 
+def policy_key_prefix(store_id, order_id):
+    """بادئة مفاتيح البواليص لطلب في متجر (الرابط الموقّع لا يسمح بغيرها)"""
+    return f"shipping-policies/{store_id}/{secure_filename(str(order_id))}/"
+
+@orders_bp.route('/orders/shipping-policy/presign', methods=['POST'])
+def presign_shipping_policy_upload():
+    """إصدار رابط رفع موقّع لبوليصة طلب ليرفعها المتصفح مباشرة إلى التخزين"""
+    user, employee = get_user_from_cookies()
+    
+    if not user:
+        return jsonify({'error': 'الرجاء تسجيل الدخول أولاً'}), 401
+    
+    store_id = user.store_id
+    if not store_id:
+        return jsonify({'error': 'غير مصرح بالوصول'}), 403
+    
+    if not current_app.config.get('SHIPPING_POLICY_DIRECT_UPLOAD', True) or not do_storage.supports_presigned:
+        return jsonify({'error': 'الرفع المباشر غير مفعل', 'direct_upload': False}), 404
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        order_number = str(data.get('order_id') or data.get('order_number') or '').strip()
+        filename = data.get('filename') or ''
+        if not order_number or not filename:
+            return jsonify({'error': 'بيانات ناقصة'}), 400
+        
+        if not allowed_file(filename):
+            return jsonify({
+                'error': 'نوع الملف غير مسموح به. الأنواع المسموحة: ' + 
+                        ', '.join(current_app.config['ALLOWED_EXTENSIONS'])
+            }), 400
+        
+        # البحث عن الطلب باستخدام رقم الطلب أو المرجع للمتجر الحالي فقط
+        order = SallaOrder.query.filter(
+            SallaOrder.store_id == store_id,
+            or_(
+                SallaOrder.id == order_number,
+                SallaOrder.reference_id == order_number
+            )
+        ).first()
+        
+        if not order:
+            return jsonify({'error': f'لم يتم العثور على طلب بالرقم {order_number} في متجرك'}), 404
+        
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        object_key = f"{policy_key_prefix(store_id, order.id)}{uuid.uuid4()}_{secure_filename(filename)}"
+        upload = do_storage.presigned_upload(
+            object_key,
+            content_type,
+            current_app.config['MAX_FILE_SIZE'],
+            expires_in=current_app.config.get('PRESIGNED_UPLOAD_EXPIRES', 600),
+            method='put' if data.get('method') == 'put' else 'post'
+        )
+        
+        return jsonify({
+            'order_id': order.id,
+            'object_key': object_key,
+            'upload': upload
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"خطأ في إصدار رابط الرفع: {str(e)}")
+        return jsonify({'error': 'حدث خطأ أثناء تجهيز الرفع'}), 500
+
+@orders_bp.route('/orders/shipping-policy/confirm', methods=['POST'])
+def confirm_shipping_policy_upload():
+    """تأكيد رفع مباشر: التحقق من الملف في التخزين ثم حفظ رابطه للطلب"""
+    user, employee = get_user_from_cookies()
+    
+    if not user:
+        return jsonify({'error': 'الرجاء تسجيل الدخول أولاً'}), 401
+    
+    store_id = user.store_id
+    if not store_id:
+        return jsonify({'error': 'غير مصرح بالوصول'}), 403
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        order_id = str(data.get('order_id') or '').strip()
+        object_key = data.get('object_key') or ''
+        
+        order = SallaOrder.query.filter_by(id=order_id, store_id=store_id).first()
+        if not order:
+            return jsonify({'error': 'الطلب غير موجود'}), 404
+        
+        # المفتاح يجب أن يكون ضمن بادئة هذا الطلب في هذا المتجر
+        if not object_key.startswith(policy_key_prefix(store_id, order.id)) or '..' in object_key:
+            return jsonify({'error': 'مفتاح الملف غير صالح'}), 400
+        
+        stored = do_storage.head(object_key)
+        if not stored:
+            return jsonify({'error': 'الملف غير موجود في التخزين'}), 400
+        
+        # رفع PUT لا يفرض الحجم مسبقاً فيُتحقق منه هنا
+        if not stored['size'] or stored['size'] > current_app.config['MAX_FILE_SIZE']:
+            do_storage.delete_object(object_key)
+            return jsonify({'error': 'حجم الملف كبير جداً'}), 400
+        
+        image_url = do_storage.public_url(object_key)
+        order.shipping_policy_image = image_url
+        order.shipping_policy_thumbnail = None
+        db.session.commit()
+        policy_image_pipeline.enqueue(order.id, store_id, image_url)
+        
+        return jsonify({
+            'message': 'تم رفع صورة البوليصة بنجاح',
+            'image_url': image_url,
+            'order_id': order.id,
+            'order_number': order.reference_id or order.id
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"خطأ في تأكيد رفع البوليصة: {str(e)}")
+        return jsonify({'error': 'حدث خطأ أثناء حفظ الملف'}), 500
+
+def resolve_store_orders(store_id, order_numbers):
+    """ربط أرقام الطلبات (المعرف أو المرجع) بمعرفاتها في المتجر باستعلام واحد"""
+    numbers = {str(number).strip() for number in order_numbers if number and str(number).strip()}
+    if not numbers:
+        return {}
+    
+    rows = SallaOrder.query.with_entities(SallaOrder.id, SallaOrder.reference_id).filter(
+        SallaOrder.store_id == store_id,
+        or_(
+            SallaOrder.id.in_(list(numbers)),
+            SallaOrder.reference_id.in_(list(numbers))
+        )
+    ).all()
+    
+    resolved = {}
+    for order_id, reference_id in rows:
+        if reference_id in numbers:
+            resolved.setdefault(reference_id, order_id)
+    # المطابقة بمعرف الطلب تسبق المطابقة بالمرجع
+    for order_id, _ in rows:
+        if order_id in numbers:
+            resolved[order_id] = order_id
+    return resolved
+
+def attach_shipping_policies(store_id, entries):
+    """ربط بواليص بطلبات المتجر دفعة واحدة: استعلام واحد للطلبات، رفع متوازٍ، و UPDATE واحد.
+    entries: (رقم الطلب، المحتوى، اسم الملف، نوع المحتوى)، ويُرجع أحداث التقدم كقواميس:
+    uploaded (مرفوعة بانتظار الحفظ) ثم result لكل طلب بعد نجاح commit أو فشله، ثم done"""
+    resolved = resolve_store_orders(store_id, [entry[0] for entry in entries])
+    
+    pending = []
+    seen_orders = set()
+    failed = 0
+    for order_number, body, filename, content_type in entries:
+        order_number = str(order_number or '').strip()
+        order_id = resolved.get(order_number)
+        error = None
+        if not order_number or not body:
+            error = 'بيانات ناقصة'
+        elif not order_id:
+            error = 'الطلب غير موجود في قاعدة البيانات أو لا ينتمي لمتجرك'
+        elif order_id in seen_orders:
+            error = 'بوليصة مكررة لنفس الطلب في هذه الدفعة'
+        
+        if error:
+            failed += 1
+            yield {'type': 'result', 'success': False, 'order_number': order_number, 'error': error}
+            continue
+        
+        seen_orders.add(order_id)
+        pending.append((order_number, order_id, {
+            'object_key': f"{policy_key_prefix(store_id, order_id)}{uuid.uuid4()}_{secure_filename(filename)}",
+            'body': body,
+            'content_type': content_type
+        }))
+    
+    uploaded = []
+    for index, upload in do_storage.upload_iter([item for _, _, item in pending]):
+        order_number, order_id, _ = pending[index]
+        if not upload['url']:
+            failed += 1
+            yield {'type': 'result', 'success': False, 'order_number': order_number, 'error': 'فشل في رفع الملف'}
+            continue
+        uploaded.append((order_number, order_id, upload))
+        # مرفوعة فقط: النجاح لا يُعلن إلا بعد حفظ الربط في قاعدة البيانات
+        yield {'type': 'uploaded', 'order_number': order_number, 'order_id': order_id}
+    
+    if uploaded:
+        try:
+            db.session.execute(text("""
+                UPDATE salla_orders AS o
+                SET shipping_policy_image = v.image_url,
+                    shipping_policy_thumbnail = NULL,
+                    updated_at = :updated_at
+                FROM unnest(CAST(:ids AS text[]), CAST(:urls AS text[])) AS v(id, image_url)
+                WHERE o.id = v.id AND o.store_id = :store_id
+            """), {
+                'ids': [order_id for _, order_id, _ in uploaded],
+                'urls': [upload['url'] for _, _, upload in uploaded],
+                'updated_at': datetime.utcnow(),
+                'store_id': store_id
+            })
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"خطأ في حفظ البواليص المرفوعة: {str(e)}")
+            do_storage.delete_many([upload['object_key'] for _, _, upload in uploaded])
+            for order_number, order_id, _ in uploaded:
+                yield {'type': 'result', 'success': False, 'order_number': order_number, 'error': 'حدث خطأ أثناء حفظ البوليصة'}
+            yield {'type': 'done', 'success': False, 'error': 'حدث خطأ أثناء حفظ البواليص', 'total': len(entries)}
+            return
+        
+        for order_number, order_id, upload in uploaded:
+            yield {
+                'type': 'result',
+                'success': True,
+                'order_number': order_number,
+                'order_id': order_id,
+                'image_url': upload['url']
+            }
+            policy_image_pipeline.enqueue(order_id, store_id, upload['url'])
+    
+    yield {
+        'type': 'done',
+        'success': True,
+        'total': len(entries),
+        'successful': len(uploaded),
+        'failed': failed
+    }
+
 @orders_bp.route('/orders/bulk-shipping-policies', methods=['POST'])
 def bulk_upload_shipping_policies():
-    """رفع جماعي للبواليص للطلبات المستخرجة من PDF للمتجر الحالي فقط"""
+    """رفع جماعي للبواليص للطلبات المستخرجة من PDF للمتجر الحالي فقط.
+    يقبل JSON (صور base64) أو multipart (order_numbers + files)، ويبث النتائج كـ NDJSON عند طلبها"""
     user, employee = get_user_from_cookies()
     
     if not user:
@@ -326,85 +567,61 @@ def bulk_upload_shipping_policies():
         return jsonify({'error': 'غير مصرح بالوصول'}), 403
     
     try:
-        orders_data = request.json.get('orders', [])
-        
-        if not orders_data:
+        entries = []
+        if request.is_json:
+            for order_data in (request.json or {}).get('orders', []):
+                order_number = order_data.get('order_number')
+                image_data = order_data.get('image_data') or ''  # base64 encoded image
+                # إزالة header إذا موجود
+                if ',' in image_data:
+                    image_data = image_data.split(',')[1]
+                try:
+                    body = base64.b64decode(image_data) if image_data else None
+                except ValueError:
+                    body = None
+                entries.append((order_number, body, f"{order_number}.png", 'image/png'))
+        else:
+            # ملفات ثنائية بدون تضخم base64
+            for order_number, file in zip(request.form.getlist('order_numbers'), request.files.getlist('files')):
+                filename = file.filename or f"{order_number}.png"
+                body = file.read() if allowed_file(filename) else None
+                content_type = file.mimetype or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                entries.append((order_number, body, filename, content_type))
+        
+        if not entries:
             return jsonify({'error': 'لم يتم تقديم بيانات الطلبات'}), 400
         
+        if 'application/x-ndjson' in request.headers.get('Accept', '') or request.args.get('format') == 'ndjson':
+            def generate_ndjson():
+                try:
+                    for event in attach_shipping_policies(store_id, entries):
+                        yield json.dumps(event, ensure_ascii=False) + '\n'
+                except Exception as e:
+                    current_app.logger.error(f"خطأ في الرفع الجماعي للبواليص: {str(e)}")
+                    yield json.dumps({'type': 'done', 'success': False, 'error': 'حدث خطأ أثناء المعالجة'}, ensure_ascii=False) + '\n'
+            
+            response = Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+            response.headers['Cache-Control'] = 'no-store'
+            response.headers['X-Accel-Buffering'] = 'no'
+            return response
+        
         results = {
             'successful': [],
             'failed': []
         }
-        
-        for order_data in orders_data:
-            order_number = order_data.get('order_number')
-            image_data = order_data.get('image_data')  # base64 encoded image
-            
-            if not order_number or not image_data:
-                results['failed'].append({
-                    'order_number': order_number,
-                    'error': 'بيانات ناقصة'
-                })
+        for event in attach_shipping_policies(store_id, entries):
+            if event['type'] == 'done':
+                if not event['success']:
+                    return jsonify({'error': event['error']}), 500
                 continue
-            
-            # البحث عن الطلب في قاعدة البيانات للمتجر الحالي فقط
-            order = SallaOrder.query.filter(
-                SallaOrder.store_id == store_id,
-                or_(
-                    SallaOrder.id == order_number,
-                    SallaOrder.reference_id == order_number
-                )
-            ).first()
-            
-            if not order:
-                results['failed'].append({
-                    'order_number': order_number,
-                    'error': 'الطلب غير موجود في قاعدة البيانات أو لا ينتمي لمتجرك'
-                })
+            if event['type'] != 'result':
                 continue
-            
-            try:
-                # تحويل base64 إلى ملف
-                import base64
-                from io import BytesIO
-                
-                # إزالة header إذا موجود
-                if ',' in image_data:
-                    image_data = image_data.split(',')[1]
-                
-                image_binary = base64.b64decode(image_data)
-                image_file = BytesIO(image_binary)
-                image_file.filename = f"{order_number}.png"
-                
-                # رفع الملف إلى التخزين
-                image_url = do_storage.upload_file(image_file, 'shipping-policies')
-                
-                if not image_url:
-                    results['failed'].append({
-                        'order_number': order_number,
-                        'error': 'فشل في رفع الملف'
-                    })
-                    continue
-                
-                # حفظ في قاعدة البيانات
-                order.shipping_policy_image = image_url
-                db.session.commit()
-                
-                results['successful'].append({
-                    'order_number': order_number,
-                    'order_id': order.id,
-                    'image_url': image_url
-                })
-                
-            except Exception as e:
-                db.session.rollback()
-                results['failed'].append({
-                    'order_number': order_number,
-                    'error': f'خطأ في المعالجة: {str(e)}'
-                })
+            event.pop('type')
+            event.pop('success')
+            results['successful' if 'image_url' in event else 'failed'].append(event)
         
         return jsonify({
-            'message': f'تم معالجة {len(orders_data)} طلب',
+            'message': f'تم معالجة {len(entries)} طلب',
             'results': results,
             'store_id': store_id
         }), 200
@@ -414,6 +631,129 @@ def bulk_upload_shipping_policies():
         current_app.logger.error(f"خطأ في الرفع الجماعي للبواليص: {str(e)}")
         return jsonify({'error': 'حدث خطأ أثناء المعالجة'}), 500
 
+@orders_bp.route('/orders/shipping-policies/ingest-pdf', methods=['POST'])
+def ingest_carrier_pdf():
+    """ملف بواليص شركة الشحن كاملاً: استخراج رقم الطلب لكل صفحة على الخادم ثم ربط الصفحات بالطلبات دفعة واحدة.
+    يبث النتائج كـ NDJSON عند طلبها، وصفحات بدون رقم أو بدون طلب تُعاد مع صورتها لإعادة المحاولة يدوياً"""
+    user, employee = get_user_from_cookies()
+    
+    if not user:
+        return jsonify({'error': 'الرجاء تسجيل الدخول أولاً'}), 401
+    
+    store_id = user.store_id
+    if not store_id:
+        return jsonify({'error': 'غير مصرح بالوصول'}), 403
+    
+    if not carrier_pdf_ingest.available:
+        # الواجهة تعود للاستخراج داخل المتصفح
+        return jsonify({'error': 'المعالجة على الخادم غير متاحة', 'server_ingest': False}), 404
+    
+    file = request.files.get('pdf')
+    if not file:
+        return jsonify({'error': 'لم يتم تقديم ملف PDF'}), 400
+    
+    try:
+        pdf_path, page_count = carrier_pdf_ingest.prepare(file.read())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def failed_page(page, error):
+        return {
+            'type': 'result',
+            'success': False,
+            'page': page['page'],
+            'order_number': page['order_number'] or '',
+            'error': error,
+            'image_data': 'data:image/png;base64,' + base64.b64encode(page['image']).decode('ascii')
+        }
+    
+    def generate_events():
+        yield {'type': 'start', 'pages': page_count}
+        
+        pages = []
+        for page in carrier_pdf_ingest.iter_pages(pdf_path, page_count):
+            yield {'type': 'page', 'page': page['page'], 'order_number': page['order_number'], 'method': page['method']}
+            pages.append(page)
+        
+        # الصفحة الأولى لكل رقم هي التي تُربط، والتكرار يُعاد للمراجعة
+        pages_by_number = {}
+        unmatched = []
+        for page in sorted(pages, key=lambda item: item['page']):
+            if not page['order_number']:
+                unmatched.append(failed_page(page, 'لم يتم العثور على رقم طلب في الصفحة'))
+            elif page['order_number'] in pages_by_number:
+                first_page = pages_by_number[page['order_number']]['page']
+                unmatched.append(failed_page(page, f"رقم الطلب مكرر في الصفحة {first_page}"))
+            else:
+                pages_by_number[page['order_number']] = page
+        
+        yield from unmatched
+        
+        # استعلام واحد لمطابقة كل الأرقام، ورفع متوازٍ، و UPDATE واحد
+        entries = [
+            (order_number, page['image'], f"{order_number}_p{page['page']}.png", 'image/png')
+            for order_number, page in pages_by_number.items()
+        ]
+        done = {'type': 'done', 'success': True, 'total': 0, 'successful': 0, 'failed': 0}
+        if entries:
+            for event in attach_shipping_policies(store_id, entries):
+                page = pages_by_number.get(event.get('order_number'))
+                if event['type'] == 'done':
+                    done = event
+                elif event['type'] == 'result' and not event['success'] and page:
+                    yield failed_page(page, event['error'])
+                else:
+                    if page:
+                        event['page'] = page['page']
+                    yield event
+        
+        done['pages'] = page_count
+        done['failed'] = done.get('failed', 0) + len(unmatched)
+        yield done
+    
+    if 'application/x-ndjson' in request.headers.get('Accept', '') or request.args.get('format') == 'ndjson':
+        def generate_ndjson():
+            try:
+                for event in generate_events():
+                    yield json.dumps(event, ensure_ascii=False) + '\n'
+            except Exception as e:
+                current_app.logger.error(f"خطأ في معالجة ملف البواليص: {str(e)}")
+                yield json.dumps({'type': 'done', 'success': False, 'error': 'حدث خطأ أثناء معالجة الملف'}, ensure_ascii=False) + '\n'
+        
+        response = Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+        response.headers['Cache-Control'] = 'no-store'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+    
+    try:
+        results = {
+            'successful': [],
+            'failed': []
+        }
+        summary = {}
+        for event in generate_events():
+            if event['type'] == 'done':
+                if not event['success']:
+                    return jsonify({'error': event['error']}), 500
+                summary = event
+            elif event['type'] == 'result':
+                event.pop('type')
+                results['successful' if event.pop('success') else 'failed'].append(event)
+        
+        return jsonify({
+            'message': f"تم معالجة {page_count} صفحة",
+            'results': results,
+            'pages': page_count,
+            'successful': summary.get('successful', 0),
+            'failed': summary.get('failed', 0),
+            'store_id': store_id
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"خطأ في معالجة ملف البواليص: {str(e)}")
+        return jsonify({'error': 'حدث خطأ أثناء معالجة الملف'}), 500
+
 @orders_bp.route('/api/store-orders', methods=['GET'])
 def get_store_orders():
     """جلب الطلبات الخاصة بالمتجر الحالي فقط للإحصائيات"""
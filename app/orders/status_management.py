@@ -8,6 +8,9 @@ from app.config import Config
 import requests
 from datetime import datetime
 from app.models import Employee
+from app.services.reference_cache import CUSTOM_STATUSES
+from app.services.invalidation_bus import invalidation_bus
+from app.services.order_events import order_events, NOTE_FLAGGED, CUSTOM_STATUS_CHANGED
 import logging
 
 # إعداد المسجل للإنتاج
@@ -186,6 +189,13 @@ def add_status_note(order_id):
             db.session.commit()
             message = "تم حفظ الملاحظة بنجاح"
         
+        flag_event = {'flag': status_flag}
+        if custom_status_id:
+            note_status = CustomNoteStatus.query.get(custom_status_id)
+            if note_status:
+                flag_event.update(name=note_status.name, color=note_status.color)
+        order_events.publish(user.store_id, NOTE_FLAGGED, [order_id], **flag_event)
+        
         # إذا كان الطلب AJAX، نرجع JSON
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             # تحضير بيانات الحالة الجديدة
@@ -383,6 +393,7 @@ def manage_employee_status():
             )
             db.session.add(new_status)
             db.session.commit()
+            invalidation_bus.publish(user.store_id, CUSTOM_STATUSES)
             flash('تمت إضافة الحالة بنجاح', 'success')
         return redirect(url_for('orders.manage_employee_status'))
     
@@ -408,6 +419,7 @@ def delete_employee_status(status_id):
     if status and status.employee_id == request.cookies.get('user_id'):
         db.session.delete(status)
         db.session.commit()
+        invalidation_bus.publish(user.store_id, CUSTOM_STATUSES)
         flash('تم حذف الحالة بنجاح', 'success')
     return redirect(url_for('orders.manage_employee_status'))
 
@@ -562,6 +574,12 @@ def bulk_update_status():
     
     try:
         db.session.commit()
+        order_events.publish(
+            employee.store_id, CUSTOM_STATUS_CHANGED, order_ids,
+            employee_id=employee.id,
+            name=custom_status.name,
+            color=custom_status.color
+        )
         return jsonify({
             'success': True,
             'message': f'تم تحديث {updated_count} طلب بنجاح'
@@ -9,6 +9,9 @@ from app.models import db, SallaOrder, OrderStatus, User
 from app.utils import get_user_from_cookies
 from app.config import Config
 from app.token_utils import refresh_salla_token
+from app.services.reference_cache import ORDER_STATUSES
+from app.services.invalidation_bus import invalidation_bus
+from app.services.qr_pregen import qr_pregen
 # orders/sync.py - إضافة الواردات الجديدة
 import hmac
 import hashlib
@@ -108,6 +111,7 @@ def sync_order_statuses_internal(user, access_token, store_id):
                 current_app.logger.error(f"خطأ في معالجة الحالة {status_data.get('id', 'unknown')}: {str(e)}")
         
         db.session.commit()
+        invalidation_bus.publish(store_id, ORDER_STATUSES)
         
         current_app.logger.info(f"تمت مزامنة حالات الطلبات بنجاح: {new_count} جديد، {updated_count} محدث")
         return True, f'تمت مزامنة حالات الطلبات بنجاح: {new_count} حالة جديدة، {updated_count} حالة محدثة'
@@ -299,6 +303,7 @@ def sync_orders():
 
 # معالجة الطلبات
         new_count, updated_count, skipped_count = 0, 0, 0
+        qr_pending_ids = []
         
         for order_data in all_orders:
             try:
@@ -358,6 +363,8 @@ def sync_orders():
                     existing_order.raw_data = json.dumps(order_data, ensure_ascii=False)
                     existing_order.updated_at = datetime.utcnow()
                     existing_order.status_id = final_status_id
+                    if not existing_order.qr_code_url:
+                        qr_pending_ids.append(order_id)
                     updated_count += 1
                 else:
                     customer = order_data.get('customer', {})
@@ -375,6 +382,7 @@ def sync_orders():
                         status_id=final_status_id
                     )
                     db.session.add(new_order)
+                    qr_pending_ids.append(order_id)
                     new_count += 1
                     
             except Exception as e: 
@@ -385,6 +393,7 @@ def sync_orders():
         
         user.last_sync = datetime.utcnow()
         db.session.commit()
+        qr_pregen.enqueue(qr_pending_ids)
         
         current_app.logger.info(f"تمت المزامنة بنجاح: {new_count} جديد، {updated_count} محدث، {skipped_count} متخطى")
         
@@ -1,8 +1,17 @@
 # orders/utils_routes.py
-from flask import render_template, redirect, url_for, make_response, flash, send_from_directory, redirect
+from flask import render_template, redirect, url_for, make_response, flash, send_from_directory, redirect, request, jsonify
 from . import orders_bp
 from app.utils import get_user_from_cookies
 from app.config import Config
+from app.services.reference_cache import reference_cache
+from app.services.print_fragment_cache import print_fragment_cache
+from app.services.qr_store import qr_store
+from app.services.qr_pregen import qr_pregen
+from app.services.image_proxy_cache import image_proxy_cache
+from app.services.shipping_policy_cache import shipping_policy_cache
+from app.services.policy_image_pipeline import policy_image_pipeline
+from app.services.carrier_pdf_ingest import carrier_pdf_ingest
+from app.services.storage_service import do_storage
 
 @orders_bp.route('/static/barcodes/<filename>')
 def serve_barcode(filename):
@@ -23,3 +32,24 @@ def scan_barcode():
         return response
     return render_template('scan_barcode.html')
 
+
+@orders_bp.route('/cache/stats')
+def cache_stats():
+    """إحصائيات الذاكرة المؤقتة للبيانات المرجعية وصفحات الطباعة (للمديرين فقط)"""
+    user, _ = get_user_from_cookies()
+
+    if not user or request.cookies.get('is_admin') != 'true':
+        return jsonify({'success': False, 'error': 'غير مصرح لك بالوصول'}), 403
+
+    return jsonify({
+        'success': True,
+        'reference_cache': reference_cache.stats(),
+        'print_fragment_cache': print_fragment_cache.stats(),
+        'qr_store': qr_store.stats(),
+        'qr_pregen': qr_pregen.stats(),
+        'image_proxy_cache': image_proxy_cache.stats(),
+        'shipping_policy_cache': shipping_policy_cache.stats(),
+        'policy_image_pipeline': policy_image_pipeline.stats(),
+        'carrier_pdf_ingest': carrier_pdf_ingest.stats(),
+        'storage': do_storage.stats()
+    })
@@ -0,0 +1,267 @@
+import io
+import os
+import re
+import time
+import uuid
+import shutil
+import logging
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from threading import Lock
+
+logger = logging.getLogger('salla_app')
+
+# الأرقام العربية والفارسية كما تظهر أحياناً في نتائج OCR
+ARABIC_DIGITS = str.maketrans('٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹', '01234567890123456789')
+
+# أنماط بوليصة شركة الشحن مرتبة حسب الأولوية، والرقم المقبول من 9 خانات
+CARRIER_PATTERNS = (
+    re.compile(r'\b(21\d{7})\b'),
+    re.compile(r'PCs?:\s*1[\r\n\s]*([\s\S]{0,50}?2\d{8})', re.IGNORECASE),
+    re.compile(r'PCs?:\s*[\r\n\s]*[\s\S]{0,100}?(\d{9})', re.IGNORECASE),
+    re.compile(r'PCs?:\s*1\s*n[\r\n\s]*\s*(\d{9})', re.IGNORECASE),
+    re.compile(r'Ship\s*Date[\s\S]{0,50}?(\d{9})', re.IGNORECASE),
+    re.compile(r'WGT[\s\S]{0,50}?(\d{9})', re.IGNORECASE),
+    re.compile(r'\b(\d{9})\b'),
+)
+
+# أنماط احتياطية لأرقام من 6 إلى 15 خانة
+GENERAL_PATTERNS = (
+    re.compile(r'PCs?:\s*1\s*[\r\n]*\s*(\d{6,15})', re.IGNORECASE),
+    re.compile(r'\b(2\d{5,8})\b'),
+    re.compile(r'\b\d{6,15}\b'),
+)
+
+
+def extract_order_number(text):
+    """رقم الطلب من نص صفحة البوليصة أو None"""
+    if not text:
+        return None
+    text = re.sub(r'\s+', ' ', text.translate(ARABIC_DIGITS)).strip()
+
+    for patterns, lengths in ((CARRIER_PATTERNS, (9, 9)), (GENERAL_PATTERNS, (6, 15))):
+        for pattern in patterns:
+            match = pattern.search(text)
+            if not match:
+                continue
+            digits = re.sub(r'\D', '', match.group(1) if match.groups() else match.group(0))
+            if lengths[0] <= len(digits) <= lengths[1]:
+                return digits
+    return None
+
+
+def _ocr_text(image, lang):
+    # OCR اختياري: بدون pytesseract أو برنامج tesseract تبقى الصفحة بدون رقم
+    try:
+        import pytesseract
+    except ImportError:
+        return None
+    try:
+        return pytesseract.image_to_string(image, lang=lang, config='--psm 6')
+    except (pytesseract.TesseractNotFoundError, pytesseract.TesseractError, OSError):
+        return None
+
+
+def count_pdf_pages(pdf_path):
+    """عدد صفحات ملف PDF (داخل عملية منفصلة لأن pdfium غير آمن مع الخيوط)"""
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def extract_pdf_pages(pdf_path, page_indexes, scale=2.8, ocr_enabled=True, ocr_lang='eng'):
+    """قراءة رقم الطلب وصورة PNG لكل صفحة: طبقة النص أولاً، و OCR للصورة فقط عند عدم وجود رقم"""
+    import pypdfium2 as pdfium
+
+    results = []
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        for index in page_indexes:
+            page = pdf[index]
+            try:
+                textpage = page.get_textpage()
+                try:
+                    order_number = extract_order_number(textpage.get_text_bounded())
+                finally:
+                    textpage.close()
+                method = 'text' if order_number else None
+
+                # الملصقات أبيض وأسود، والتدرج الرمادي يصغّر حجم الصورة دون فقد الباركود
+                image = page.render(scale=scale, grayscale=True).to_pil()
+                if not order_number and ocr_enabled:
+                    order_number = extract_order_number(_ocr_text(image, ocr_lang))
+                    method = 'ocr' if order_number else None
+
+                output = io.BytesIO()
+                image.save(output, format='PNG', optimize=True)
+                results.append({
+                    'page': index + 1,
+                    'order_number': order_number,
+                    'method': method,
+                    'image': output.getvalue()
+                })
+            finally:
+                page.close()
+    finally:
+        pdf.close()
+    return results
+
+
+class CarrierPdfIngest:
+    """تقسيم ملف بواليص شركة الشحن إلى صفحات واستخراج رقم الطلب لكل صفحة عبر مجموعة عمليات"""
+
+    def __init__(self):
+        self.enabled = True
+        self.max_workers = 2
+        self.pages_per_task = 8
+        self.render_dpi = 203
+        self.ocr_enabled = True
+        self.ocr_lang = 'eng'
+        self.max_pages = 300
+        self.timeout = 300
+        self.work_dir = '/tmp/carrier_pdf'
+        self._executor = None
+        self._executor_pid = None
+        self._lock = Lock()
+        self.files = 0
+        self.pages = 0
+        self.text_layer = 0
+        self.ocr = 0
+        self.unmatched = 0
+        self.seconds = 0.0
+
+    def init_app(self, app):
+        """تهيئة الخدمة مع التطبيق"""
+        self.enabled = app.config.get('CARRIER_PDF_INGEST_ENABLED', self.enabled)
+        self.max_workers = max(1, int(app.config.get('CARRIER_PDF_WORKERS', self.max_workers)))
+        self.pages_per_task = max(1, int(app.config.get('CARRIER_PDF_PAGES_PER_TASK', self.pages_per_task)))
+        self.render_dpi = app.config.get('CARRIER_PDF_RENDER_DPI', self.render_dpi)
+        self.ocr_enabled = app.config.get('CARRIER_PDF_OCR_ENABLED', self.ocr_enabled)
+        self.ocr_lang = app.config.get('CARRIER_PDF_OCR_LANG', self.ocr_lang)
+        self.max_pages = app.config.get('CARRIER_PDF_MAX_PAGES', self.max_pages)
+        self.timeout = app.config.get('CARRIER_PDF_TIMEOUT', self.timeout)
+        self.work_dir = app.config.get('CARRIER_PDF_WORK_DIR', self.work_dir)
+        os.makedirs(self.work_dir, exist_ok=True)
+
+    @property
+    def available(self):
+        """الخدمة مفعلة ومكتبة pypdfium2 مثبتة"""
+        return bool(self.enabled) and importlib.util.find_spec('pypdfium2') is not None
+
+    @property
+    def executor(self):
+        """مجموعة العمليات تُنشأ بشكل كسول لكل عامل gunicorn"""
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                # forkserver آمن مع الخيوط داخل عامل gunicorn
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context(method)
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def prepare(self, data):
+        """حفظ الملف المرفوع في مجلد عمل وإرجاع (المسار، عدد الصفحات)، و ValueError إن لم يكن صالحاً"""
+        if not data or not data.startswith(b'%PDF'):
+            raise ValueError('الملف ليس PDF صالحاً')
+
+        self._prune()
+        job_dir = os.path.join(self.work_dir, uuid.uuid4().hex)
+        os.makedirs(job_dir)
+        pdf_path = os.path.join(job_dir, 'source.pdf')
+        with open(pdf_path, 'wb') as f:
+            f.write(data)
+
+        try:
+            page_count = self.executor.submit(count_pdf_pages, pdf_path).result(timeout=self.timeout)
+        except Exception as e:
+            self.cleanup(pdf_path)
+            raise ValueError(f'تعذر قراءة ملف PDF: {str(e)}')
+
+        if not page_count or page_count > self.max_pages:
+            self.cleanup(pdf_path)
+            raise ValueError(f'عدد الصفحات ({page_count}) خارج الحد المسموح ({self.max_pages})')
+        return pdf_path, page_count
+
+    def iter_pages(self, pdf_path, page_count):
+        """نتائج الصفحات فور انتهاء كل مجموعة منها (ليس بترتيب الصفحات)، ويُحذف الملف في النهاية"""
+        started = time.monotonic()
+        scale = self.render_dpi / 72
+        try:
+            futures = [
+                self.executor.submit(
+                    extract_pdf_pages,
+                    pdf_path,
+                    list(range(start, min(start + self.pages_per_task, page_count))),
+                    scale,
+                    self.ocr_enabled,
+                    self.ocr_lang
+                )
+                for start in range(0, page_count, self.pages_per_task)
+            ]
+            try:
+                for future in as_completed(futures, timeout=self.timeout):
+                    for page in future.result():
+                        with self._lock:
+                            self.pages += 1
+                            if page['method'] == 'text':
+                                self.text_layer += 1
+                            elif page['method'] == 'ocr':
+                                self.ocr += 1
+                            else:
+                                self.unmatched += 1
+                        yield page
+            finally:
+                # انقطاع العميل أو خطأ: لا داعي لإكمال الصفحات المتبقية
+                for future in futures:
+                    future.cancel()
+        finally:
+            self.cleanup(pdf_path)
+            with self._lock:
+                self.files += 1
+                self.seconds += time.monotonic() - started
+            logger.info(f"📄 تمت معالجة ملف بواليص من {page_count} صفحة خلال {time.monotonic() - started:.1f} ثانية")
+
+    @staticmethod
+    def cleanup(pdf_path):
+        shutil.rmtree(os.path.dirname(pdf_path), ignore_errors=True)
+
+    def _prune(self):
+        # ملفات طلبات انقطعت قبل بدء المعالجة
+        cutoff = time.time() - 2 * self.timeout
+        try:
+            names = os.listdir(self.work_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.work_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+    def stats(self):
+        """إحصائيات المعالجة"""
+        with self._lock:
+            return {
+                'available': self.available,
+                'workers': self.max_workers,
+                'files': self.files,
+                'pages': self.pages,
+                'text_layer': self.text_layer,
+                'ocr': self.ocr,
+                'unmatched': self.unmatched,
+                'seconds': round(self.seconds, 2)
+            }
+
+
+# إنشاء نسخة عامة من الخدمة
+carrier_pdf_ingest = CarrierPdfIngest()
@@ -0,0 +1,277 @@
+import io
+import os
+import glob
+import json
+import time
+import hashlib
+import logging
+import urllib.parse
+from threading import Lock
+
+logger = logging.getLogger('salla_app')
+
+# المقاسات المسموحة لنسخ الصور المصغرة (يُقرّب العرض المطلوب لأقرب مقاس أكبر)
+VARIANT_WIDTHS = (64, 128, 256, 512, 1024)
+
+VARIANT_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg'),
+    'png': ('PNG', 'image/png', '.png'),
+    'webp': ('WEBP', 'image/webp', '.webp')
+}
+
+REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
+    'Accept-Language': 'ar,en;q=0.9',
+    'Referer': 'https://salla.sa/'
+}
+
+
+def normalize_url(url):
+    """توحيد الرابط كمفتاح للذاكرة (حالة النطاق، ترتيب المعاملات، بدون #)"""
+    parsed = urllib.parse.urlsplit(url.strip())
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)))
+    return urllib.parse.urlunsplit((parsed.scheme.lower(), parsed.netloc.lower(), parsed.path or '/', query, ''))
+
+
+class ImageProxyCache:
+    """ذاكرة قرص (LRU) لصور /proxy-image مع إعادة تحقق ETag/Last-Modified ونسخ مصغرة تُولد مرة واحدة"""
+
+    def __init__(self, cache_dir='/tmp/image_proxy', max_bytes=256 * 1024 * 1024, revalidate_after=86400):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.max_download_bytes = 15 * 1024 * 1024
+        self.timeout = 10
+        self._session = None
+        self._session_pid = None
+        self._lock = Lock()
+        self._key_locks = [Lock() for _ in range(64)]
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        """تهيئة الذاكرة مع التطبيق"""
+        self.cache_dir = app.config.get('IMAGE_PROXY_CACHE_DIR', self.cache_dir)
+        self.max_bytes = int(app.config.get('IMAGE_PROXY_CACHE_MAX_MB', self.max_bytes // (1024 * 1024))) * 1024 * 1024
+        self.revalidate_after = app.config.get('IMAGE_PROXY_REVALIDATE_SECONDS', self.revalidate_after)
+        self.timeout = app.config.get('REQUEST_TIMEOUT', self.timeout)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _get_session(self):
+        # جلسة اتصالات مشتركة لكل عملية (لا تُنقل عبر fork)
+        if self._session is None or self._session_pid != os.getpid():
+            from app.utils import create_session
+            with self._lock:
+                if self._session is None or self._session_pid != os.getpid():
+                    self._session = create_session()
+                    self._session.headers.update(REQUEST_HEADERS)
+                    self._session_pid = os.getpid()
+        return self._session
+
+    def _base_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _read_meta(self, key):
+        try:
+            with open(f"{self._base_path(key)}.json", encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_atomic(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _save_meta(self, key, meta):
+        self._write_atomic(f"{self._base_path(key)}.json", json.dumps(meta).encode('utf-8'))
+
+    def _download(self, key, url, meta):
+        """جلب الأصل من المصدر (مشروط إن وُجدت نسخة) وإرجاع البيانات الوصفية المحدثة"""
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        response = self._get_session().get(url, headers=headers, timeout=self.timeout, stream=True)
+        try:
+            if response.status_code == 304 and meta:
+                meta['fetched_at'] = time.time()
+                self._save_meta(key, meta)
+                self.revalidated += 1
+                return meta
+
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', 'image/jpeg').split(';')[0].strip()
+            if not content_type.startswith('image/'):
+                raise ValueError(f'نوع المحتوى ليس صورة: {content_type}')
+
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(64 * 1024):
+                size += len(chunk)
+                if size > self.max_download_bytes:
+                    raise ValueError('حجم الصورة أكبر من الحد المسموح')
+                chunks.append(chunk)
+        finally:
+            response.close()
+
+        base = self._base_path(key)
+        self._write_atomic(base, b''.join(chunks))
+        # الأصل تغير فتُحذف النسخ المصغرة القديمة
+        for variant in glob.glob(f"{base}.w*"):
+            try:
+                os.remove(variant)
+            except OSError:
+                pass
+
+        meta = {
+            'url': url,
+            'content_type': content_type,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': time.time()
+        }
+        self._save_meta(key, meta)
+        self._written()
+        return meta
+
+    def _make_variant(self, source_path, variant_path, width, image_format):
+        from PIL import Image, ImageOps
+
+        pil_format = VARIANT_FORMATS[image_format][0]
+        with Image.open(source_path) as image:
+            image = ImageOps.exif_transpose(image)
+            if width and image.width > width:
+                image.thumbnail((width, width * 10))
+            if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            output = io.BytesIO()
+            image.save(output, format=pil_format, quality=82, optimize=True)
+        self._write_atomic(variant_path, output.getvalue())
+        self._written()
+
+    @staticmethod
+    def variant_width(width):
+        """تقريب العرض المطلوب لأقرب مقاس مسموح حتى لا تتضخم الذاكرة بكل قيمة"""
+        if not width:
+            return None
+        for allowed in VARIANT_WIDTHS:
+            if width <= allowed:
+                return allowed
+        return VARIANT_WIDTHS[-1]
+
+    def get(self, url, width=None, image_format=None):
+        """مسار الصورة المخزنة ونوعها (مع النسخة المطلوبة) أو (None, None) عند الفشل"""
+        key = hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest()
+        width = self.variant_width(width)
+        if image_format not in VARIANT_FORMATS:
+            image_format = None
+
+        with self._key_locks[int(key[:4], 16) % len(self._key_locks)]:
+            base = self._base_path(key)
+            meta = self._read_meta(key) if os.path.exists(base) else None
+
+            if meta and time.time() - meta.get('fetched_at', 0) < self.revalidate_after:
+                self.hits += 1
+            else:
+                self.misses += 1
+                try:
+                    meta = self._download(key, url, meta)
+                except Exception as e:
+                    if not meta:
+                        logger.warning(f"⚠️ فشل تحميل الصورة {url}: {str(e)}")
+                        return None, None
+                    # المصدر غير متاح: تُستخدم النسخة المخزنة القديمة
+                    logger.warning(f"⚠️ تعذر التحقق من الصورة {url}، استخدام النسخة المخزنة: {str(e)}")
+
+            path, mime_type = base, meta.get('content_type', 'image/jpeg')
+            if width or image_format:
+                image_format = image_format or ('png' if mime_type == 'image/png' else 'jpeg')
+                _, mime_type, extension = VARIANT_FORMATS[image_format]
+                path = f"{base}.w{width or 0}{extension}"
+                if not os.path.exists(path):
+                    try:
+                        self._make_variant(base, path, width, image_format)
+                    except Exception as e:
+                        logger.warning(f"⚠️ تعذر إنشاء نسخة مصغرة للصورة {url}: {str(e)}")
+                        path, mime_type = base, meta.get('content_type', 'image/jpeg')
+
+        try:
+            # تحديث وقت التعديل يجعل الملف الأحدث استخداماً عند الإخلاء
+            os.utime(path)
+        except OSError:
+            pass
+        return path, mime_type
+
+    def _written(self):
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % 200 == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """حذف الأقدم استخداماً حتى يعود الحجم إلى 90% من الحد الأقصى"""
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return 0
+
+        removed = 0
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                if '.w' not in os.path.basename(path):
+                    # حذف الأصل يعني حذف بياناته الوصفية أيضاً
+                    os.remove(f"{path}.json")
+            except OSError:
+                pass
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self.evictions += removed
+        logger.info(f"🧹 تم حذف {removed} صورة من ذاكرة الـ proxy لتجاوز الحد الأقصى")
+        return removed
+
+    def stats(self):
+        """إحصائيات الاستخدام"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else 0,
+                'revalidated': self.revalidated,
+                'evictions': self.evictions,
+                'max_bytes': self.max_bytes
+            }
+
+
+# إنشاء نسخة عامة من الخدمة
+image_proxy_cache = ImageProxyCache()
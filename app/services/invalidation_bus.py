@@ -0,0 +1,194 @@
+import os
+import json
+import uuid
+import select
+import logging
+import threading
+
+from sqlalchemy import text
+
+logger = logging.getLogger('salla_app')
+
+DEFAULT_CHANNEL = 'cache_invalidation'
+
+
+class InvalidationBus:
+    """ناقل إبطال الذاكرة المؤقتة والأحداث بين العمال عبر PostgreSQL LISTEN/NOTIFY"""
+
+    def __init__(self):
+        self.channel = DEFAULT_CHANNEL
+        self.dsn = None
+        self.enabled = False
+        self.connected = False
+        self.instance_id = uuid.uuid4().hex
+        self._handlers = []
+        self._event_handlers = []
+        self._state_handlers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        """تهيئة الناقل وتشغيل خيط الاستماع مرة واحدة لكل عملية"""
+        self.channel = app.config.get('INVALIDATION_CHANNEL', DEFAULT_CHANNEL)
+        database_uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+
+        if not app.config.get('INVALIDATION_BUS_ENABLED', True) or not database_uri.startswith('postgresql'):
+            logger.info("ℹ️ ناقل الإبطال غير مفعل، سيتم الاعتماد على مدة الصلاحية فقط")
+            return
+
+        # psycopg2 لا يقبل اسم المشغل الخاص بـ SQLAlchemy داخل الرابط
+        self.dsn = database_uri.replace('postgresql+psycopg2://', 'postgresql://', 1)
+        self.enabled = True
+        self.start()
+
+    def subscribe(self, handler, on_state_change=None):
+        """تسجيل دالة تستقبل (store_id, topic) ودالة اختيارية لتغير حالة الاتصال"""
+        with self._lock:
+            # create_app قد يُستدعى أكثر من مرة في نفس العملية
+            if handler in self._handlers:
+                return
+            self._handlers.append(handler)
+            if on_state_change:
+                self._state_handlers.append(on_state_change)
+                on_state_change(self.connected or not self.enabled)
+
+    def subscribe_events(self, handler):
+        """تسجيل دالة تستقبل الأحداث ذات البيانات (store_id, topic, data)"""
+        with self._lock:
+            if handler not in self._event_handlers:
+                self._event_handlers.append(handler)
+
+    def publish(self, store_id, topic=None):
+        """إبطال محلي فوري ثم إرسال الحدث لبقية العمال (يُستدعى بعد commit)"""
+        self._dispatch(store_id, topic)
+        self._notify({'store_id': str(store_id), 'topic': topic})
+
+    def publish_event(self, store_id, topic, data):
+        """نشر حدث يحمل بيانات (مثل تغييرات الطلبات) لجميع العمال"""
+        self._dispatch_event(store_id, topic, data)
+        self._notify({'store_id': str(store_id), 'topic': topic, 'data': data})
+
+    def _notify(self, event):
+        if not self.enabled:
+            return
+
+        event['source'] = self.instance_id
+        payload = json.dumps(event, ensure_ascii=False, default=str)
+        store_id = event.get('store_id')
+        try:
+            from app import db
+            with db.engine.connect() as conn:
+                conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                             {'channel': self.channel, 'payload': payload})
+                conn.commit()
+        except Exception as e:
+            logger.warning(f"⚠️ فشل نشر حدث {event.get('topic')} للمتجر {store_id}: {str(e)}")
+
+    def start(self):
+        """تشغيل خيط الاستماع (يعاد تشغيله بعد fork)"""
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        # معرف مستقل لكل عملية حتى بعد fork
+        self.instance_id = uuid.uuid4().hex
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen_loop, name='invalidation-listener', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """إيقاف خيط الاستماع"""
+        self._stop.set()
+
+    def _dispatch(self, store_id, topic):
+        with self._lock:
+            handlers = list(self._handlers)
+        for handler in handlers:
+            try:
+                handler(store_id, topic)
+            except Exception as e:
+                logger.error(f"❌ خطأ في معالج الإبطال: {str(e)}")
+
+    def _dispatch_event(self, store_id, topic, data):
+        with self._lock:
+            handlers = list(self._event_handlers)
+        for handler in handlers:
+            try:
+                handler(store_id, topic, data)
+            except Exception as e:
+                logger.error(f"❌ خطأ في معالج الأحداث: {str(e)}")
+
+    def _set_connected(self, connected):
+        if self.connected == connected:
+            return
+        self.connected = connected
+        with self._lock:
+            state_handlers = list(self._state_handlers)
+        for handler in state_handlers:
+            try:
+                handler(connected)
+            except Exception as e:
+                logger.error(f"❌ خطأ في معالج حالة الناقل: {str(e)}")
+
+    def _listen_loop(self):
+        """حلقة الاستماع مع إعادة الاتصال التدريجية"""
+        import psycopg2
+        import psycopg2.extensions
+
+        backoff = 1
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self.channel}";')
+
+                logger.info(f"✅ ناقل الإبطال متصل بالقناة {self.channel} (pid={os.getpid()})")
+                # قد تكون أحداث فاتتنا أثناء الانقطاع، لذا يُفرغ المشتركون بياناتهم
+                self._set_connected(True)
+                backoff = 1
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._handle_notification(conn.notifies.pop(0).payload)
+
+            except Exception as e:
+                logger.warning(f"⚠️ انقطع ناقل الإبطال، إعادة المحاولة بعد {backoff} ثانية: {str(e)}")
+            finally:
+                self._set_connected(False)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, 60)
+
+    def _handle_notification(self, payload):
+        try:
+            event = json.loads(payload)
+        except (TypeError, ValueError):
+            logger.warning(f"⚠️ حدث إبطال غير صالح: {payload!r}")
+            return
+
+        # الإبطال المحلي تم عند النشر
+        if event.get('source') == self.instance_id:
+            return
+
+        store_id = event.get('store_id')
+        if not store_id:
+            return
+        if 'data' in event:
+            self._dispatch_event(store_id, event.get('topic'), event['data'])
+        else:
+            self._dispatch(store_id, event.get('topic'))
+
+
+# إنشاء نسخة عامة من الخدمة
+invalidation_bus = InvalidationBus()
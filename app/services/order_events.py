@@ -0,0 +1,140 @@
+import time
+import logging
+from collections import deque
+from queue import Queue, Full
+from threading import Lock
+
+from .invalidation_bus import invalidation_bus
+
+logger = logging.getLogger('salla_app')
+
+ORDER_EVENTS_TOPIC = 'order_events'
+
+# أنواع أحداث الطلبات المرسلة للصفحات المفتوحة
+ORDER_CREATED = 'order_created'
+STATUS_CHANGED = 'status_changed'
+ORDER_ASSIGNED = 'assigned'
+NOTE_FLAGGED = 'note_flagged'
+CUSTOM_STATUS_CHANGED = 'custom_status'
+
+# حد NOTIFY في PostgreSQL هو 8000 بايت لذا تُقسم الدفعات الكبيرة
+MAX_IDS_PER_EVENT = 150
+
+
+class OrderEventBroker:
+    """توزيع أحداث تغيير الطلبات على اتصالات SSE المفتوحة لكل متجر"""
+
+    def __init__(self, queue_size=200, buffer_size=200):
+        self.queue_size = queue_size
+        self.buffer_size = buffer_size
+        self._subscribers = {}
+        self._recent = {}
+        self._lock = Lock()
+
+    def init_app(self, app):
+        """تهيئة الموزع وربطه بناقل الأحداث"""
+        self.queue_size = app.config.get('ORDER_EVENTS_QUEUE_SIZE', self.queue_size)
+        self.buffer_size = app.config.get('ORDER_EVENTS_BUFFER_SIZE', self.buffer_size)
+        invalidation_bus.subscribe_events(self._on_bus_event)
+
+    def subscribe(self, store_id):
+        """تسجيل مستمع جديد وإرجاع طابور الأحداث الخاص به"""
+        queue = Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(str(store_id), set()).add(queue)
+        return queue
+
+    def try_subscribe(self, store_id, max_subscribers):
+        """حجز مكان مستمع ذرياً ضمن الحد الأقصى للعامل، و None إن اكتمل العدد"""
+        with self._lock:
+            if sum(len(queues) for queues in self._subscribers.values()) >= max_subscribers:
+                return None
+            queue = Queue(maxsize=self.queue_size)
+            self._subscribers.setdefault(str(store_id), set()).add(queue)
+        return queue
+
+    def unsubscribe(self, store_id, queue):
+        """إلغاء تسجيل مستمع"""
+        with self._lock:
+            queues = self._subscribers.get(str(store_id))
+            if queues:
+                queues.discard(queue)
+                if not queues:
+                    self._subscribers.pop(str(store_id), None)
+
+    def publish(self, store_id, event_type, order_ids, city=None, **fields):
+        """نشر حدث لطلب أو مجموعة طلبات (يُستدعى بعد commit)"""
+        order_ids = [str(order_id) for order_id in order_ids if order_id is not None]
+        if not order_ids or store_id is None:
+            return
+
+        # نطاق مدير التوصيل يعتمد على المدينة، فتُقسم الدفعة حسب مدينة كل طلب
+        if city is None:
+            cities = self._order_cities(order_ids)
+            groups = {}
+            for order_id in order_ids:
+                groups.setdefault(cities.get(order_id) or '', []).append(order_id)
+        else:
+            groups = {city: order_ids}
+
+        try:
+            for group_city, group_ids in groups.items():
+                for start in range(0, len(group_ids), MAX_IDS_PER_EVENT):
+                    event = {
+                        'type': event_type,
+                        'order_ids': group_ids[start:start + MAX_IDS_PER_EVENT],
+                        'city': group_city,
+                        'ts': time.time()
+                    }
+                    event.update(fields)
+                    invalidation_bus.publish_event(store_id, ORDER_EVENTS_TOPIC, event)
+        except Exception as e:
+            logger.warning(f"⚠️ فشل نشر حدث {event_type} للمتجر {store_id}: {str(e)}")
+
+    def recent(self, store_id, since):
+        """الأحداث الأحدث من since (وقت النشر) للصفحات التي تعمل بالاستطلاع بدلاً من SSE"""
+        with self._lock:
+            events = list(self._recent.get(str(store_id), ()))
+        return [event for event in events if event.get('ts', 0) > since]
+
+    def subscribers_count(self, store_id=None):
+        """عدد الاتصالات المفتوحة"""
+        with self._lock:
+            if store_id is not None:
+                return len(self._subscribers.get(str(store_id), ()))
+            return sum(len(queues) for queues in self._subscribers.values())
+
+    def _on_bus_event(self, store_id, topic, data):
+        if topic != ORDER_EVENTS_TOPIC:
+            return
+
+        with self._lock:
+            queues = list(self._subscribers.get(str(store_id), ()))
+            # كل عامل يستقبل كل الأحداث، فيحتفظ بآخرها لطلبات الاستطلاع
+            recent = self._recent.get(str(store_id))
+            if recent is None:
+                recent = self._recent[str(store_id)] = deque(maxlen=self.buffer_size)
+            recent.append(data)
+
+        for queue in queues:
+            try:
+                queue.put_nowait(data)
+            except Full:
+                # المستمع البطيء يفقد الأحداث القديمة بدلاً من حجز الذاكرة
+                logger.debug(f"طابور أحداث ممتلئ للمتجر {store_id}، تم تجاهل الحدث")
+
+    @staticmethod
+    def _order_cities(order_ids):
+        """مدن الطلبات باستعلام واحد: {order_id: city}"""
+        from app.models import OrderAddress
+        try:
+            rows = OrderAddress.query.with_entities(OrderAddress.order_id, OrderAddress.city).filter(
+                OrderAddress.order_id.in_(order_ids)
+            ).all()
+        except Exception:
+            return {}
+        return {str(order_id): city for order_id, city in rows}
+
+
+# إنشاء نسخة عامة من الخدمة
+order_events = OrderEventBroker()
@@ -0,0 +1,52 @@
+import os
+import shutil
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def merge_pdf_files(paths, output_path):
+    """دمج ملفات PDF بالترتيب في ملف واحد عبر pdfium، ويُرجع حجم الناتج.
+    يُستدعى داخل عملية من مجموعة التوليد لأن pdfium غير آمن مع الخيوط"""
+    import pypdfium2 as pdfium
+
+    merged = pdfium.PdfDocument.new()
+    sources = []
+    try:
+        for path in paths:
+            source = pdfium.PdfDocument(path)
+            sources.append(source)
+            merged.import_pages(source)
+
+        tmp_path = f"{output_path}.tmp"
+        merged.save(tmp_path)
+        os.replace(tmp_path, output_path)
+    finally:
+        merged.close()
+        for source in sources:
+            source.close()
+    return os.path.getsize(output_path)
+
+
+def pin_file(source_path, pinned_path):
+    """ربط ثابت (أو نسخ) لملف حتى لا يختفي أثناء الدمج إن حُذف من الذاكرة، ويُرجع False إن لم يوجد"""
+    try:
+        os.link(source_path, pinned_path)
+    except FileNotFoundError:
+        return False
+    except OSError:
+        # نظام ملفات مختلف
+        try:
+            shutil.copyfile(source_path, pinned_path)
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def iter_file(path, chunk_size=READ_CHUNK_SIZE):
+    """قراءة ملف على دفعات للإرسال المتدفق"""
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            yield data
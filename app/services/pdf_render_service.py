@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import uuid
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock, Thread
+
+from .pdf_merge import merge_pdf_files, pin_file, iter_file
+from .print_fragment_cache import print_fragment_cache
+from .print_context import get_print_context, warm_print_context
+from .print_image_cache import print_image_cache, cached_url_fetcher
+from .qr_store import qr_store
+from .storage_service import do_storage
+
+logger = logging.getLogger('salla_app')
+
+JOB_PENDING = 'pending'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+def init_render_process(image_cache_dir, qr_cache_dir, storage_settings=None):
+    """تهيئة عملية التوليد: مجلدات ذاكرة الصور ورموز QR وواجهة التخزين وسياق الطباعة"""
+    print_image_cache.cache_dir = image_cache_dir
+    qr_store.cache_dir = qr_cache_dir
+    if storage_settings:
+        # حتى يقرأ cached_url_fetcher كائنات التخزين المحلية من القرص بدلاً من الشبكة
+        try:
+            do_storage.configure(storage_settings)
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر تهيئة التخزين في عملية التوليد: {str(e)}")
+    warm_print_context()
+
+
+def render_html_to_pdf(html, base_url, output_path, render_options=None, template=None):
+    """تحويل HTML إلى PDF داخل عملية منفصلة وكتابته مباشرة إلى الملف"""
+    from weasyprint import HTML
+
+    context = get_print_context()
+    started = time.monotonic()
+    HTML(string=html, base_url=base_url, url_fetcher=cached_url_fetcher).write_pdf(
+        output_path,
+        stylesheets=context.stylesheets_for(template),
+        font_config=context.font_config,
+        **(render_options or {})
+    )
+    return {
+        'size': os.path.getsize(output_path),
+        'render_seconds': round(time.monotonic() - started, 3)
+    }
+
+
+def render_fragments_to_pdf(fragments, base_url, render_options=None, template=None):
+    """تحويل عدة مستندات صغيرة (مستند لكل طلب) في استدعاء واحد للعملية"""
+    for html, output_path in fragments:
+        render_html_to_pdf(html, base_url, output_path, render_options, template)
+    return len(fragments)
+
+
+class PdfRenderService:
+    """خدمة توليد PDF عبر مجموعة عمليات مع مهام قابلة للمتابعة"""
+
+    def __init__(self):
+        self.max_workers = 2
+        self.jobs_dir = '/tmp/pdf_jobs'
+        self.job_ttl = 3600
+        self.render_options = {'jpeg_quality': 80}
+        self.chunk_size = 50
+        self.render_timeout = 300
+        self._executor = None
+        self._executor_pid = None
+        self._lock = Lock()
+
+    def init_app(self, app):
+        """تهيئة الخدمة مع التطبيق"""
+        self.max_workers = max(1, int(app.config.get('PDF_GENERATION_WORKERS', self.max_workers)))
+        self.jobs_dir = app.config.get('PDF_JOBS_DIR', self.jobs_dir)
+        self.job_ttl = app.config.get('PDF_JOB_TTL', self.job_ttl)
+        # خيارات write_pdf: جودة JPEG مع optimize_images و dpi من WEASYPRINT_OPTIONS
+        options = app.config.get('WEASYPRINT_OPTIONS', {})
+        self.render_options = {'jpeg_quality': app.config.get('PDF_JPEG_QUALITY', 80)}
+        self.render_options.update({key: options[key] for key in ('optimize_images', 'dpi') if key in options})
+        self.chunk_size = max(1, int(app.config.get('PDF_CHUNK_SIZE', self.chunk_size)))
+        self.render_timeout = app.config.get('PDF_RENDER_TIMEOUT', self.render_timeout)
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+    @property
+    def executor(self):
+        """مجموعة العمليات تُنشأ بشكل كسول لكل عامل gunicorn"""
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                # forkserver آمن مع الخيوط داخل عامل gunicorn
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context(method),
+                    initializer=init_render_process,
+                    initargs=(print_image_cache.cache_dir, qr_store.cache_dir, do_storage.settings)
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    # ------ المهام ------
+
+    def _meta_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def pdf_path(self, job_id):
+        """مسار ملف PDF الناتج للمهمة"""
+        return os.path.join(self.jobs_dir, f"{job_id}.pdf")
+
+    def _write_meta(self, job_id, meta):
+        # كتابة ذرية حتى لا يقرأ عامل آخر ملفاً ناقصاً
+        tmp_path = f"{self._meta_path(job_id)}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self._meta_path(job_id))
+
+    def get_job(self, job_id):
+        """قراءة حالة المهمة (مشتركة بين العمال عبر القرص)"""
+        if not job_id or not job_id.isalnum():
+            return None
+        try:
+            with open(self._meta_path(job_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def split(self, items):
+        """تقسيم العناصر إلى أجزاء بحجم PDF_CHUNK_SIZE"""
+        return [items[i:i + self.chunk_size] for i in range(0, len(items), self.chunk_size)]
+
+    def _iter_merged_file(self, paths, batch_id):
+        """دمج الأجزاء بالترتيب داخل مجموعة العمليات ثم إخراج الملف الناتج على دفعات"""
+        merged_path = os.path.join(self.jobs_dir, f"{batch_id}.merged")
+        try:
+            size = self.executor.submit(merge_pdf_files, paths, merged_path).result(timeout=self.render_timeout)
+            logger.info(f"✅ تم دمج {len(paths)} جزء PDF بحجم {size} بايت")
+            yield from iter_file(merged_path)
+        finally:
+            for leftover in (merged_path, f"{merged_path}.tmp"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    def iter_merged(self, html_chunks, base_url=None, template=None):
+        """توليد الأجزاء بالتوازي ثم إخراج الملف المدمج"""
+        batch_id = uuid.uuid4().hex
+        paths = [os.path.join(self.jobs_dir, f"{batch_id}_{index}.part") for index in range(len(html_chunks))]
+        futures = [
+            self.executor.submit(render_html_to_pdf, html, base_url, path, self.render_options, template)
+            for html, path in zip(html_chunks, paths)
+        ]
+        try:
+            for future in futures:
+                future.result(timeout=self.render_timeout)
+
+            # جزء واحد لا يحتاج دمجاً
+            if len(paths) == 1:
+                yield from iter_file(paths[0])
+                return
+
+            yield from self._iter_merged_file(paths, batch_id)
+        finally:
+            for future in futures:
+                future.cancel()
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def iter_cached(self, fragments, base_url=None, template=None):
+        """تجميع PDF من صفحات الطلبات المخزنة وتوليد الطلبات المتغيرة فقط (fragments: [(مفتاح, html أو دالة تولده)])"""
+        batch_id = uuid.uuid4().hex
+        sources = []
+        misses = []
+        for index, (key, html) in enumerate(fragments):
+            cached_path = print_fragment_cache.get(key)
+            if cached_path:
+                sources.append((key, html, cached_path, False))
+            else:
+                # html قد يكون دالة توليد لطلب كان مخزناً عند تجهيز الدفعة
+                html = html() if callable(html) else html
+                path = os.path.join(self.jobs_dir, f"{batch_id}_{index}.part")
+                sources.append((key, html, path, True))
+                misses.append((html, path))
+
+        futures = {}
+        for group in self.split(misses):
+            future = self.executor.submit(render_fragments_to_pdf, group, base_url, self.render_options, template)
+            futures.update((path, future) for _, path in group)
+
+        logger.info(f"🔄 تجميع PDF لـ {len(fragments)} طلب: {len(fragments) - len(misses)} من الذاكرة و {len(misses)} للتوليد")
+        # نسخ مثبتة من ملفات الذاكرة حتى لا يحذفها الإخلاء قبل انتهاء الدمج
+        pinned = []
+        try:
+            paths = []
+            for index, (key, html, path, is_miss) in enumerate(sources):
+                if is_miss:
+                    futures[path].result(timeout=self.render_timeout)
+                    path = print_fragment_cache.put(key, path) or path
+                pinned_path = os.path.join(self.jobs_dir, f"{batch_id}_{index}.pin")
+                if not pin_file(path, pinned_path):
+                    # حُذف من الذاكرة أثناء التجميع: توليده مجدداً
+                    html = html() if callable(html) else html
+                    self.executor.submit(
+                        render_html_to_pdf, html, base_url, pinned_path, self.render_options, template
+                    ).result(timeout=self.render_timeout)
+                pinned.append(pinned_path)
+                paths.append(pinned_path)
+
+            if len(paths) == 1:
+                yield from iter_file(paths[0])
+            else:
+                yield from self._iter_merged_file(paths, batch_id)
+        finally:
+            for future in futures.values():
+                future.cancel()
+            for path in pinned + [path for _, path in misses]:
+                if os.path.exists(path):
+                    os.remove(path)
+            if misses:
+                print_fragment_cache.evict()
+
+    def submit(self, pdf_stream, store_id, filename, order_count=0):
+        """تشغيل مولد PDF (iter_merged أو iter_cached) في الخلفية وإرجاع معرف المهمة"""
+        self.cleanup_expired()
+
+        job_id = uuid.uuid4().hex
+        meta = {
+            'job_id': job_id,
+            'status': JOB_PENDING,
+            'store_id': str(store_id),
+            'filename': filename,
+            'order_count': order_count,
+            'created_at': time.time()
+        }
+        self._write_meta(job_id, meta)
+
+        Thread(target=self._run_job, args=(job_id, meta, pdf_stream), daemon=True).start()
+        logger.info(f"🔄 تم إرسال مهمة PDF {job_id} ({order_count} طلب)")
+        return job_id
+
+    def _run_job(self, job_id, meta, pdf_stream):
+        started = time.monotonic()
+        meta = dict(meta)
+        tmp_path = f"{self.pdf_path(job_id)}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                for data in pdf_stream:
+                    f.write(data)
+            os.replace(tmp_path, self.pdf_path(job_id))
+            meta.update(
+                status=JOB_DONE,
+                size=os.path.getsize(self.pdf_path(job_id)),
+                render_seconds=round(time.monotonic() - started, 3)
+            )
+            logger.info(f"✅ اكتملت مهمة PDF {job_id} بحجم {meta['size']} بايت في {meta['render_seconds']} ثانية")
+        except Exception as e:
+            meta.update(status=JOB_FAILED, error=str(e))
+            logger.error(f"❌ فشلت مهمة PDF {job_id}: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        meta['finished_at'] = time.time()
+        self._write_meta(job_id, meta)
+
+    def render(self, html_chunks, base_url=None, template=None):
+        """توليد متزامن عبر مجموعة العمليات وإرجاع البايتات كاملة"""
+        return b''.join(self.iter_merged(html_chunks, base_url, template))
+
+    def cleanup_expired(self):
+        """حذف ملفات المهام المنتهية"""
+        cutoff = time.time() - self.job_ttl
+        try:
+            for name in os.listdir(self.jobs_dir):
+                path = os.path.join(self.jobs_dir, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except OSError:
+                    continue
+        except OSError as e:
+            logger.warning(f"⚠️ تعذر تنظيف مجلد مهام PDF: {str(e)}")
+
+
+# إنشاء نسخة عامة من الخدمة
+pdf_render_service = PdfRenderService()
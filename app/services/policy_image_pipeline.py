@@ -0,0 +1,206 @@
+import io
+import os
+import uuid
+import logging
+import threading
+from queue import Queue, Full
+
+logger = logging.getLogger('salla_app')
+
+POLICY_IMAGE_FORMATS = {
+    'webp': ('WEBP', 'image/webp', '.webp'),
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg')
+}
+
+
+class PolicyImagePipeline:
+    """تطبيع صور البواليص المرفوعة في الخلفية: تدوير حسب EXIF، حذف البيانات الوصفية،
+    تصغير لدقة الملصق، ونسخة رئيسية مضغوطة + صورة مصغرة لقوائم العرض"""
+
+    def __init__(self, max_px=1400, thumb_px=240, image_format='webp', quality=80, workers=2, queue_size=2000):
+        self.max_px = max_px
+        self.thumb_px = thumb_px
+        self.image_format = image_format
+        self.quality = quality
+        self.workers = workers
+        self.queue_size = queue_size
+        self.enabled = True
+        self._app = None
+        self._queue = None
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.dropped = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    def init_app(self, app):
+        """تهيئة المرحلة مع التطبيق (الخيوط تبدأ عند أول رفع في كل عملية)"""
+        self.max_px = app.config.get('POLICY_IMAGE_MAX_PX', self.max_px)
+        self.thumb_px = app.config.get('POLICY_IMAGE_THUMB_PX', self.thumb_px)
+        self.image_format = app.config.get('POLICY_IMAGE_FORMAT', self.image_format)
+        if self.image_format not in POLICY_IMAGE_FORMATS:
+            self.image_format = 'webp'
+        self.quality = app.config.get('POLICY_IMAGE_QUALITY', self.quality)
+        self.workers = app.config.get('POLICY_IMAGE_WORKERS', self.workers)
+        self.enabled = app.config.get('POLICY_IMAGE_PIPELINE_ENABLED', self.enabled)
+        self._app = app
+
+    def _ensure_started(self):
+        # بعد fork في gunicorn لا تنتقل الخيوط للعامل، فيُنشأ طابور وخيوط لكل عملية
+        if self._threads and self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+            return
+        with self._lock:
+            if self._threads and self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+                return
+            self._queue = Queue(maxsize=self.queue_size)
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._run, name=f'policy-image-{index}', daemon=True)
+                for index in range(max(1, self.workers))
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def enqueue(self, order_id, store_id, image_url):
+        """إضافة بوليصة مرفوعة لطابور التطبيع (يُستدعى بعد commit)"""
+        if not self.enabled or self._app is None or not image_url:
+            return
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((str(order_id), store_id, image_url))
+        except Full:
+            # تبقى الصورة الأصلية كما هي
+            self.dropped += 1
+            logger.warning(f"⚠️ طابور تطبيع البواليص ممتلئ، تم تجاهل الطلب {order_id}")
+
+    def _run(self):
+        while True:
+            order_id, store_id, image_url = self._queue.get()
+            try:
+                with self._app.app_context():
+                    self.process(order_id, store_id, image_url)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"❌ خطأ في تطبيع بوليصة الطلب {order_id}: {str(e)}")
+
+    def normalize(self, data):
+        """النسخة الرئيسية والمصغرة (bytes) من صورة أصلية"""
+        from PIL import Image, ImageOps
+
+        pil_format = POLICY_IMAGE_FORMATS[self.image_format][0]
+        with Image.open(io.BytesIO(data)) as source:
+            image = ImageOps.exif_transpose(source)
+            # إعادة البناء من البكسلات فقط يحذف EXIF و GPS و ICC المضمنة
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            image.thumbnail((self.max_px, self.max_px), Image.LANCZOS)
+
+            master = io.BytesIO()
+            image.save(master, format=pil_format, quality=self.quality, optimize=True)
+
+            image.thumbnail((self.thumb_px, self.thumb_px), Image.LANCZOS)
+            thumbnail = io.BytesIO()
+            image.save(thumbnail, format=pil_format, quality=70, optimize=True)
+
+        return master.getvalue(), thumbnail.getvalue()
+
+    def process(self, order_id, store_id, image_url):
+        """تطبيع بوليصة طلب واستبدال رابطها إن لم تتغير أثناء المعالجة"""
+        from sqlalchemy import text
+        from app.models import db
+        from .storage_service import do_storage
+
+        source_key = do_storage.key_from_url(image_url)
+        if not source_key or source_key.lower().endswith('.pdf'):
+            self.skipped += 1
+            return False
+
+        data = do_storage.get_bytes(source_key)
+        if not data:
+            self.failed += 1
+            return False
+
+        try:
+            master, thumbnail = self.normalize(data)
+        except Exception as e:
+            # ليست صورة يمكن قراءتها (PDF باسم آخر مثلاً) فتبقى كما هي
+            self.skipped += 1
+            logger.info(f"ℹ️ تخطي تطبيع بوليصة الطلب {order_id}: {str(e)}")
+            return False
+
+        _, content_type, extension = POLICY_IMAGE_FORMATS[self.image_format]
+        folder = source_key.rsplit('/', 1)[0] if '/' in source_key else 'shipping-policies'
+        name = uuid.uuid4().hex
+        uploads = do_storage.upload_many([
+            {
+                'object_key': f"{folder}/{name}{extension}",
+                'body': master,
+                'content_type': content_type,
+                'cache_control': 'public, max-age=31536000, immutable'
+            },
+            {
+                'object_key': f"{folder}/{name}_thumb{extension}",
+                'body': thumbnail,
+                'content_type': content_type,
+                'cache_control': 'public, max-age=31536000, immutable'
+            }
+        ])
+        if not all(upload['url'] for upload in uploads):
+            for upload in uploads:
+                if upload['url']:
+                    do_storage.delete_object(upload['object_key'])
+            self.failed += 1
+            return False
+
+        # الشرط على الرابط القديم يمنع الكتابة فوق بوليصة أُعيد رفعها أثناء المعالجة
+        result = db.session.execute(text("""
+            UPDATE salla_orders
+            SET shipping_policy_image = :master_url,
+                shipping_policy_thumbnail = :thumbnail_url
+            WHERE id = :order_id AND store_id = :store_id AND shipping_policy_image = :image_url
+        """), {
+            'master_url': uploads[0]['url'],
+            'thumbnail_url': uploads[1]['url'],
+            'order_id': order_id,
+            'store_id': store_id,
+            'image_url': image_url
+        })
+        db.session.commit()
+
+        if result.rowcount:
+            do_storage.delete_object(source_key)
+        else:
+            for upload in uploads:
+                do_storage.delete_object(upload['object_key'])
+            self.skipped += 1
+            return False
+
+        with self._lock:
+            self.processed += 1
+            self.bytes_before += len(data)
+            self.bytes_after += len(master) + len(thumbnail)
+        logger.info(f"🖼️ تم تطبيع بوليصة الطلب {order_id}: {len(data) // 1024}KB → {len(master) // 1024}KB")
+        return True
+
+    def stats(self):
+        """إحصائيات المرحلة"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'pending': self._queue.qsize() if self._queue is not None else 0,
+                'processed': self.processed,
+                'skipped': self.skipped,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'bytes_before': self.bytes_before,
+                'bytes_after': self.bytes_after
+            }
+
+
+# إنشاء نسخة عامة من الخدمة
+policy_image_pipeline = PolicyImagePipeline()
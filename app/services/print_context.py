@@ -0,0 +1,159 @@
+import os
+import time
+import shutil
+import subprocess
+import hashlib
+import logging
+
+logger = logging.getLogger('salla_app')
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
+
+# ورقة الأنماط المحللة مسبقاً لكل قالب طباعة (تُحذف من HTML عند pdf_mode)
+PRINT_STYLESHEETS = {
+    'print_orders.html': 'css/print_orders.css',
+    'print_addresses.html': 'css/print_addresses.css'
+}
+
+# الخطوط التي تطلبها أوراق أنماط الطباعة، وتُحل عبر fontconfig في النظام (لا توجد خطوط مضمنة في المشروع)
+PRINT_FONT_FAMILIES = ('Tajawal',)
+
+# طلب تجريبي يناسب قالبي الطلبات والعناوين لقياس الأداء
+SAMPLE_ORDER = {
+    'id': '1000001',
+    'reference_id': '1000001',
+    'created_at': '2024-01-01',
+    'customer_name': 'عميل تجريبي',
+    'customer': {'name': 'عميل تجريبي', 'email': '', 'mobile': '0500000000'},
+    'barcode': '',
+    'order_items': [{
+        'id': '1', 'name': 'منتج تجريبي', 'sku': 'SKU-1', 'quantity': 2, 'currency': 'SAR',
+        'price': {'amount': 100, 'currency': 'SAR'}, 'main_image': '', 'options': [], 'notes': ''
+    }],
+    'address': {'name': 'عميل تجريبي', 'address': 'حي النخيل، شارع 10', 'city': 'الرياض',
+                'country': 'السعودية', 'postal_code': '', 'mobile': '0500000000'}
+}
+
+
+def print_assets_version(template):
+    """بصمة ورقة الأنماط المستخدمة مع القالب"""
+    digest = hashlib.sha256()
+    stylesheet = PRINT_STYLESHEETS.get(template)
+    if stylesheet:
+        with open(os.path.join(STATIC_DIR, stylesheet), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def missing_print_fonts():
+    """خطوط الطباعة غير المثبتة في النظام (قائمة فارغة إن تعذر الفحص)"""
+    if not shutil.which('fc-list'):
+        return []
+    try:
+        output = subprocess.run(['fc-list', ':', 'family'], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return []
+    installed = {family.strip().lower() for line in output.splitlines() for family in line.split(',')}
+    return [family for family in PRINT_FONT_FAMILIES if family.lower() not in installed]
+
+
+class PrintContext:
+    """سياق طباعة لكل عملية: إعدادات خطوط fontconfig مشتركة وأوراق أنماط محللة مرة واحدة"""
+
+    def __init__(self):
+        from weasyprint import CSS
+        from weasyprint.text.fonts import FontConfiguration
+
+        started = time.monotonic()
+        self.font_config = FontConfiguration()
+
+        self.stylesheets = {
+            template: CSS(filename=os.path.join(STATIC_DIR, path), font_config=self.font_config)
+            for template, path in PRINT_STYLESHEETS.items()
+        }
+        self.build_seconds = round(time.monotonic() - started, 3)
+
+        missing = missing_print_fonts()
+        if missing:
+            # بدون الخط يستبدله WeasyPrint بخط آخر فيتغير شكل الطباعة
+            logger.warning(f"⚠️ خطوط الطباعة غير مثبتة في النظام: {', '.join(missing)}")
+
+    def stylesheets_for(self, template):
+        """أوراق الأنماط الجاهزة للقالب"""
+        return [self.stylesheets[template]] if template in self.stylesheets else []
+
+
+_context = None
+_context_pid = None
+
+
+def get_print_context():
+    """سياق الطباعة للعملية الحالية (يُبنى مرة واحدة لكل عامل)"""
+    global _context, _context_pid
+    if _context is None or _context_pid != os.getpid():
+        _context = PrintContext()
+        _context_pid = os.getpid()
+        logger.info(f"✅ تم تجهيز سياق الطباعة في {_context.build_seconds} ثانية (العملية {_context_pid})")
+    return _context
+
+
+def warm_print_context():
+    """تهيئة مسبقة عند بدء عملية التوليد حتى لا يتحملها أول مستند"""
+    try:
+        get_print_context()
+    except Exception as e:
+        logger.warning(f"⚠️ تعذر تجهيز سياق الطباعة مسبقاً: {str(e)}")
+
+
+def benchmark_fixed_cost(html, template, runs=5):
+    """قياس متوسط زمن المستند الواحد بدون السياق المشترك ومعه"""
+    from weasyprint import HTML, CSS
+
+    stylesheet = os.path.join(STATIC_DIR, PRINT_STYLESHEETS[template])
+
+    def without_context():
+        # السلوك السابق: تحليل الأنماط وإعداد الخطوط مع كل مستند
+        HTML(string=html, base_url=STATIC_DIR).write_pdf(stylesheets=[CSS(filename=stylesheet)])
+
+    def with_context():
+        context = get_print_context()
+        HTML(string=html, base_url=STATIC_DIR).write_pdf(
+            stylesheets=context.stylesheets_for(template),
+            font_config=context.font_config
+        )
+
+    def timed(render):
+        render()
+        started = time.monotonic()
+        for _ in range(runs):
+            render()
+        return round((time.monotonic() - started) / runs, 4)
+
+    before = timed(without_context)
+    after = timed(with_context)
+    return {
+        'template': template,
+        'runs': runs,
+        'before_seconds': before,
+        'after_seconds': after,
+        'context_build_seconds': get_print_context().build_seconds
+    }
+
+
+def register_print_commands(app):
+    """أوامر سطر الأوامر الخاصة بالطباعة"""
+    import click
+    from flask import render_template
+
+    @app.cli.command('benchmark-print')
+    @click.option('--runs', default=5, help='عدد مرات التوليد لكل حالة')
+    def benchmark_print(runs):
+        """قياس التكلفة الثابتة لكل مستند طباعة قبل السياق المشترك وبعده"""
+        with app.test_request_context():
+            for template in PRINT_STYLESHEETS:
+                html = render_template(template, orders=[SAMPLE_ORDER], current_time='', pdf_mode=True)
+                result = benchmark_fixed_cost(html, template, runs)
+                click.echo(
+                    f"{template}: قبل {result['before_seconds']} ث، بعد {result['after_seconds']} ث "
+                    f"(تجهيز السياق مرة واحدة {result['context_build_seconds']} ث)"
+                )
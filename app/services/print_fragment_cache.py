@@ -0,0 +1,143 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+from threading import Lock
+
+from .print_context import print_assets_version
+
+logger = logging.getLogger('salla_app')
+
+
+class PrintFragmentCache:
+    """تخزين صفحات PDF المولدة لكل طلب على القرص بمفتاح من محتواها مع حد أقصى للحجم (LRU)"""
+
+    def __init__(self, cache_dir='/tmp/print_fragments', max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = False
+        self._jinja_env = None
+        self._template_versions = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        """تهيئة الذاكرة مع التطبيق"""
+        self.cache_dir = app.config.get('PRINT_FRAGMENT_CACHE_DIR', self.cache_dir)
+        self.max_bytes = int(app.config.get('PRINT_FRAGMENT_CACHE_MAX_MB', self.max_bytes // (1024 * 1024))) * 1024 * 1024
+        self.enabled = app.config.get('PRINT_FRAGMENT_CACHE_ENABLED', self.enabled)
+        self._jinja_env = app.jinja_env
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def template_version(self, template):
+        """بصمة مصدر القالب وأنماطه وخطوطه حتى يُبطل أي تعديل عليها الصفحات المخزنة"""
+        version = self._template_versions.get(template)
+        if version is None:
+            source, _, _ = self._jinja_env.loader.get_source(self._jinja_env, template)
+            digest = hashlib.sha256(source.encode('utf-8'))
+            digest.update(print_assets_version(template).encode())
+            version = digest.hexdigest()[:16]
+            self._template_versions[template] = version
+        return version
+
+    def key(self, template, payload):
+        """مفتاح الطلب: القالب + بيانات الطلب المعالجة (تشمل الباركود/QR)"""
+        digest = hashlib.sha256(self.template_version(template).encode())
+        digest.update(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pdf")
+
+    def exists(self, key):
+        """هل الطلب مخزن؟ (دون احتسابه في الإحصائيات)"""
+        return self.enabled and os.path.exists(self._path(key))
+
+    def get(self, key):
+        """مسار الصفحات المخزنة للطلب أو None"""
+        if not self.enabled:
+            return None
+
+        path = self._path(key)
+        try:
+            # تحديث وقت التعديل يجعل الملف الأحدث استخداماً عند الإخلاء
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put(self, key, source_path):
+        """نقل ملف PDF مولد إلى الذاكرة (يُحذف المصدر)"""
+        if not self.enabled:
+            return None
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(source_path, path)
+        except OSError:
+            # نظام ملفات مختلف: نسخ إلى ملف مؤقت بجانب الهدف ثم استبدال ذري
+            tmp_path = f"{path}.tmp"
+            shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, path)
+            os.remove(source_path)
+        return path
+
+    def evict(self):
+        """حذف الأقدم استخداماً حتى يعود الحجم إلى 90% من الحد الأقصى"""
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return 0
+
+        removed = 0
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self.evictions += removed
+        logger.info(f"🧹 تم حذف {removed} صفحة طباعة مخزنة لتجاوز الحد الأقصى")
+        return removed
+
+    def stats(self):
+        """إحصائيات الاستخدام"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else 0,
+                'evictions': self.evictions,
+                'max_bytes': self.max_bytes,
+                'enabled': self.enabled
+            }
+
+
+# إنشاء نسخة عامة من الخدمة
+print_fragment_cache = PrintFragmentCache()
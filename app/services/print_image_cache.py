@@ -0,0 +1,164 @@
+import io
+import os
+import hashlib
+import logging
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+
+from .qr_store import qr_store
+from .storage_service import do_storage
+
+logger = logging.getLogger('salla_app')
+
+CACHED_FORMATS = (('.jpg', 'image/jpeg'), ('.png', 'image/png'))
+
+# مهلة قصيرة لجلب صورة لم تُجلب مسبقاً أثناء التوليد حتى لا يتعطل المستند على CDN بطيء
+FALLBACK_FETCH_TIMEOUT = 5
+
+
+def _url_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+class PrintImageCache:
+    """ذاكرة قرص لصور المنتجات بمقاس الطباعة تُملأ قبل التوليد ويقرأ منها محرك PDF"""
+
+    def __init__(self, cache_dir='/tmp/weasyprint_cache', max_px=360, jpeg_quality=80):
+        self.cache_dir = cache_dir
+        self.max_px = max_px
+        self.jpeg_quality = jpeg_quality
+        self.timeout = 15
+        self.workers = 8
+
+    def init_app(self, app):
+        """تهيئة الذاكرة مع التطبيق (image_cache_dir من WEASYPRINT_OPTIONS إن وجد)"""
+        options = app.config.get('WEASYPRINT_OPTIONS', {})
+        self.cache_dir = options.get('image_cache_dir', app.config.get('PRINT_IMAGE_CACHE_DIR', self.cache_dir))
+        self.max_px = app.config.get('PRINT_IMAGE_MAX_PX', self.max_px)
+        self.jpeg_quality = app.config.get('PDF_JPEG_QUALITY', self.jpeg_quality)
+        self.timeout = app.config.get('REQUEST_TIMEOUT', self.timeout)
+        self.workers = app.config.get('PRINT_IMAGE_FETCH_WORKERS', self.workers)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def cached_path(self, url):
+        """مسار النسخة المخزنة للصورة ونوعها أو (None, None)"""
+        key = _url_key(url)
+        base = os.path.join(self.cache_dir, key[:2], key)
+        for extension, mime_type in CACHED_FORMATS:
+            if os.path.exists(base + extension):
+                return base + extension, mime_type
+        return None, None
+
+    def _downscale(self, content, downscale=True):
+        """تصغير الصورة لمقاس الطباعة وإرجاع (البايتات, الامتداد)، والباركود يُحفظ PNG بمقاسه الأصلي"""
+        from PIL import Image, ImageOps
+
+        with Image.open(io.BytesIO(content)) as image:
+            image = ImageOps.exif_transpose(image)
+            output = io.BytesIO()
+            if not downscale:
+                # تصغير الباركود أو ضغطه JPEG يفسد قراءته
+                image.save(output, format='PNG', optimize=True)
+                return output.getvalue(), '.png'
+
+            image.thumbnail((self.max_px, self.max_px))
+
+            # الشفافية تحتاج PNG، وغير ذلك JPEG يُضمّن في PDF دون إعادة ترميز
+            if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+                image.save(output, format='PNG', optimize=True)
+                return output.getvalue(), '.png'
+
+            image.convert('RGB').save(output, format='JPEG', quality=self.jpeg_quality, optimize=True, progressive=True)
+            return output.getvalue(), '.jpg'
+
+    def _fetch(self, session, url, downscale=True):
+        response = session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        data, extension = self._downscale(response.content, downscale)
+
+        key = _url_key(url)
+        path = os.path.join(self.cache_dir, key[:2], key + extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return len(response.content), len(data)
+
+    def prefetch(self, urls, downscale=True):
+        """تحميل الصور غير المخزنة بالتوازي قبل بدء التوليد (downscale=False لصور الباركود)"""
+        from app.utils import create_session
+
+        # رموز QR وكائنات التخزين المحلية يقرؤها محرك PDF من القرص مباشرة
+        missing = sorted({
+            url for url in urls
+            if url and url.startswith(('http://', 'https://'))
+            and not qr_store.path_for_url(url)
+            and not do_storage.local_path_for_url(url)
+            and not self.cached_path(url)[0]
+        })
+        if not missing:
+            return 0
+
+        session = create_session()
+        fetched = 0
+        original_bytes = stored_bytes = 0
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(missing)))) as executor:
+            futures = {executor.submit(self._fetch, session, url, downscale): url for url in missing}
+            for future, url in futures.items():
+                try:
+                    original, stored = future.result()
+                    fetched += 1
+                    original_bytes += original
+                    stored_bytes += stored
+                except Exception as e:
+                    logger.warning(f"⚠️ تعذر تخزين صورة الطباعة {url}: {str(e)}")
+
+        logger.info(f"🖼️ تم تخزين {fetched}/{len(missing)} صورة للطباعة ({original_bytes} ← {stored_bytes} بايت)")
+        return fetched
+
+
+# إنشاء نسخة عامة من الخدمة
+print_image_cache = PrintImageCache()
+
+
+def cached_url_fetcher(url, *args, **kwargs):
+    """url_fetcher لـ WeasyPrint: الصور البعيدة من الذاكرة أولاً دون انتظار CDN"""
+    from weasyprint import default_url_fetcher
+
+    if not url.startswith(('http://', 'https://')):
+        return default_url_fetcher(url, *args, **kwargs)
+
+    # رموز QR من المخزن الثابت تُقرأ من القرص مباشرة
+    qr_path = qr_store.path_for_url(url)
+    if qr_path:
+        return {
+            'file_obj': open(qr_path, 'rb'),
+            'mime_type': 'image/png',
+            'redirected_url': url,
+            'filename': os.path.basename(qr_path)
+        }
+
+    # كائنات التخزين الموجودة على القرص (الواجهة المحلية أو الطبقة المحلية أمام S3)
+    storage_path = do_storage.local_path_for_url(url)
+    if storage_path:
+        return {
+            'file_obj': open(storage_path, 'rb'),
+            'mime_type': mimetypes.guess_type(storage_path)[0] or 'application/octet-stream',
+            'redirected_url': url,
+            'filename': os.path.basename(storage_path)
+        }
+
+    path, mime_type = print_image_cache.cached_path(url)
+    if path:
+        return {
+            'file_obj': open(path, 'rb'),
+            'mime_type': mime_type,
+            'redirected_url': url,
+            'filename': os.path.basename(path)
+        }
+
+    # صورة لم تُجلب مسبقاً (أو فشل جلبها): محاولة أخيرة بمهلة قصيرة بدلاً من إسقاطها من المستند
+    logger.warning(f"⚠️ صورة غير موجودة في ذاكرة الطباعة، جلبها أثناء التوليد: {url}")
+    kwargs['timeout'] = min(kwargs.get('timeout', FALLBACK_FETCH_TIMEOUT), FALLBACK_FETCH_TIMEOUT)
+    return default_url_fetcher(url, *args, **kwargs)
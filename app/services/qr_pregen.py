@@ -0,0 +1,97 @@
+import os
+import logging
+import threading
+from queue import Queue, Full, Empty
+
+logger = logging.getLogger('salla_app')
+
+
+class QrPregenerator:
+    """توليد رموز QR في الخلفية عند استلام الطلبات حتى تكون جاهزة قبل الطباعة"""
+
+    def __init__(self, batch_size=100, workers=4, queue_size=10000):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.queue_size = queue_size
+        self.enabled = True
+        self._app = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.generated = 0
+        self.dropped = 0
+
+    def init_app(self, app):
+        """تهيئة المرحلة مع التطبيق (الخيط يبدأ عند أول طلب في كل عملية)"""
+        self.batch_size = app.config.get('QR_PREGEN_BATCH_SIZE', self.batch_size)
+        self.workers = app.config.get('QR_PREGEN_WORKERS', self.workers)
+        self.queue_size = app.config.get('QR_PREGEN_QUEUE_SIZE', self.queue_size)
+        self.enabled = app.config.get('QR_PREGEN_ENABLED', self.enabled)
+        self._app = app
+
+    def _ensure_started(self):
+        # بعد fork في gunicorn لا ينتقل الخيط للعامل، فيُنشأ طابور وخيط لكل عملية
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._queue = Queue(maxsize=self.queue_size)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='qr-pregen', daemon=True)
+            self._thread.start()
+
+    def enqueue(self, order_ids):
+        """إضافة طلبات لطابور التوليد (يُستدعى بعد commit)"""
+        if not self.enabled or self._app is None:
+            return
+
+        order_ids = [str(order_id) for order_id in order_ids if order_id is not None]
+        if not order_ids:
+            return
+
+        self._ensure_started()
+        for index, order_id in enumerate(order_ids):
+            try:
+                self._queue.put_nowait(order_id)
+            except Full:
+                # ما لا يدخل الطابور يُولد عند الطباعة كما في السابق
+                remaining = len(order_ids) - index
+                self.dropped += remaining
+                logger.warning(f"⚠️ طابور توليد QR ممتلئ، تم تجاهل {remaining} طلب")
+                break
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        # انتظار قصير لتجميع طلبات المزامنة والـ Webhook المتتالية في دفعة واحدة
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=0.5))
+            except Empty:
+                break
+        return batch
+
+    def _run(self):
+        from app.utils import bulk_generate_and_store_qr_codes
+
+        while True:
+            batch = self._next_batch()
+            try:
+                with self._app.app_context():
+                    self.generated += len(bulk_generate_and_store_qr_codes(batch, max_workers=self.workers, only_missing=True))
+            except Exception as e:
+                logger.error(f"❌ خطأ في توليد QR في الخلفية: {str(e)}")
+
+    def stats(self):
+        """إحصائيات المرحلة"""
+        return {
+            'enabled': self.enabled,
+            'pending': self._queue.qsize() if self._queue is not None else 0,
+            'generated': self.generated,
+            'dropped': self.dropped
+        }
+
+
+# إنشاء نسخة عامة من الخدمة
+qr_pregen = QrPregenerator()
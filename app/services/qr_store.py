@@ -0,0 +1,262 @@
+import os
+import re
+import base64
+import hashlib
+import logging
+from io import BytesIO
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+
+import qrcode
+
+from .storage_service import do_storage
+
+logger = logging.getLogger('salla_app')
+
+# يتغير عند تعديل إعدادات الرسم حتى لا تُستخدم صور قديمة بنفس المفتاح
+QR_RENDER_VERSION = 'v1-L-10-4'
+
+_QR_FILENAME_RE = re.compile(r'qr_([0-9a-f]{32})\.png$')
+
+
+@lru_cache(maxsize=4096)
+def render_qr_svg(data_str):
+    """رسم QR كـ SVG مضمّن بمسار واحد (يُرسم بدقة في أي DPI دون PIL أو base64)"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        border=4,
+    )
+    qr.add_data(data_str)
+    qr.make(fit=True)
+
+    matrix = qr.get_matrix()
+    size = len(matrix)
+    parts = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < size and row[x]:
+                x += 1
+            parts.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/><path d="{"".join(parts)}" fill="#000"/></svg>'
+    )
+
+
+class QrCodeStore:
+    """مخزن QR بمفتاح ثابت لكل قيمة: ذاكرة LRU داخل العملية + قرص + رفع واحد على الأكثر"""
+
+    def __init__(self, cache_dir='/tmp/qr_codes', max_entries=5000, folder='qrcodes'):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.folder = folder
+        self._urls = OrderedDict()
+        self._lock = Lock()
+        # أقفال موزعة حسب المفتاح حتى لا يُرفع نفس الرمز مرتين من خيطين
+        self._key_locks = [Lock() for _ in range(64)]
+        self.hits = 0
+        self.uploads = 0
+
+    def init_app(self, app):
+        """تهيئة المخزن مع التطبيق"""
+        self.cache_dir = app.config.get('QR_CACHE_DIR', self.cache_dir)
+        self.max_entries = app.config.get('QR_MEMORY_CACHE_SIZE', self.max_entries)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def digest(data_str):
+        """مفتاح ثابت من محتوى الرمز"""
+        return hashlib.sha256(f"{QR_RENDER_VERSION}:{data_str}".encode('utf-8')).hexdigest()[:32]
+
+    def local_path(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], f"qr_{digest}.png")
+
+    def path_for_url(self, url):
+        """الملف المحلي لرابط QR صادر من هذا المخزن (لمحرك PDF) أو None"""
+        match = _QR_FILENAME_RE.search(url or '')
+        if not match:
+            return None
+        path = self.local_path(match.group(1))
+        return path if os.path.exists(path) else None
+
+    @staticmethod
+    def render_png(data_str):
+        """رسم QR كـ PNG"""
+        qr = qrcode.QRCode(
+            version=1,
+            error_correction=qrcode.constants.ERROR_CORRECT_L,
+            box_size=10,
+            border=4,
+        )
+        qr.add_data(data_str)
+        qr.make(fit=True)
+
+        img = qr.make_image(fill_color="black", back_color="white")
+        buffer = BytesIO()
+        img.save(buffer, format='PNG', optimize=True)
+        return buffer.getvalue()
+
+    def _ensure_png(self, data_str, digest):
+        """صورة الرمز على القرص (تُرسم مرة واحدة)"""
+        path = self.local_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(self.render_png(data_str))
+            os.replace(tmp_path, path)
+        return path
+
+    def _remember(self, digest, url):
+        with self._lock:
+            self._urls[digest] = url
+            self._urls.move_to_end(digest)
+            while len(self._urls) > self.max_entries:
+                self._urls.popitem(last=False)
+
+    def get_url(self, data):
+        """رابط QR للقيمة: من الذاكرة أو القرص، ويُرفع مرة واحدة فقط عند أول استخدام"""
+        data_str = str(data).strip()
+        if not data_str:
+            return None
+
+        digest = self.digest(data_str)
+        with self._lock:
+            url = self._urls.get(digest)
+            if url:
+                self._urls.move_to_end(digest)
+                self.hits += 1
+
+        if url:
+            self._ensure_png(data_str, digest)
+            return url
+
+        with self._key_locks[int(digest[:4], 16) % len(self._key_locks)]:
+            path = self._ensure_png(data_str, digest)
+            marker_path = f"{path}.url"
+
+            # عامل آخر على نفس الخادم رفعه مسبقاً
+            if os.path.exists(marker_path):
+                with open(marker_path, encoding='utf-8') as f:
+                    url = f.read().strip()
+
+            if not url:
+                object_key = f"{self.folder}/qr_{digest}.png"
+                if do_storage.object_exists(object_key):
+                    url = do_storage.public_url(object_key)
+                else:
+                    with open(path, 'rb') as f:
+                        url = do_storage.upload_qr_code(BytesIO(f.read()), data_str, object_key=object_key)
+                    if url:
+                        self.uploads += 1
+                        logger.info(f"QR Code uploaded once for: {data_str}")
+
+                if not url:
+                    logger.error(f"Failed to upload QR Code for: {data_str}")
+                    with open(path, 'rb') as f:
+                        return f"data:image/png;base64,{base64.b64encode(f.read()).decode('utf-8')}"
+
+                with open(marker_path, 'w', encoding='utf-8') as f:
+                    f.write(url)
+
+        self._remember(digest, url)
+        return url
+
+    def get_urls(self, values, max_workers=None):
+        """روابط QR لعدة قيم: الموجود من الذاكرة أو القرص، والباقي يُرفع دفعة واحدة بتوازي محدود.
+        القيم التي فشل رفعها لا تظهر في النتيجة"""
+        urls = {}
+        pending = {}
+        for value in values:
+            data_str = str(value).strip()
+            if not data_str or data_str in urls:
+                continue
+
+            digest = self.digest(data_str)
+            with self._lock:
+                url = self._urls.get(digest)
+                if url:
+                    self._urls.move_to_end(digest)
+                    self.hits += 1
+
+            path = self._ensure_png(data_str, digest)
+            if not url and os.path.exists(f"{path}.url"):
+                with open(f"{path}.url", encoding='utf-8') as f:
+                    url = f.read().strip()
+                self._remember(digest, url)
+
+            if url:
+                urls[data_str] = url
+            else:
+                pending[digest] = data_str
+
+        if not pending:
+            return urls
+
+        # المفتاح ثابت من المحتوى فإعادة الرفع آمنة، ولا حاجة لـ head_object لكل رمز
+        items = []
+        for digest in pending:
+            with open(self.local_path(digest), 'rb') as f:
+                items.append({
+                    'object_key': f"{self.folder}/qr_{digest}.png",
+                    'body': f.read(),
+                    'content_type': 'image/png',
+                    'cache_control': 'public, max-age=31536000, immutable'
+                })
+
+        results = do_storage.upload_many(items, max_workers=max_workers)
+        for (digest, data_str), result in zip(pending.items(), results):
+            if not result['url']:
+                continue
+            with open(f"{self.local_path(digest)}.url", 'w', encoding='utf-8') as f:
+                f.write(result['url'])
+            self._remember(digest, result['url'])
+            urls[data_str] = result['url']
+
+        with self._lock:
+            self.uploads += sum(1 for result in results if result['url'])
+        logger.info(f"QR Codes uploaded in bulk: {sum(1 for result in results if result['url'])}/{len(items)}")
+        return urls
+
+    def forget(self, object_key):
+        """نسيان رابط رمز حُذف من التخزين حتى يُرفع من جديد عند الحاجة"""
+        match = _QR_FILENAME_RE.search(object_key or '')
+        if not match:
+            return
+        digest = match.group(1)
+        with self._lock:
+            self._urls.pop(digest, None)
+        try:
+            os.remove(f"{self.local_path(digest)}.url")
+        except OSError:
+            pass
+
+    def svg(self, data, css_class=None):
+        """QR كـ SVG مضمّن للطباعة (من ذاكرة LRU)"""
+        data_str = str(data).strip()
+        if not data_str:
+            return ''
+        svg = render_qr_svg(data_str)
+        if css_class:
+            svg = svg.replace('<svg ', f'<svg class="{css_class}" ', 1)
+        return svg
+
+    def stats(self):
+        """إحصائيات الاستخدام"""
+        with self._lock:
+            stats = {'entries': len(self._urls), 'hits': self.hits, 'uploads': self.uploads}
+        svg_info = render_qr_svg.cache_info()
+        stats.update(svg_entries=svg_info.currsize, svg_hits=svg_info.hits)
+        return stats
+
+
+# إنشاء نسخة عامة من الخدمة
+qr_store = QrCodeStore()
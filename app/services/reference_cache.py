@@ -0,0 +1,127 @@
+import time
+import logging
+from threading import Lock
+from types import SimpleNamespace
+
+from sqlalchemy import inspect as sa_inspect
+
+logger = logging.getLogger('salla_app')
+
+# أنواع البيانات المرجعية المخزنة لكل متجر
+ORDER_STATUSES = 'order_statuses'
+ACTIVE_EMPLOYEES = 'active_employees'
+CUSTOM_STATUSES = 'custom_statuses'
+
+ALL_TOPICS = (ORDER_STATUSES, ACTIVE_EMPLOYEES, CUSTOM_STATUSES)
+
+
+def _snapshot(obj):
+    """نسخة خفيفة من صف ORM لا ترتبط بجلسة قاعدة البيانات"""
+    mapper = sa_inspect(obj).mapper
+    return SimpleNamespace(**{attr.key: getattr(obj, attr.key) for attr in mapper.column_attrs})
+
+
+class ReferenceDataCache:
+    """ذاكرة مؤقتة داخل العملية للبيانات المرجعية لكل متجر مع مدة صلاحية"""
+
+    def __init__(self, ttl=300, fallback_ttl=30):
+        self.ttl = ttl
+        self.fallback_ttl = fallback_ttl
+        self.bus_connected = True
+        self._entries = {}
+        self._versions = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        """تهيئة الذاكرة المؤقتة مع التطبيق"""
+        self.ttl = app.config.get('REFERENCE_CACHE_TTL', self.ttl)
+        self.fallback_ttl = app.config.get('INVALIDATION_FALLBACK_TTL', self.fallback_ttl)
+
+    @property
+    def effective_ttl(self):
+        """مدة الصلاحية الفعلية: أقصر عند انقطاع ناقل الإبطال"""
+        return self.ttl if self.bus_connected else min(self.ttl, self.fallback_ttl)
+
+    def on_bus_state(self, connected):
+        """عند تغير اتصال ناقل الإبطال: تفريغ البيانات لأن أحداثاً قد تكون فاتت"""
+        self.bus_connected = connected
+        self.clear()
+
+    def get(self, store_id, topic, loader):
+        """إرجاع القيمة المخزنة أو تحميلها عبر loader عند انتهاء صلاحيتها"""
+        key = (str(store_id), topic)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return list(entry[1])
+            self.misses += 1
+            version = self._versions.get(key, 0)
+
+        value = [_snapshot(row) for row in loader()]
+
+        with self._lock:
+            # لا تخزن نتيجة حُمّلت قبل إبطال تم أثناء التحميل
+            if self._versions.get(key, 0) == version:
+                self._entries[key] = (now + self.effective_ttl, value)
+        return list(value)
+
+    def invalidate(self, store_id, topic=None):
+        """حذف بيانات متجر من الذاكرة المؤقتة (موضوع محدد أو الكل)"""
+        topics = (topic,) if topic else ALL_TOPICS
+        with self._lock:
+            for t in topics:
+                key = (str(store_id), t)
+                self._entries.pop(key, None)
+                self._versions[key] = self._versions.get(key, 0) + 1
+        logger.info(f"🔄 تم إبطال البيانات المرجعية للمتجر {store_id}: {', '.join(topics)}")
+
+    def clear(self):
+        """تفريغ الذاكرة المؤقتة بالكامل"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """إحصائيات الإصابة والإخفاق"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else 0.0,
+                'entries': len(self._entries),
+                'ttl': self.effective_ttl,
+                'bus_connected': self.bus_connected
+            }
+
+    # ------ دوال الجلب المختصرة ------
+
+    def get_order_statuses(self, store_id):
+        """حالات الطلبات للمتجر مرتبة حسب sort"""
+        from app.models import OrderStatus
+        return self.get(store_id, ORDER_STATUSES, lambda: OrderStatus.query.filter_by(
+            store_id=store_id
+        ).order_by(OrderStatus.sort).all())
+
+    def get_active_employees(self, store_id):
+        """الموظفون النشطون في المتجر"""
+        from app.models import Employee
+        return self.get(store_id, ACTIVE_EMPLOYEES, lambda: Employee.query.filter_by(
+            store_id=store_id,
+            is_active=True
+        ).all())
+
+    def get_custom_statuses(self, store_id):
+        """الحالات المخصصة لجميع موظفي المتجر"""
+        from app.models import EmployeeCustomStatus, Employee
+        return self.get(store_id, CUSTOM_STATUSES, lambda: EmployeeCustomStatus.query.join(Employee).filter(
+            Employee.store_id == store_id
+        ).all())
+
+
+# إنشاء نسخة عامة من الخدمة
+reference_cache = ReferenceDataCache()
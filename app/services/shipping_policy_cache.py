@@ -0,0 +1,217 @@
+import os
+import json
+import glob
+import hashlib
+import logging
+import threading
+from threading import Lock
+
+logger = logging.getLogger('salla_app')
+
+
+class ShippingPolicyCache:
+    """ذاكرة قرص (LRU) لملفات بوالص الشحن حسب الطلب ورقم الشحنة، والمصدر لا يُطلب إلا عند عدم وجود نسخة"""
+
+    def __init__(self, cache_dir='/tmp/shipping_policies', max_bytes=512 * 1024 * 1024, fetch_workers=4):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.fetch_workers = fetch_workers
+        self.max_download_bytes = 20 * 1024 * 1024
+        self.timeout = 30
+        self._session = None
+        self._session_pid = None
+        self._lock = Lock()
+        self._key_locks = [Lock() for _ in range(64)]
+        self._fetch_slots = threading.BoundedSemaphore(fetch_workers)
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        """تهيئة الذاكرة مع التطبيق"""
+        self.cache_dir = app.config.get('SHIPPING_POLICY_CACHE_DIR', self.cache_dir)
+        self.max_bytes = int(app.config.get('SHIPPING_POLICY_CACHE_MAX_MB', self.max_bytes // (1024 * 1024))) * 1024 * 1024
+        self.fetch_workers = app.config.get('SHIPPING_POLICY_FETCH_WORKERS', self.fetch_workers)
+        self._fetch_slots = threading.BoundedSemaphore(self.fetch_workers)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _get_session(self):
+        # جلسة اتصالات مشتركة لكل عملية (لا تُنقل عبر fork)
+        if self._session is None or self._session_pid != os.getpid():
+            from app.utils import create_session
+            with self._lock:
+                if self._session is None or self._session_pid != os.getpid():
+                    self._session = create_session()
+                    self._session_pid = os.getpid()
+        return self._session
+
+    def _order_dir(self, store_id, order_id):
+        return os.path.join(self.cache_dir, str(store_id), hashlib.sha256(str(order_id).encode('utf-8')).hexdigest()[:32])
+
+    def _path(self, store_id, order_id, shipment_index, url):
+        # تغيّر رابط البوليصة (إعادة إصدارها) يعني ملفاً جديداً تلقائياً
+        url_hash = hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self._order_dir(store_id, order_id), f"{int(shipment_index)}_{url_hash}")
+
+    @staticmethod
+    def _read_meta(path):
+        try:
+            with open(f"{path}.json", encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _download(self, path, url, headers):
+        """تحميل البوليصة إلى ملف مؤقت مع حساب البصمة أثناء البث ثم نقله ذرياً"""
+        # حد أقصى للتحميلات المتزامنة من المصدر حتى لا تُستهلك عمال الخادم عند ضغط الطباعة
+        if not self._fetch_slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.rejected += 1
+            raise RuntimeError('تجاوز الحد الأقصى للتحميلات المتزامنة للبوالص')
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            response = self._get_session().get(url, headers=headers, timeout=self.timeout, stream=True)
+            try:
+                response.raise_for_status()
+                content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+                if 'pdf' in content_type or url.lower().split('?')[0].endswith('.pdf'):
+                    content_type = 'application/pdf'
+                content_type = content_type or 'application/octet-stream'
+
+                digest = hashlib.sha256()
+                size = 0
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_content(64 * 1024):
+                        size += len(chunk)
+                        if size > self.max_download_bytes:
+                            raise ValueError('حجم البوليصة أكبر من الحد المسموح')
+                        digest.update(chunk)
+                        f.write(chunk)
+            finally:
+                response.close()
+
+            if not size:
+                raise ValueError('ملف البوليصة فارغ')
+
+            meta = {'content_type': content_type, 'etag': digest.hexdigest(), 'size': size}
+            meta_tmp_path = f"{tmp_path}.json"
+            with open(meta_tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, path)
+            os.replace(meta_tmp_path, f"{path}.json")
+        except Exception:
+            for leftover in (tmp_path, f"{tmp_path}.json"):
+                try:
+                    os.remove(leftover)
+                except OSError:
+                    pass
+            raise
+        finally:
+            self._fetch_slots.release()
+
+        self._written()
+        return meta
+
+    def get(self, store_id, order_id, shipment_index, url, headers=None):
+        """مسار البوليصة المخزنة وبياناتها (النوع والبصمة) أو (None, None) عند الفشل.
+        headers قد تكون دالة تُستدعى عند عدم وجود نسخة فقط (مثل تجديد رمز الوصول)"""
+        path = self._path(store_id, order_id, shipment_index, url)
+        key = hashlib.sha256(path.encode('utf-8')).hexdigest()
+
+        with self._key_locks[int(key[:4], 16) % len(self._key_locks)]:
+            meta = self._read_meta(path) if os.path.exists(path) else None
+            if meta:
+                with self._lock:
+                    self.hits += 1
+            else:
+                with self._lock:
+                    self.misses += 1
+                try:
+                    meta = self._download(path, url, (headers() if callable(headers) else headers) or {})
+                except Exception as e:
+                    logger.warning(f"⚠️ فشل تحميل بوليصة الطلب {order_id}: {str(e)}")
+                    return None, None
+
+        try:
+            # تحديث وقت التعديل يجعل الملف الأحدث استخداماً عند الإخلاء
+            os.utime(path)
+        except OSError:
+            pass
+        return path, meta
+
+    def invalidate(self, store_id, order_id):
+        """حذف البوالص المخزنة لطلب (عند تغيير بوليصته في Webhook تحديث الطلب)"""
+        removed = 0
+        for path in glob.glob(os.path.join(self._order_dir(store_id, order_id), '*')):
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def _written(self):
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % 50 == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """حذف الأقدم استخداماً حتى يعود الحجم إلى 90% من الحد الأقصى"""
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith('.json') or name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return 0
+
+        removed = 0
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            for stale in (path, f"{path}.json"):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self.evictions += removed
+        logger.info(f"🧹 تم حذف {removed} بوليصة من الذاكرة لتجاوز الحد الأقصى")
+        return removed
+
+    def stats(self):
+        """إحصائيات الاستخدام"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else 0,
+                'rejected': self.rejected,
+                'evictions': self.evictions,
+                'fetch_workers': self.fetch_workers,
+                'max_bytes': self.max_bytes
+            }
+
+
+# إنشاء نسخة عامة من الخدمة
+shipping_policy_cache = ShippingPolicyCache()
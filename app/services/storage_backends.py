@@ -0,0 +1,348 @@
+import os
+import time
+import logging
+import mimetypes
+from abc import ABC, abstractmethod
+from threading import Lock
+
+logger = logging.getLogger('salla_app')
+
+
+class StorageBackend(ABC):
+    """واجهة موحدة للتخزين: المفاتيح نصية بصيغة folder/name، والأخطاء تُرفع للمستدعي"""
+
+    name = 'base'
+    supports_presigned = False
+
+    @abstractmethod
+    def put(self, object_key, body, content_type=None, cache_control=None, acl='public-read'):
+        ...
+
+    @abstractmethod
+    def get(self, object_key):
+        """المحتوى كـ bytes أو None إن لم يوجد"""
+
+    @abstractmethod
+    def head(self, object_key):
+        """{'size', 'content_type'} أو None إن لم يوجد"""
+
+    @abstractmethod
+    def delete(self, object_key):
+        ...
+
+    def local_path(self, object_key):
+        """مسار ملف محلي للكائن إن وُجد (للقراءة بدون شبكة) أو None"""
+        return None
+
+    @abstractmethod
+    def iter_objects(self, prefix, page_size=1000):
+        """صفحات الكائنات تحت بادئة: قوائم من {'key', 'size', 'last_modified' (epoch)}"""
+
+    def delete_many(self, object_keys):
+        """حذف مجموعة مفاتيح، ويعيد قائمة المفاتيح التي فشل حذفها"""
+        failed = []
+        for object_key in object_keys:
+            try:
+                self.delete(object_key)
+            except (OSError, ValueError):
+                failed.append(object_key)
+        return failed
+
+    def stats(self):
+        return {'backend': self.name}
+
+
+class S3Backend(StorageBackend):
+    """Spaces أو أي خدمة متوافقة مع S3 عبر boto3"""
+
+    name = 's3'
+    supports_presigned = True
+
+    def __init__(self, client, bucket_name):
+        self.client = client
+        self.bucket_name = bucket_name
+
+    def put(self, object_key, body, content_type=None, cache_control=None, acl='public-read'):
+        extra_args = {'ACL': acl, 'ContentType': content_type or 'application/octet-stream'}
+        if cache_control:
+            extra_args['CacheControl'] = cache_control
+        self.client.put_object(Bucket=self.bucket_name, Key=object_key, Body=body, **extra_args)
+
+    def get(self, object_key):
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.client.get_object(Bucket=self.bucket_name, Key=object_key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+        return response['Body'].read()
+
+    def head(self, object_key):
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.client.head_object(Bucket=self.bucket_name, Key=object_key)
+        except ClientError:
+            return None
+        return {'size': response.get('ContentLength', 0), 'content_type': response.get('ContentType', '')}
+
+    def delete(self, object_key):
+        self.client.delete_object(Bucket=self.bucket_name, Key=object_key)
+
+    def iter_objects(self, prefix, page_size=1000):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix, PaginationConfig={'PageSize': page_size}):
+            yield [
+                {'key': item['Key'], 'size': item['Size'], 'last_modified': item['LastModified'].timestamp()}
+                for item in page.get('Contents', [])
+            ]
+
+    def delete_many(self, object_keys):
+        # delete_objects يقبل 1000 مفتاح كحد أقصى في الطلب الواحد
+        failed = []
+        object_keys = list(object_keys)
+        for start in range(0, len(object_keys), 1000):
+            batch = object_keys[start:start + 1000]
+            response = self.client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+            failed.extend(error['Key'] for error in response.get('Errors', []))
+        return failed
+
+
+class LocalFilesystemBackend(StorageBackend):
+    """ملفات على القرص المحلي، مع حد أقصى اختياري للحجم (LRU) عند استخدامه كطبقة أمام S3"""
+
+    name = 'local'
+
+    def __init__(self, root, max_bytes=0):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._writes = 0
+        self.evictions = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, object_key):
+        path = os.path.abspath(os.path.join(self.root, object_key.lstrip('/')))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f'مفتاح غير صالح: {object_key}')
+        return path
+
+    def put(self, object_key, body, content_type=None, cache_control=None, acl='public-read'):
+        path = self._path(object_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+        if self.max_bytes:
+            with self._lock:
+                self._writes += 1
+                evict = self._writes % 200 == 0
+            if evict:
+                self.evict()
+
+    def get(self, object_key):
+        path = self._path(object_key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if self.max_bytes:
+            # تحديث وقت التعديل يجعل الملف الأحدث استخداماً عند الإخلاء
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return data
+
+    def head(self, object_key):
+        try:
+            size = os.path.getsize(self._path(object_key))
+        except OSError:
+            return None
+        return {'size': size, 'content_type': mimetypes.guess_type(object_key)[0] or 'application/octet-stream'}
+
+    def delete(self, object_key):
+        try:
+            os.remove(self._path(object_key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, object_key):
+        path = self._path(object_key)
+        return path if os.path.exists(path) else None
+
+    def iter_objects(self, prefix, page_size=1000):
+        page = []
+        for root, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                object_key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if not object_key.startswith(prefix):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                page.append({'key': object_key, 'size': stat.st_size, 'last_modified': stat.st_mtime})
+                if len(page) >= page_size:
+                    yield page
+                    page = []
+        if page:
+            yield page
+
+    def evict(self):
+        """حذف الأقدم استخداماً حتى يعود الحجم إلى 90% من الحد الأقصى"""
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return 0
+
+        removed = 0
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self.evictions += removed
+        logger.info(f"🧹 تم حذف {removed} ملف من طبقة التخزين المحلية لتجاوز الحد الأقصى")
+        return removed
+
+    def stats(self):
+        return {'backend': self.name, 'root': self.root, 'max_bytes': self.max_bytes, 'evictions': self.evictions}
+
+
+class MemoryBackend(StorageBackend):
+    """تخزين داخل الذاكرة لاختبارات الحمل والتشغيل بدون شبكة (لا يُشارك بين العمال)"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._objects = {}
+        self._lock = Lock()
+
+    def put(self, object_key, body, content_type=None, cache_control=None, acl='public-read'):
+        with self._lock:
+            self._objects[object_key] = (bytes(body), content_type or 'application/octet-stream', time.time())
+
+    def get(self, object_key):
+        with self._lock:
+            stored = self._objects.get(object_key)
+        return stored[0] if stored else None
+
+    def head(self, object_key):
+        with self._lock:
+            stored = self._objects.get(object_key)
+        return {'size': len(stored[0]), 'content_type': stored[1]} if stored else None
+
+    def delete(self, object_key):
+        with self._lock:
+            self._objects.pop(object_key, None)
+
+    def iter_objects(self, prefix, page_size=1000):
+        with self._lock:
+            items = [
+                {'key': key, 'size': len(body), 'last_modified': created_at}
+                for key, (body, _, created_at) in self._objects.items()
+                if key.startswith(prefix)
+            ]
+        for start in range(0, len(items), page_size):
+            yield items[start:start + page_size]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.name,
+                'objects': len(self._objects),
+                'bytes': sum(len(stored[0]) for stored in self._objects.values())
+            }
+
+
+class WriteThroughBackend(StorageBackend):
+    """طبقة محلية أمام تخزين بعيد: الكتابة للاثنين، والقراءة من القرص أولاً"""
+
+    def __init__(self, remote, local):
+        self.remote = remote
+        self.local = local
+        self.name = f"{remote.name}+local"
+        self.supports_presigned = remote.supports_presigned
+        self.local_hits = 0
+        self.remote_reads = 0
+
+    def put(self, object_key, body, content_type=None, cache_control=None, acl='public-read'):
+        self.remote.put(object_key, body, content_type, cache_control, acl)
+        try:
+            self.local.put(object_key, body, content_type, cache_control, acl)
+        except OSError as e:
+            # الطبقة المحلية اختيارية: فشلها لا يُفشل الرفع
+            logger.warning(f"⚠️ تعذر حفظ {object_key} في الطبقة المحلية: {str(e)}")
+
+    def get(self, object_key):
+        data = self.local.get(object_key)
+        if data is not None:
+            self.local_hits += 1
+            return data
+
+        data = self.remote.get(object_key)
+        self.remote_reads += 1
+        if data is not None:
+            try:
+                self.local.put(object_key, data)
+            except OSError:
+                pass
+        return data
+
+    def head(self, object_key):
+        return self.local.head(object_key) or self.remote.head(object_key)
+
+    def delete(self, object_key):
+        self.remote.delete(object_key)
+        self.local.delete(object_key)
+
+    def local_path(self, object_key):
+        return self.local.local_path(object_key)
+
+    def iter_objects(self, prefix, page_size=1000):
+        return self.remote.iter_objects(prefix, page_size)
+
+    def delete_many(self, object_keys):
+        object_keys = list(object_keys)
+        failed = self.remote.delete_many(object_keys)
+        self.local.delete_many([key for key in object_keys if key not in set(failed)])
+        return failed
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'local_hits': self.local_hits,
+            'remote_reads': self.remote_reads,
+            'local': self.local.stats()
+        }
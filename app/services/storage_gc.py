@@ -0,0 +1,123 @@
+import time
+import logging
+
+from .storage_service import do_storage
+from .qr_store import qr_store
+
+logger = logging.getLogger('salla_app')
+
+GC_PREFIXES = ('qrcodes/', 'shipping-policies/')
+
+# كل الأعمدة التي تحمل روابط كائنات في التخزين
+REFERENCE_QUERIES = (
+    "SELECT qr_code_url, shipping_policy_image, shipping_policy_thumbnail FROM salla_orders",
+    "SELECT qr_code_url FROM custom_orders",
+)
+
+# رموز QR مفاتيحها ثابتة من رقم الطلب، فتُعد مستخدمة لكل طلب موجود حتى لو لم يُحفظ رابطها
+ORDER_ID_QUERIES = (
+    "SELECT id FROM salla_orders",
+    "SELECT CAST(id AS text) FROM custom_orders",
+)
+
+
+def referenced_keys():
+    """مجموعة مفاتيح التخزين المستخدمة في قاعدة البيانات (قراءة بالدفعات دون تحميل الصفوف كاملة)"""
+    from sqlalchemy import text
+    from app.models import db
+
+    keys = set()
+    for query in REFERENCE_QUERIES:
+        result = db.session.execute(text(query), execution_options={'stream_results': True, 'yield_per': 5000})
+        for row in result:
+            for url in row:
+                object_key = do_storage.key_from_url(url)
+                if object_key:
+                    keys.add(object_key)
+
+    for query in ORDER_ID_QUERIES:
+        result = db.session.execute(text(query), execution_options={'stream_results': True, 'yield_per': 5000})
+        for (order_id,) in result:
+            if order_id:
+                keys.add(f"{qr_store.folder}/qr_{qr_store.digest(str(order_id).strip())}.png")
+
+    return keys
+
+
+def collect_garbage(prefixes=GC_PREFIXES, grace_seconds=7 * 86400, dry_run=True, batch_size=1000, sample_size=20):
+    """حذف الكائنات غير المستخدمة والأقدم من مهلة السماح، أو تقرير بها فقط في وضع dry_run"""
+    started = time.time()
+    references = referenced_keys()
+    if not references:
+        # قاعدة فارغة أو استعلام فاشل: لا يُحذف شيء
+        raise RuntimeError('لم يُعثر على أي مراجع في قاعدة البيانات، تم إيقاف التنظيف')
+
+    cutoff = started - grace_seconds
+    report = {
+        'dry_run': dry_run,
+        'referenced': len(references),
+        'prefixes': {}
+    }
+
+    for prefix in prefixes:
+        stats = {'scanned': 0, 'orphaned': 0, 'orphaned_bytes': 0, 'deleted': 0, 'failed': 0, 'sample': []}
+        pending = []
+
+        def flush():
+            failed = do_storage.delete_many(pending)
+            failed_keys = set(failed)
+            for object_key in pending:
+                if object_key not in failed_keys:
+                    qr_store.forget(object_key)
+            stats['deleted'] += len(pending) - len(failed_keys)
+            stats['failed'] += len(failed_keys)
+            pending.clear()
+
+        # صفحة واحدة في الذاكرة، والحذف بدفعات أثناء التصفح
+        for page in do_storage.iter_objects(prefix, page_size=batch_size):
+            for item in page:
+                stats['scanned'] += 1
+                if item['key'] in references or item['last_modified'] > cutoff:
+                    continue
+
+                stats['orphaned'] += 1
+                stats['orphaned_bytes'] += item['size']
+                if len(stats['sample']) < sample_size:
+                    stats['sample'].append(item['key'])
+                if not dry_run:
+                    pending.append(item['key'])
+                    if len(pending) >= batch_size:
+                        flush()
+
+        if pending:
+            flush()
+        report['prefixes'][prefix] = stats
+
+    report['seconds'] = round(time.time() - started, 2)
+    logger.info(
+        f"🧹 تنظيف التخزين{' (تجربة)' if dry_run else ''}: "
+        + ', '.join(f"{prefix} {stats['orphaned']}/{stats['scanned']}" for prefix, stats in report['prefixes'].items())
+    )
+    return report
+
+
+def register_storage_commands(app):
+    """أوامر سطر الأوامر الخاصة بالتخزين"""
+    import json
+    import click
+
+    @app.cli.command('storage-gc')
+    @click.option('--delete', 'delete', is_flag=True, help='حذف الكائنات فعلياً (الافتراضي تقرير فقط)')
+    @click.option('--grace-days', default=None, type=float, help='عدم حذف ما هو أحدث من هذه المدة')
+    @click.option('--prefix', 'prefixes', multiple=True, help='بادئة للفحص (يمكن تكرارها)')
+    def storage_gc(delete, grace_days, prefixes):
+        """حذف كائنات QR والبواليص التي لا يشير إليها أي طلب"""
+        if grace_days is None:
+            grace_days = app.config.get('STORAGE_GC_GRACE_DAYS', 7)
+        with app.app_context():
+            report = collect_garbage(
+                prefixes=prefixes or GC_PREFIXES,
+                grace_seconds=grace_days * 86400,
+                dry_run=not delete
+            )
+        click.echo(json.dumps(report, ensure_ascii=False, indent=2))
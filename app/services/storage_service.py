@@ -1,80 +1,308 @@
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import ClientError, BotoCoreError
 import os
-from flask import current_app
+import io
+import logging
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import current_app, send_file, abort
 from werkzeug.utils import secure_filename
 import uuid
 
+from .storage_backends import S3Backend, LocalFilesystemBackend, MemoryBackend, WriteThroughBackend
+
+logger = logging.getLogger('salla_app')
+
+# أخطاء التخزين المتوقعة من أي واجهة خلفية
+STORAGE_ERRORS = (ClientError, BotoCoreError, OSError, ValueError)
+
+# إعدادات التخزين غير السرية التي تُمرر لعمليات توليد PDF لإنشاء نفس الواجهة الخلفية هناك،
+# ومفاتيح Spaces تقرؤها العملية من متغيرات البيئة مباشرة
+STORAGE_SETTINGS = (
+    'DO_SPACES_BUCKET', 'DO_SPACES_REGION', 'DO_SPACES_ENDPOINT', 'DO_SPACES_PUBLIC_URL',
+    'DO_SPACES_ADDRESSING_STYLE',
+    'STORAGE_BACKEND', 'STORAGE_UPLOAD_WORKERS', 'STORAGE_LOCAL_DIR', 'STORAGE_PUBLIC_URL',
+    'STORAGE_MAX_POOL_CONNECTIONS', 'STORAGE_MAX_ATTEMPTS', 'STORAGE_LOCAL_TIER', 'STORAGE_LOCAL_TIER_MAX_MB',
+    'TESTING', 'DEBUG'
+)
+
 class DigitalOceanStorage:
     def __init__(self):
         self.s3_client = None
+        self.backend = None
         self.bucket_name = None
         self.region = None
+        self.public_base_url = None
+        self.upload_workers = 16
+        self.settings = {}
         
     def init_app(self, app):
         """تهيئة العميل مع التطبيق"""
-        self.bucket_name = app.config.get('DO_SPACES_BUCKET')
-        self.region = app.config.get('DO_SPACES_REGION')
+        self.configure(app.config)
+        
+        if self.backend.name in ('local', 'memory'):
+            # تشغيل بدون شبكة (تطوير واختبارات حمل): الملفات تُخدم من التطبيق نفسه
+            public_path = urllib.parse.urlsplit(self.public_base_url).path.rstrip('/')
+            app.add_url_rule(f"{public_path}/<path:object_key>", 'storage_object', self.serve_object)
+            logger.info(f"📦 التخزين يعمل على الواجهة المحلية: {self.backend.name}")
+    
+    def configure(self, config):
+        """إنشاء الواجهة الخلفية من الإعدادات (تُستدعى أيضاً داخل عمليات توليد PDF بـ settings)"""
+        self.settings = {key: config[key] for key in STORAGE_SETTINGS if key in config}
+        self.bucket_name = config.get('DO_SPACES_BUCKET')
+        self.region = config.get('DO_SPACES_REGION')
+        self.upload_workers = config.get('STORAGE_UPLOAD_WORKERS', self.upload_workers)
+        backend_name = config.get('STORAGE_BACKEND', 's3')
+        
+        if backend_name in ('local', 'memory'):
+            if backend_name == 'local':
+                self.backend = LocalFilesystemBackend(config.get('STORAGE_LOCAL_DIR', '/tmp/storage'))
+            else:
+                # الكائنات داخل عملية واحدة فقط: عمال gunicorn الآخرون وعمليات توليد PDF لا يرونها (404)
+                if not (config.get('TESTING') or config.get('DEBUG')):
+                    raise ValueError("STORAGE_BACKEND='memory' للاختبارات والتطوير بعملية واحدة فقط (TESTING أو DEBUG)")
+                logger.warning("⚠️ تخزين الذاكرة لا يُشارك بين العمليات: استخدم عاملاً واحداً أو STORAGE_BACKEND='local'")
+                self.backend = MemoryBackend()
+            # STORAGE_PUBLIC_URL قد يكون مساراً أو رابطاً كاملاً (http://localhost:5000/storage)
+            self.public_base_url = config.get('STORAGE_PUBLIC_URL', '/storage').rstrip('/')
+            return
+        
+        # نقطة اتصال بديلة متوافقة مع S3 (MinIO مثلاً) للتجربة المحلية
+        endpoint_url = config.get('DO_SPACES_ENDPOINT') or f'https://{self.region}.digitaloceanspaces.com'
+        self.public_base_url = (
+            config.get('DO_SPACES_PUBLIC_URL') or f"https://{self.bucket_name}.{self.region}.digitaloceanspaces.com"
+        ).rstrip('/')
+        
+        # مجمع اتصالات يكفي عمال الرفع المتوازي + إعادة محاولة تكيفية عند التقييد (SlowDown/503)
+        client_config = BotoConfig(
+            max_pool_connections=config.get('STORAGE_MAX_POOL_CONNECTIONS', 32),
+            retries={'max_attempts': config.get('STORAGE_MAX_ATTEMPTS', 5), 'mode': 'adaptive'},
+            s3={'addressing_style': config.get('DO_SPACES_ADDRESSING_STYLE', 'auto')}
+        )
         
         self.s3_client = boto3.client(
             's3',
             region_name=self.region,
-            endpoint_url=f'https://{self.region}.digitaloceanspaces.com',
-            aws_access_key_id=app.config.get('DO_SPACES_KEY'),
-            aws_secret_access_key=app.config.get('DO_SPACES_SECRET')
+            endpoint_url=endpoint_url,
+            aws_access_key_id=config.get('DO_SPACES_KEY') or os.environ.get('DO_SPACES_KEY'),
+            aws_secret_access_key=config.get('DO_SPACES_SECRET') or os.environ.get('DO_SPACES_SECRET'),
+            config=client_config
         )
+        self.backend = S3Backend(self.s3_client, self.bucket_name)
+        
+        # طبقة محلية اختيارية: الكائنات المقروءة كثيراً (QR والبواليص) تُقرأ من القرص
+        if config.get('STORAGE_LOCAL_TIER'):
+            self.backend = WriteThroughBackend(self.backend, LocalFilesystemBackend(
+                config.get('STORAGE_LOCAL_DIR', '/tmp/storage'),
+                max_bytes=int(config.get('STORAGE_LOCAL_TIER_MAX_MB', 1024)) * 1024 * 1024
+            ))
+    
+    @property
+    def supports_presigned(self):
+        """هل تدعم الواجهة الحالية الرفع المباشر بروابط موقّعة؟"""
+        return bool(self.backend and self.backend.supports_presigned)
     
     def upload_file(self, file, folder='shipping-policies'):
         """رفع ملف إلى Spaces"""
         try:
             # توليد اسم فريد للملف
-            filename = secure_filename(file.filename)
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            object_key = f"{folder}/{unique_filename}"
+            object_key = self.unique_key(file.filename, folder)
             
             # رفع الملف
-            self.s3_client.upload_fileobj(
-                file,
-                self.bucket_name,
-                object_key,
-                ExtraArgs={
-                    'ACL': 'public-read',
-                    'ContentType': file.content_type
-                }
-            )
+            self.backend.put(object_key, file.read(), content_type=file.content_type)
             
             # توليد الرابط العام
-            file_url = f"https://{self.bucket_name}.{self.region}.digitaloceanspaces.com/{object_key}"
-            return file_url
+            return self.public_url(object_key)
             
-        except ClientError as e:
+        except STORAGE_ERRORS as e:
             current_app.logger.error(f"خطأ في رفع الملف: {str(e)}")
             return None
 
-    def upload_qr_code(self, file_data, order_id, folder='qrcodes'):
-        """رفع صورة QR Code إلى Spaces"""
+    def public_url(self, object_key):
+        """الرابط العام لكائن في Spaces"""
+        return f"{self.public_base_url}/{object_key}"
+
+    def key_from_url(self, file_url):
+        """استخراج object_key من رابط عام صادر من هذه الخدمة أو None"""
+        if not file_url:
+            return None
+        if file_url.startswith(f"{self.public_base_url}/"):
+            return file_url[len(self.public_base_url) + 1:]
+        if self.backend and self.backend.name in ('local', 'memory'):
+            # روابط الواجهة المحلية قد تصل بمضيف مختلف (نسبية وتُكمل في WeasyPrint مثلاً)
+            public_path = urllib.parse.urlsplit(self.public_base_url).path.rstrip('/')
+            path = urllib.parse.urlsplit(file_url).path
+            if path.startswith(f"{public_path}/"):
+                return urllib.parse.unquote(path[len(public_path) + 1:])
+        if ".digitaloceanspaces.com/" in file_url:
+            return file_url.split(".digitaloceanspaces.com/", 1)[1]
+        return None
+
+    def local_path_for_url(self, file_url):
+        """ملف محلي لرابط صادر من هذه الخدمة (الواجهة المحلية أو طبقة القرص) أو None"""
+        object_key = self.key_from_url(file_url)
+        if not object_key or not self.backend:
+            return None
+        try:
+            return self.backend.local_path(object_key)
+        except ValueError:
+            return None
+
+    def get_bytes(self, object_key):
+        """محتوى كائن كـ bytes أو None"""
+        try:
+            return self.backend.get(object_key)
+        except STORAGE_ERRORS as e:
+            logger.error(f"❌ خطأ في قراءة {object_key}: {str(e)}")
+            return None
+
+    def head(self, object_key):
+        """حجم الكائن ونوعه أو None إن لم يوجد"""
+        try:
+            return self.backend.head(object_key)
+        except STORAGE_ERRORS:
+            return None
+
+    def serve_object(self, object_key):
+        """خدمة كائن من الواجهة المحلية أو الذاكرة (عند عدم استخدام S3)"""
+        path = self.backend.local_path(object_key) if '..' not in object_key else None
+        if path:
+            return send_file(path, max_age=31536000, conditional=True)
+        data = self.get_bytes(object_key)
+        if data is None:
+            abort(404)
+        stored = self.head(object_key) or {}
+        return send_file(io.BytesIO(data), mimetype=stored.get('content_type'), max_age=31536000)
+
+    def presigned_upload(self, object_key, content_type, max_bytes, expires_in=600, method='post'):
+        """رابط رفع موقّع ليرفع المتصفح مباشرة إلى Spaces دون المرور بعمال الخادم.
+        POST يفرض الحجم والنوع في السياسة الموقّعة، و PUT يُتحقق منه عند التأكيد"""
+        if method == 'put':
+            url = self.s3_client.generate_presigned_url(
+                'put_object',
+                Params={
+                    'Bucket': self.bucket_name,
+                    'Key': object_key,
+                    'ContentType': content_type,
+                    'ACL': 'public-read'
+                },
+                ExpiresIn=expires_in
+            )
+            return {
+                'method': 'PUT',
+                'url': url,
+                'headers': {'Content-Type': content_type, 'x-amz-acl': 'public-read'}
+            }
+
+        post = self.s3_client.generate_presigned_post(
+            Bucket=self.bucket_name,
+            Key=object_key,
+            Fields={'acl': 'public-read', 'Content-Type': content_type},
+            Conditions=[
+                {'acl': 'public-read'},
+                {'Content-Type': content_type},
+                ['content-length-range', 1, max_bytes]
+            ],
+            ExpiresIn=expires_in
+        )
+        return {'method': 'POST', 'url': post['url'], 'fields': post['fields']}
+
+    def delete_object(self, object_key):
+        """حذف كائن بمفتاحه"""
         try:
-            # توليد اسم فريد للملف بناءً على رقم الطلب
-            filename = f"qr_{order_id}.png"
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            object_key = f"{folder}/{unique_filename}"
+            self.backend.delete(object_key)
+            return True
+        except STORAGE_ERRORS as e:
+            logger.error(f"❌ خطأ في حذف {object_key}: {str(e)}")
+            return False
+
+    def iter_objects(self, prefix, page_size=1000):
+        """صفحات الكائنات تحت بادئة (صفحة واحدة في الذاكرة في كل مرة)"""
+        return self.backend.iter_objects(prefix, page_size)
+
+    def delete_many(self, object_keys):
+        """حذف دفعة مفاتيح (delete_objects في S3)، ويعيد ما فشل حذفه"""
+        object_keys = list(object_keys)
+        try:
+            return self.backend.delete_many(object_keys)
+        except STORAGE_ERRORS as e:
+            logger.error(f"❌ خطأ في الحذف الجماعي: {str(e)}")
+            return object_keys
+
+    def object_exists(self, object_key):
+        """هل الكائن موجود في Spaces؟"""
+        return self.head(object_key) is not None
+
+    def _put_object(self, item):
+        """رفع كائن واحد من دفعة (بدون سياق التطبيق لأنه يعمل في خيط)"""
+        object_key = item['object_key']
+        try:
+            body = item['body']
+            if hasattr(body, 'read'):
+                body = body.read()
+            self.backend.put(
+                object_key,
+                body,
+                content_type=item.get('content_type'),
+                cache_control=item.get('cache_control'),
+                acl=item.get('acl', 'public-read')
+            )
+            return {'object_key': object_key, 'url': self.public_url(object_key), 'error': None}
+        except STORAGE_ERRORS as e:
+            logger.error(f"❌ خطأ في رفع {object_key}: {str(e)}")
+            return {'object_key': object_key, 'url': None, 'error': str(e)}
+
+    def upload_many(self, items, max_workers=None):
+        """رفع دفعة كائنات بتوازي محدود، كل عنصر: object_key و body ومعه content_type/cache_control اختيارياً.
+        النتائج بنفس ترتيب المدخلات: object_key و url و error"""
+        items = list(items)
+        if not items:
+            return []
+
+        workers = max(1, min(max_workers or self.upload_workers, len(items)))
+        if workers == 1:
+            return [self._put_object(item) for item in items]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self._put_object, items))
+
+    def upload_iter(self, items, max_workers=None):
+        """مثل upload_many لكن يُرجع (فهرس العنصر، النتيجة) فور اكتمال كل رفع لعرض التقدم مباشرة"""
+        items = list(items)
+        if not items:
+            return
+
+        workers = max(1, min(max_workers or self.upload_workers, len(items)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self._put_object, item): index for index, item in enumerate(items)}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    @staticmethod
+    def unique_key(filename, folder='shipping-policies'):
+        """مفتاح فريد لملف مرفوع (نفس تسمية upload_file)"""
+        return f"{folder}/{uuid.uuid4()}_{secure_filename(filename)}"
+
+    def upload_qr_code(self, file_data, order_id, folder='qrcodes', object_key=None):
+        """رفع صورة QR Code إلى Spaces (بمفتاح ثابت عند تمرير object_key)"""
+        try:
+            if not object_key:
+                # توليد اسم فريد للملف بناءً على رقم الطلب
+                filename = f"qr_{order_id}.png"
+                unique_filename = f"{uuid.uuid4()}_{filename}"
+                object_key = f"{folder}/{unique_filename}"
             
             # رفع الملف
-            self.s3_client.upload_fileobj(
-                file_data,
-                self.bucket_name,
+            self.backend.put(
                 object_key,
-                ExtraArgs={
-                    'ACL': 'public-read',
-                    'ContentType': 'image/png'
-                }
+                file_data.read(),
+                content_type='image/png',
+                cache_control='public, max-age=31536000, immutable'
             )
             
-            # توليد الرابط العام
-            file_url = f"https://{self.bucket_name}.{self.region}.digitaloceanspaces.com/{object_key}"
-            return file_url
+            return self.public_url(object_key)
             
-        except ClientError as e:
+        except STORAGE_ERRORS as e:
             current_app.logger.error(f"خطأ في رفع QR Code: {str(e)}")
             return None
     
@@ -82,17 +310,18 @@ class DigitalOceanStorage:
         """حذف ملف من Spaces"""
         try:
             # استخراج object_key من الرابط
-            if f".digitaloceanspaces.com/" in file_url:
-                object_key = file_url.split(f".digitaloceanspaces.com/")[1]
-                self.s3_client.delete_object(
-                    Bucket=self.bucket_name,
-                    Key=object_key
-                )
+            object_key = self.key_from_url(file_url)
+            if object_key:
+                self.backend.delete(object_key)
                 return True
             return False
-        except ClientError as e:
+        except STORAGE_ERRORS as e:
             current_app.logger.error(f"خطأ في حذف الملف: {str(e)}")
             return False
 
+    def stats(self):
+        """إحصائيات الواجهة الخلفية"""
+        return self.backend.stats() if self.backend else {}
+
 # إنشاء نسخة عامة من الخدمة
 do_storage = DigitalOceanStorage()
\ No newline at end of file
@@ -659,9 +659,187 @@ $(document).ready(function () {
         }, 300);
     });
 
+    // 14. التحديثات الحية عبر Server-Sent Events
+    const FLAG_TEXTS = {
+        'late': 'متأخر',
+        'missing': 'واصل ناقص',
+        'refunded': 'مرتجع',
+        'not_shipped': 'لم يشحن'
+    };
+
+    function findOrderRows(orderIds, orderType = 'salla') {
+        return $('#orders-table tbody tr').filter(function () {
+            return orderIds.includes(String($(this).data('order-id'))) &&
+                   ($(this).data('order-type') || 'salla') === orderType;
+        });
+    }
+
+    function flashRow(row) {
+        row.addClass('table-info');
+        setTimeout(() => row.removeClass('table-info'), 2000);
+    }
+
+    function patchStatus(event) {
+        if (!event.status) return;
+        findOrderRows(event.order_ids).each(function () {
+            const row = $(this);
+            const badge = $('<span class="status-badge">')
+                .addClass(`status-${event.status.slug}`)
+                .attr('title', event.status.name)
+                .append('<i class="fas fa-circle me-1 small"></i>')
+                .append(document.createTextNode(event.status.name));
+            row.attr('data-order-status', event.status.slug);
+            row.find('.order-status-cell').empty().append(badge);
+            flashRow(row);
+        });
+    }
+
+    function patchFlag(event) {
+        findOrderRows(event.order_ids).each(function () {
+            const row = $(this);
+            const badge = event.flag === 'custom'
+                ? $('<span class="badge rounded-pill me-1">').css({ 'background-color': event.color, 'color': 'white' }).text(event.name || '')
+                : $('<span class="badge fw-normal me-1">').addClass(`badge-${event.flag}`).text(FLAG_TEXTS[event.flag] || event.flag);
+            row.find('.order-flags-cell').empty().append($('<div class="d-flex align-items-center">').append(badge));
+            flashRow(row);
+        });
+    }
+
+    function patchCustomStatus(event) {
+        findOrderRows(event.order_ids).each(function () {
+            const row = $(this);
+            const badge = $('<span class="badge rounded-pill">')
+                .css({ 'background-color': event.color, 'color': 'white' })
+                .text(event.name || '');
+            row.find('.order-custom-status-cell').empty().append(badge);
+            flashRow(row);
+        });
+    }
+
+    function patchAssignment(event) {
+        findOrderRows(event.order_ids, event.order_type).each(function () {
+            const row = $(this);
+            const cell = row.find('.order-assignee-cell');
+            if (!cell.length) return;
+
+            let group = cell.find('.avatar-group');
+            if (!group.length) {
+                group = $('<div class="avatar-group">');
+                cell.empty().append(group);
+            }
+            const avatar = $('<div class="avatar avatar-xs">')
+                .attr('title', `${event.employee_email} (موظف عام)`)
+                .append($('<span class="avatar-text bg-primary text-white">').text((event.employee_email || '?').charAt(0).toUpperCase()));
+            group.append(avatar);
+            flashRow(row);
+        });
+    }
+
+    function prependCreatedOrder(event) {
+        // إضافة الطلب الجديد فقط في الصفحة الأولى بدون فلاتر
+        const params = new URLSearchParams(window.location.search);
+        const filtered = ['status', 'employee', 'custom_status', 'date_from', 'date_to', 'search'].some(key => params.get(key));
+        if (filtered || (params.get('page') && params.get('page') !== '1')) {
+            showSweetAlert('info', 'طلب جديد', `#${event.reference_id}`);
+            return;
+        }
+        if (findOrderRows(event.order_ids).length) return;
+
+        const orderId = event.order_ids[0];
+        const columns = $('#orders-table thead th').length;
+        const row = $('<tr class="align-middle clickable-row table-success">')
+            .attr({ 'data-order-id': orderId, 'data-order-type': 'salla', 'data-order-status': event.status ? event.status.slug : 'unknown' });
+        row.append($('<td class="ps-4">').append(
+            $('<div class="form-check">').append(
+                $('<input type="checkbox" class="form-check-input order-checkbox" data-type="salla">').val(orderId))));
+        row.append($('<td>').append($('<span class="fw-bold">').text(`#${event.reference_id}`)));
+        row.append($('<td class="d-none d-md-table-cell order-status-cell">'));
+        row.append($('<td class="order-custom-status-cell"><span class="text-muted small">-</span></td>'));
+        row.append($('<td class="d-none d-lg-table-cell">').append($('<span class="text-muted small">').text(event.customer_name || '')));
+        row.append($('<td class="order-flags-cell"><span class="text-muted small">-</span></td>'));
+        row.append($('<td class="d-none d-md-table-cell">').append(
+            $('<span class="time-ago small">').attr('title', event.created_at).text(dayjs(event.created_at).fromNow())));
+        {% if is_reviewer %}
+        row.append($('<td class="d-none d-md-table-cell order-assignee-cell"><span class="badge text-muted">غير مسند</span></td>'));
+        {% endif %}
+        while (row.children().length < columns - 1) {
+            row.append('<td>');
+        }
+        row.append($('<td class="text-end pe-4 actions-cell">').append(
+            $('<a class="btn btn-sm btn-icon btn-outline-primary rounded-circle" title="عرض التفاصيل"><i class="fas fa-eye"></i></a>')
+                .attr('href', `{{ url_for('orders.index') }}${orderId}`)));
+
+        $('#orders-table tbody').prepend(row);
+        patchStatus(event);
+        setTimeout(() => row.removeClass('table-success'), 3000);
+    }
+
+    function connectOrderEvents() {
+        const handlers = {
+            'order_created': prependCreatedOrder,
+            'status_changed': patchStatus,
+            'note_flagged': patchFlag,
+            'custom_status': patchCustomStatus,
+            'assigned': patchAssignment
+        };
+        let pollSince = null;
+
+        function handleEvent(event) {
+            const handler = handlers[event.type];
+            if (!handler) return;
+            try {
+                handler(event);
+            } catch (err) {
+                console.error('خطأ في معالجة حدث الطلبات:', err);
+            }
+        }
+
+        // الخادم يحد عدد اتصالات SSE لكل عامل، وما زاد يعمل بالاستطلاع حتى يتوفر اتصال
+        function pollOrderEvents() {
+            const params = pollSince === null ? {} : { since: pollSince };
+            $.getJSON("{{ url_for('orders.order_events_poll') }}", params)
+                .done(function (data) {
+                    pollSince = data.since;
+                    (data.events || []).forEach(handleEvent);
+                    if (data.stream_available && window.EventSource) {
+                        openStream();
+                    } else {
+                        setTimeout(pollOrderEvents, (data.poll_seconds || 20) * 1000);
+                    }
+                })
+                .fail(function () {
+                    setTimeout(pollOrderEvents, 60000);
+                });
+        }
+
+        function openStream() {
+            const source = new EventSource("{{ url_for('orders.order_events_stream') }}");
+            Object.keys(handlers).forEach(type => {
+                source.addEventListener(type, function (e) {
+                    const event = JSON.parse(e.data);
+                    pollSince = Math.max(pollSince || 0, event.ts || 0);
+                    handleEvent(event);
+                });
+            });
+            source.addEventListener('error', function () {
+                // CLOSED يعني رفض الاتصال (الحد الأقصى أو خطأ)، أما انقطاع البث فيعيد المتصفح الاتصال تلقائياً
+                if (source.readyState === EventSource.CLOSED) {
+                    pollOrderEvents();
+                }
+            });
+        }
+
+        if (window.EventSource) {
+            openStream();
+        } else {
+            pollOrderEvents();
+        }
+    }
+
     // --- التشغيل عند تحميل الصفحة ---
     updateTimestamps();
     updateAssignButtonState();
+    connectOrderEvents();
     toggleQuickListButton();
     
     // تحديث التواريخ كل دقيقة
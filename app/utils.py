@@ -1,9 +1,7 @@
 from datetime import datetime
 import os
 import re
-import base64
 import logging
-from io import BytesIO
 from contextlib import contextmanager
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from threading import Lock
@@ -14,11 +12,9 @@ from urllib3.util.retry import Retry
 from flask import current_app, request
 from sqlalchemy import text, create_engine
 from sqlalchemy.pool import QueuePool
-import qrcode
-from qrcode.image.pil import PilImage
 
 from .models import db, User, Employee, CustomOrder, SallaOrder
-from .services.storage_service import do_storage
+from .services.qr_store import qr_store
 from .config import Config
 
 # إعداد المسجل
@@ -154,37 +150,9 @@ def clean_data(data: str) -> str:
 
 
 def generate_barcode(data, dpi=300):
-    """إنشاء QR Code"""
+    """إنشاء QR Code (من المخزن الثابت: رسم ورفع مرة واحدة لكل قيمة)"""
     try:
-        data_str = str(data).strip()
-        if not data_str:
-            return None
-
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(data_str)
-        qr.make(fit=True)
-
-        img = qr.make_image(fill_color="black", back_color="white")
-        buffer = BytesIO()
-        img.save(buffer, format='PNG', optimize=True)
-        buffer.seek(0)
-
-        qr_code_url = do_storage.upload_qr_code(buffer, data_str, folder='qrcodes')
-        
-        if qr_code_url:
-            logger.info(f"QR Code generated and uploaded successfully for: {data_str}")
-            return qr_code_url
-        else:
-            logger.error(f"Failed to upload QR Code for: {data_str}")
-            buffer.seek(0)
-            qr_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            return f"data:image/png;base64,{qr_base64}"
-
+        return qr_store.get_url(data)
     except Exception as e:
         logger.error(f"Error generating QR code: {str(e)}")
         return None
@@ -538,61 +506,40 @@ def process_order_data(order_id, items_data, qr_code_url=None, store_id=None):
         return None
 
 
-def bulk_generate_and_store_qr_codes(order_ids, order_type='salla', store_id=None):
-    """إنشاء وتخزين QR Codes بشكل مجمع"""
+def bulk_generate_and_store_qr_codes(order_ids, order_type='salla', store_id=None, max_workers=None, only_missing=False):
+    """إنشاء وتخزين QR Codes بشكل مجمع (only_missing: فقط طلبات سلة التي لا تملك رابطاً محفوظاً)"""
     try:
         if not order_ids:
             logger.warning("No order IDs provided for bulk QR code generation")
             return {}
         
-        logger.info(f"Starting bulk QR code generation for {len(order_ids)} orders, type: {order_type}")
-        
-        qr_codes_map = {}
-        records_to_update = []
-        lock = Lock()
-        
-        def generate_single_qr_code(order_id):
-            order_id_str = str(order_id).strip()
-            if not order_id_str:
-                return None, None
-                
-            try:
-                qr_code_url = generate_barcode(order_id_str)
-                
-                if qr_code_url:
-                    with lock:
-                        records_to_update.append({
-                            'id': order_id_str,
-                            'qr_code_url': qr_code_url,
-                            'barcode_generated_at': datetime.utcnow(),
-                            'store_id': store_id
-                        })
-                    return order_id_str, qr_code_url
-                return order_id_str, None
-                    
-            except Exception as e:
-                logger.error(f"Error generating QR code for {order_id_str}: {str(e)}")
-                return order_id_str, None
+        if only_missing:
+            order_ids = _orders_without_qr_code(order_ids)
+            if not order_ids:
+                return {}
         
-        # استخدام ThreadPoolExecutor لإنشاء QR Codes بشكل متزامن
-        successful_generations = 0
-        failed_generations = 0
+        logger.info(f"Starting bulk QR code generation for {len(order_ids)} orders, type: {order_type}")
         
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            future_to_id = {executor.submit(generate_single_qr_code, order_id): order_id for order_id in order_ids}
-            
-            for future in as_completed(future_to_id):
-                order_id_str, qr_code_url = future.result()
-                if qr_code_url:
-                    qr_codes_map[order_id_str] = qr_code_url
-                    successful_generations += 1
-                else:
-                    failed_generations += 1
+        # الرسم محلي والرفع دفعة واحدة بتوازي محدود عبر upload_many، وما فشل رفعه لا يظهر في النتيجة
+        qr_codes_map = qr_store.get_urls(order_ids, max_workers=max_workers)
+        generated_at = datetime.utcnow()
+        records_to_update = [
+            {
+                'id': order_id_str,
+                'qr_code_url': qr_code_url,
+                'barcode_generated_at': generated_at,
+                'store_id': store_id
+            }
+            for order_id_str, qr_code_url in qr_codes_map.items()
+        ]
         
-        logger.info(f"QR code generation completed: {successful_generations} successful, {failed_generations} failed")
+        logger.info(f"QR code generation completed: {len(qr_codes_map)} successful, {len(order_ids) - len(qr_codes_map)} failed")
         
-        # تخزين مجمع في PostgreSQL
-        if records_to_update:
+        # تخزين مجمع في PostgreSQL: بدون store_id لا يمكن إنشاء طلب سلة (العمود NOT NULL)،
+        # فالطلبات موجودة مسبقاً وتكفيها جملة UPDATE واحدة بدلاً من الإدراج مع التعارض
+        if records_to_update and order_type == 'salla' and store_id is None:
+            _bulk_update_existing_qr_codes(qr_codes_map, generated_at)
+        elif records_to_update:
             _bulk_store_qr_codes(records_to_update, order_type)
         
         logger.info(f"Final QR codes map contains {len(qr_codes_map)} entries")
@@ -603,6 +550,44 @@ def bulk_generate_and_store_qr_codes(order_ids, order_type='salla', store_id=Non
         return {}
 
 
+def _orders_without_qr_code(order_ids):
+    """طلبات سلة من القائمة التي لم يُحفظ لها رابط QR بعد"""
+    order_ids_str = sorted({str(oid).strip() for oid in order_ids if str(oid).strip()})
+    if not order_ids_str:
+        return []
+    
+    with app_context():
+        engine = get_postgres_engine()
+        with engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT id FROM salla_orders
+                WHERE id = ANY(:order_ids) AND qr_code_url IS NULL
+            """), {'order_ids': order_ids_str}).fetchall()
+    return [str(row[0]) for row in rows]
+
+
+def _bulk_update_existing_qr_codes(qr_codes_map, generated_at):
+    """حفظ روابط QR لطلبات سلة موجودة بجملة UPDATE واحدة، دون استبدال رابط حُفظ في الأثناء"""
+    try:
+        with app_context():
+            engine = get_postgres_engine()
+            with engine.begin() as conn:
+                result = conn.execute(text("""
+                    UPDATE salla_orders AS o
+                    SET qr_code_url = v.qr_code_url,
+                        barcode_generated_at = :generated_at
+                    FROM unnest(CAST(:order_ids AS text[]), CAST(:qr_code_urls AS text[])) AS v(id, qr_code_url)
+                    WHERE o.id = v.id AND o.qr_code_url IS NULL
+                """), {
+                    'order_ids': list(qr_codes_map.keys()),
+                    'qr_code_urls': list(qr_codes_map.values()),
+                    'generated_at': generated_at
+                })
+                logger.info(f"Successfully stored {result.rowcount} QR codes in database")
+    except Exception as e:
+        logger.error(f"Error in bulk QR code update: {str(e)}")
+
+
 def _bulk_store_qr_codes(records_to_update, order_type):
     """تخزين مجمع لرموز QR في قاعدة البيانات"""
     try:
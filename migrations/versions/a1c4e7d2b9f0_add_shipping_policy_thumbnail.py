@@ -0,0 +1,26 @@
+"""add salla_orders.shipping_policy_thumbnail
+
+Revision ID: a1c4e7d2b9f0
+Revises: 
+Create Date: 2026-10-19 09:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1c4e7d2b9f0'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # أول ترحيل في المشروع: باقي الجداول ينشئها db.create_all، وقواعد البيانات الجديدة
+    # قد تحتوي العمود مسبقاً لذلك الإضافة مشروطة
+    op.execute("ALTER TABLE salla_orders ADD COLUMN IF NOT EXISTS shipping_policy_thumbnail VARCHAR(500)")
+
+
+def downgrade():
+    op.drop_column('salla_orders', 'shipping_policy_thumbnail')
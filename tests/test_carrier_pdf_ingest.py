@@ -0,0 +1,22 @@
+import pytest
+
+from app.services.carrier_pdf_ingest import extract_order_number
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('AWB 219876543 Ref 123456789', '219876543'),
+    ('PCs: 1\n234567890\nCOD', '234567890'),
+    ('Pcs:\n  ORD-345678901', '345678901'),
+    ('Ship Date 2024-01-05 Ref 456789012', '456789012'),
+    ('WGT 1.5 KG\n567890123', '567890123'),
+    ('رقم الطلب ٢٣٤٥٦٧٨٩٠', '234567890'),
+    ('Order 2345678 Riyadh', '2345678'),
+    ('Tracking 1234567890123', '1234567890123'),
+])
+def test_extract_order_number(text, expected):
+    assert extract_order_number(text) == expected
+
+
+@pytest.mark.parametrize('text', [None, '', 'No digits here', 'Zip 12345'])
+def test_extract_order_number_without_match(text):
+    assert extract_order_number(text) is None
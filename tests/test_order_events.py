@@ -0,0 +1,40 @@
+import json
+
+from app.services.invalidation_bus import invalidation_bus
+from app.services.order_events import (
+    MAX_IDS_PER_EVENT, ORDER_EVENTS_TOPIC, STATUS_CHANGED, OrderEventBroker
+)
+
+
+def capture_events(monkeypatch):
+    published = []
+    monkeypatch.setattr(
+        invalidation_bus, 'publish_event',
+        lambda store_id, topic, data: published.append((store_id, topic, data))
+    )
+    return published
+
+
+def test_publish_splits_large_batches(monkeypatch):
+    published = capture_events(monkeypatch)
+    order_ids = [str(100000000 + i) for i in range(MAX_IDS_PER_EVENT * 2 + 7)]
+
+    OrderEventBroker().publish(42, STATUS_CHANGED, order_ids, city='', status_id=5)
+
+    assert [len(data['order_ids']) for _, _, data in published] == [MAX_IDS_PER_EVENT, MAX_IDS_PER_EVENT, 7]
+    assert [order_id for _, _, data in published for order_id in data['order_ids']] == order_ids
+    for store_id, topic, data in published:
+        assert (store_id, topic) == (42, ORDER_EVENTS_TOPIC)
+        assert data['type'] == STATUS_CHANGED and data['status_id'] == 5
+        # يجب أن تبقى كل دفعة تحت حد NOTIFY في PostgreSQL
+        assert len(json.dumps(data).encode('utf-8')) < 8000
+
+
+def test_publish_skips_empty_batches(monkeypatch):
+    published = capture_events(monkeypatch)
+    broker = OrderEventBroker()
+
+    broker.publish(42, STATUS_CHANGED, [None], city='')
+    broker.publish(None, STATUS_CHANGED, ['1'], city='')
+
+    assert published == []
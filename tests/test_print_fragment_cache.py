@@ -0,0 +1,60 @@
+import os
+
+from jinja2 import DictLoader, Environment
+
+from app.services.print_fragment_cache import PrintFragmentCache
+
+
+def make_cache(tmp_path, templates=None, max_bytes=1024):
+    cache = PrintFragmentCache(cache_dir=str(tmp_path / 'fragments'), max_bytes=max_bytes)
+    cache.enabled = True
+    cache._jinja_env = Environment(loader=DictLoader(templates or {'order.html': '<p>{{ order.id }}</p>'}))
+    return cache
+
+
+def write_pdf(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b'0' * size)
+    return str(path)
+
+
+def test_key_depends_on_payload_and_template(tmp_path):
+    cache = make_cache(tmp_path)
+    payload = {'id': '1001', 'items': [{'sku': 'A', 'quantity': 2}]}
+
+    key = cache.key('order.html', payload)
+    assert key == cache.key('order.html', dict(reversed(list(payload.items()))))
+    assert key != cache.key('order.html', {**payload, 'id': '1002'})
+
+    changed = make_cache(tmp_path, {'order.html': '<div>{{ order.id }}</div>'})
+    assert key != changed.key('order.html', payload)
+
+
+def test_put_and_get(tmp_path):
+    cache = make_cache(tmp_path)
+    key = cache.key('order.html', {'id': '1001'})
+    source = write_pdf(tmp_path, 'page.pdf', 10)
+
+    assert cache.get(key) is None
+    path = cache.put(key, source)
+
+    assert not os.path.exists(source)
+    assert cache.get(key) == path
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=1000)
+    paths = {}
+    for index, order_id in enumerate(('1', '2', '3')):
+        key = cache.key('order.html', {'id': order_id})
+        paths[order_id] = cache.put(key, write_pdf(tmp_path, f'{order_id}.pdf', 400))
+        os.utime(paths[order_id], (1000 + index, 1000 + index))
+
+    # استخدام الأقدم يجعله الأحدث فلا يُحذف
+    assert cache.get(cache.key('order.html', {'id': '1'})) == paths['1']
+
+    assert cache.evict() == 1
+    assert not os.path.exists(paths['2'])
+    assert os.path.exists(paths['1']) and os.path.exists(paths['3'])
+    assert cache.evict() == 0
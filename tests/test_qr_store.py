@@ -0,0 +1,42 @@
+from app.services.qr_store import QrCodeStore
+from app.services.storage_backends import MemoryBackend
+from app.services.storage_service import do_storage
+
+
+def use_memory_storage(monkeypatch):
+    backend = MemoryBackend()
+    monkeypatch.setattr(do_storage, 'backend', backend)
+    monkeypatch.setattr(do_storage, 'public_base_url', 'http://storage.test')
+    return backend
+
+
+def test_digest_is_deterministic():
+    assert QrCodeStore.digest('1001') == QrCodeStore.digest('1001')
+    assert QrCodeStore.digest('1001') != QrCodeStore.digest('1002')
+    assert len(QrCodeStore.digest('1001')) == 32
+
+
+def test_get_url_uses_stable_key_and_uploads_once(tmp_path, monkeypatch):
+    backend = use_memory_storage(monkeypatch)
+    store = QrCodeStore(cache_dir=str(tmp_path))
+    object_key = f"qrcodes/qr_{QrCodeStore.digest('1001')}.png"
+
+    url = store.get_url(' 1001 ')
+    assert url == f"http://storage.test/{object_key}"
+    assert backend.head(object_key)['content_type'] == 'image/png'
+    assert store.get_url('1001') == url
+    assert store.uploads == 1 and store.hits == 1
+
+    # عامل آخر على نفس الخادم يقرأ الرابط من القرص دون رفع
+    other = QrCodeStore(cache_dir=str(tmp_path))
+    assert other.get_urls(['1001']) == {'1001': url}
+    assert other.uploads == 0
+    assert other.path_for_url(url) == other.local_path(QrCodeStore.digest('1001'))
+
+
+def test_get_urls_matches_get_url(tmp_path, monkeypatch):
+    use_memory_storage(monkeypatch)
+    bulk = QrCodeStore(cache_dir=str(tmp_path / 'bulk')).get_urls(['1001', '1002', '1001', ''])
+    single = QrCodeStore(cache_dir=str(tmp_path / 'single'))
+
+    assert bulk == {'1001': single.get_url('1001'), '1002': single.get_url('1002')}
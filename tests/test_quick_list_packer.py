@@ -0,0 +1,49 @@
+from app.orders.print_utils import QUICK_LIST_ORDER_FIELDS, QuickListPacker
+
+
+def unpack(tables, rows):
+    """فك الصيغة المضغوطة كما تفعل صفحة القائمة السريعة"""
+    appearances = []
+    for order_index, quantity, option_indexes, notes in rows:
+        appearance = dict(zip(tables['order_fields'], tables['orders'][order_index]))
+        appearance.update(
+            quantity=quantity,
+            options=[dict(zip(('name', 'value', 'type'), tables['options'][index])) for index in option_indexes],
+            notes=notes
+        )
+        appearances.append(appearance)
+    return appearances
+
+
+def make_appearance(order_id, quantity, options, notes=''):
+    appearance = {field: f'{field}-{order_id}' for field in QUICK_LIST_ORDER_FIELDS}
+    appearance.update(order_id=order_id, quantity=quantity, options=options, notes=notes)
+    return appearance
+
+
+def test_pack_groups_round_trip():
+    size = {'name': 'المقاس', 'value': 'L', 'type': 'radio'}
+    color = {'name': 'اللون', 'value': 'أسود', 'type': 'radio'}
+    appearances_by_sku = {
+        'SKU-1': [make_appearance('1001', 2, [size, color], 'تغليف هدية'), make_appearance('1002', 1, [size])],
+        'SKU-2': [make_appearance('1001', 3, [color])],
+    }
+
+    packer = QuickListPacker()
+    packed = packer.pack_groups(appearances_by_sku)
+    tables = packer.tables()
+
+    assert tables['format'] == 'compact'
+    assert {sku: unpack(tables, rows) for sku, rows in packed.items()} == appearances_by_sku
+    # كل طلب وكل خيار يُرسل مرة واحدة فقط
+    assert len(tables['orders']) == 2
+    assert len(tables['options']) == 2
+
+
+def test_pack_fills_missing_fields():
+    packer = QuickListPacker()
+    row = packer.pack({'order_id': 1001, 'options': ['نص قديم', {'name': 'المقاس', 'value': 'M'}]})
+
+    assert row == [0, 0, [0], '']
+    assert packer.orders == [[1001 if field == 'order_id' else '' for field in QUICK_LIST_ORDER_FIELDS]]
+    assert packer.options == [['المقاس', 'M', '']]
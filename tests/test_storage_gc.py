@@ -0,0 +1,92 @@
+import pytest
+
+from app.models import db
+from app.services import storage_gc
+from app.services.qr_store import qr_store
+from app.services.storage_backends import MemoryBackend
+from app.services.storage_service import do_storage
+
+BASE_URL = 'http://storage.test/storage'
+
+
+class FakeSession:
+    """جلسة تعيد صفوفاً ثابتة لكل استعلام مراجع"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, statement, execution_options=None):
+        return iter(self.rows.get(str(statement), []))
+
+
+def use_storage(monkeypatch, rows):
+    backend = MemoryBackend()
+    monkeypatch.setattr(do_storage, 'backend', backend)
+    monkeypatch.setattr(do_storage, 'public_base_url', BASE_URL)
+    monkeypatch.setattr(db, 'session', FakeSession(rows))
+    return backend
+
+
+def qr_key(order_id):
+    return f"{qr_store.folder}/qr_{qr_store.digest(order_id)}.png"
+
+
+REFERENCE_ROWS = {
+    storage_gc.REFERENCE_QUERIES[0]: [
+        (f'{BASE_URL}/qrcodes/old_1001.png', f'{BASE_URL}/shipping-policies/a.pdf', f'{BASE_URL}/shipping-policies/a.jpg'),
+        (None, 'https://elsewhere.test/b.pdf', None),
+    ],
+    storage_gc.REFERENCE_QUERIES[1]: [(f'{BASE_URL}/qrcodes/custom_7.png',)],
+    storage_gc.ORDER_ID_QUERIES[0]: [('1001',), (None,)],
+    storage_gc.ORDER_ID_QUERIES[1]: [('7',)],
+}
+
+
+def test_referenced_keys(monkeypatch):
+    use_storage(monkeypatch, REFERENCE_ROWS)
+
+    assert storage_gc.referenced_keys() == {
+        'qrcodes/old_1001.png',
+        'shipping-policies/a.pdf',
+        'shipping-policies/a.jpg',
+        'qrcodes/custom_7.png',
+        qr_key('1001'),
+        qr_key('7'),
+    }
+
+
+def test_collect_garbage_dry_run_then_delete(monkeypatch):
+    backend = use_storage(monkeypatch, REFERENCE_ROWS)
+    for object_key in (qr_key('1001'), 'qrcodes/orphan.png', 'shipping-policies/a.pdf', 'shipping-policies/orphan.pdf'):
+        backend.put(object_key, b'data')
+    # كائن غير مستخدم لكنه أحدث من مهلة السماح
+    backend.put('shipping-policies/recent.pdf', b'data')
+    for object_key, (body, content_type, _) in list(backend._objects.items()):
+        if object_key != 'shipping-policies/recent.pdf':
+            backend._objects[object_key] = (body, content_type, 0)
+
+    report = storage_gc.collect_garbage(grace_seconds=3600, dry_run=True)
+
+    assert report['dry_run'] is True
+    assert report['prefixes']['qrcodes/']['scanned'] == 2
+    assert report['prefixes']['qrcodes/']['sample'] == ['qrcodes/orphan.png']
+    assert report['prefixes']['shipping-policies/']['orphaned'] == 1
+    assert report['prefixes']['shipping-policies/']['orphaned_bytes'] == 4
+    assert all(stats['deleted'] == 0 for stats in report['prefixes'].values())
+    assert backend.stats()['objects'] == 5
+
+    report = storage_gc.collect_garbage(grace_seconds=3600, dry_run=False)
+
+    assert sum(stats['deleted'] for stats in report['prefixes'].values()) == 2
+    assert backend.head('qrcodes/orphan.png') is None
+    assert backend.head('shipping-policies/orphan.pdf') is None
+    assert backend.stats()['objects'] == 3
+
+
+def test_collect_garbage_refuses_without_references(monkeypatch):
+    backend = use_storage(monkeypatch, {})
+    backend.put('qrcodes/orphan.png', b'data')
+
+    with pytest.raises(RuntimeError):
+        storage_gc.collect_garbage(dry_run=False)
+    assert backend.head('qrcodes/orphan.png') is not None